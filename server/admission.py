@@ -0,0 +1,149 @@
+# server/admission.py
+# Admission control for LLM-bound work (asyncio)
+# -----------------------------------------------------------------------
+# - At most max_concurrent holders of a slot; everyone else waits in a
+#   bounded queue instead of piling onto the upstream API
+# - Waiters are queued per client (IP / API key / phone number) and served
+#   round-robin, so one noisy client cannot starve the rest
+# - Full queue -> Rejected(503); too many queued for one client -> Rejected(429);
+#   waited longer than max_wait -> Rejected(503). Each carries a Retry-After
+#   estimate derived from recent service times
+# - stats(): in-flight, queue depth, wait / service time percentiles, rejections
+
+from __future__ import annotations
+
+import math
+import time
+import asyncio
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List
+
+class Rejected(Exception):
+    """Raised instead of queueing; map to an HTTP status with a Retry-After header."""
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class AdmissionController:
+    """Concurrency limiter with a bounded, per-client fair wait queue."""
+    def __init__(self, name: str, max_concurrent: int = 8, max_queue: int = 64,
+                 max_queue_per_client: int = 4, max_wait: float = 30.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self._active = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()  # client -> waiters
+        self._queued = 0
+        self._waits: Deque[float] = deque(maxlen=1000)     # seconds, admitted requests
+        self._services: Deque[float] = deque(maxlen=1000)  # seconds a slot was held
+        self.admitted = 0
+        self.max_depth = 0
+        self.rejected: Counter = Counter()
+
+    # --- acquire / release ---------------------------------------------------
+    def retry_after(self) -> int:
+        """Seconds until a queued request would likely get a slot."""
+        service = sum(self._services) / len(self._services) if self._services else 1.0
+        return max(1, math.ceil(service * (self._queued + 1) / max(1, self.max_concurrent)))
+
+    def _reject(self, status: int, reason: str) -> Rejected:
+        self.rejected[reason] += 1
+        return Rejected(status, reason, self.retry_after())
+
+    async def acquire(self, client: str) -> None:
+        t0 = time.perf_counter()
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self._admit(t0)
+            return
+        if self._queued >= self.max_queue:
+            raise self._reject(503, "queue full")
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= self.max_queue_per_client:
+            raise self._reject(429, "too many queued requests for this client")
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(fut)
+        self._queued += 1
+        self.max_depth = max(self.max_depth, self._queued)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._drop(client, fut):  # granted just as we timed out: hand it back
+                self.release(held=0.0)
+            raise self._reject(503, "queue wait timeout")
+        except BaseException:  # caller went away
+            if not self._drop(client, fut):
+                self.release(held=0.0)
+            raise
+        self._admit(t0)
+
+    def _admit(self, t0: float) -> None:
+        self.admitted += 1
+        self._waits.append(time.perf_counter() - t0)
+
+    def _drop(self, client: str, fut: asyncio.Future) -> bool:
+        """Remove a waiter that gave up; False if it had already been granted a slot."""
+        queue = self._queues.get(client)
+        if fut.done() or queue is None or fut not in queue:
+            return False
+        queue.remove(fut)
+        self._queued -= 1
+        if not queue:
+            del self._queues[client]
+        return True
+
+    def release(self, held: float | None = None) -> None:
+        if held is not None and held > 0:
+            self._services.append(held)
+        self._active -= 1
+        while self._active < self.max_concurrent and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            fut = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(client)  # round-robin across clients
+            else:
+                del self._queues[client]
+            if not fut.done():
+                self._active += 1
+                fut.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, client: str) -> AsyncIterator[None]:
+        await self.acquire(client)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(held=time.perf_counter() - t0)
+
+    # --- metrics -------------------------------------------------------------
+    def stats(self) -> Dict:
+        waits, services = list(self._waits), list(self._services)
+        return {
+            "name": self.name,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self._active,
+            "queue_depth": self._queued,
+            "queue_max_depth": self.max_depth,
+            "queue_limit": self.max_queue,
+            "queued_clients": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_ms": {"p50": round(_pct(waits, 0.5) * 1000, 1), "p95": round(_pct(waits, 0.95) * 1000, 1),
+                        "max": round(max(waits, default=0.0) * 1000, 1)},
+            "service_ms": {"p50": round(_pct(services, 0.5) * 1000, 1),
+                           "p95": round(_pct(services, 0.95) * 1000, 1)},
+            "retry_after_s": self.retry_after(),
+        }
@@ -0,0 +1,142 @@
+# server/answer_cache.py
+# Bounded answer cache for /chat -- LRU + TTL, optional SQLite backing
+# -----------------------------------------------------------------------
+# - Keyed on (normalised query tokens, retrieved chunk ids, model, temperature, top_p)
+# - Entries belong to one index version; set_version() with a new version drops
+#   everything (memory and disk), so a rebuilt index never serves stale answers
+# - With a db_path, entries are written through to SQLite and survive restarts
+#   (as long as the index version is unchanged)
+# - Stores the raw LLM answer; callers apply per-request post-processing
+
+from __future__ import annotations
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+def cache_key(query_tokens: List[str], chunk_ids: List[str], model: str,
+              temperature: float, top_p: float) -> str:
+    raw = json.dumps([query_tokens, chunk_ids, model, round(temperature, 4), round(top_p, 4)],
+                     ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """LRU over at most max_entries answers, each valid for ttl seconds."""
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400.0,
+                 db_path: str | None = None, disk_max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.version: str | None = None
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._puts = 0
+        self.hits = self.misses = self.disk_hits = 0
+        self.evictions = self.expirations = self.invalidations = 0
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS answers ("
+                             "key TEXT PRIMARY KEY, version TEXT, answer TEXT, expires REAL, created REAL)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def set_version(self, version: str) -> None:
+        """Bind to an index version; a different one invalidates every cached answer."""
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.invalidations += 1
+            self.version = version
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers WHERE version != ? OR expires < ?", (version, time.time()))
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._mem[key]
+                self.expirations += 1
+            if self._db is not None:
+                row = self._db.execute("SELECT answer, expires FROM answers WHERE key = ? AND version = ? AND expires > ?",
+                                       (key, self.version, now)).fetchone()
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, answer: str, version: str | None = None) -> None:
+        """Store an answer; dropped if the index version moved on while it was generated."""
+        if not self.enabled or not answer:
+            return
+        now = time.time()
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._remember(key, now + self.ttl, answer)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO answers (key, version, answer, expires, created) "
+                                 "VALUES (?, ?, ?, ?, ?)", (key, self.version, answer, now + self.ttl, now))
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._prune_disk(now)
+
+    def _remember(self, key: str, expires: float, answer: str) -> None:
+        self._mem[key] = (expires, answer)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self, now: float) -> None:
+        self._db.execute("DELETE FROM answers WHERE expires < ?", (now,))
+        self._db.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY created DESC "
+                         "LIMIT -1 OFFSET ?)", (self.disk_max_entries,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            out = {
+                "enabled": self.enabled,
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "persistent": self._db is not None,
+            }
+            if self._db is not None:
+                out["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            return out
@@ -3,9 +3,26 @@
 # -----------------------------------------------------------------------
 # - Centralised paths (_effective_paths)
 # - TXT corpus loader + CHUNKED BM25 retriever (sharp policy lookup)
-# - /chat supports k, temperature, top_p tuning
+# - /chat supports k, temperature, top_p tuning; "stream": true for SSE tokens
+# - /chat is async on one shared, pooled AsyncOpenAI client
+# - Answer cache (LRU/TTL, optional SQLite) in front of the OpenAI call
+# - Identical concurrent /chat requests are coalesced onto one generation
+# - Admission control: bounded concurrency + fair per-client queue in front of
+#   generation; overload gets a fast 429/503 with Retry-After
+# - Retrieved chunks are merged, de-duplicated and packed into a token budget
+#   before prompting (server/context_packer.py)
+# - Optional hybrid retrieval: BM25 + local vector ANN (Chroma dir), fused with
+#   reciprocal-rank fusion; mode per request ("bm25" | "vector" | "hybrid")
 # - /debug/retrieve for retrieval inspection
-# - /admin/reindex to rebuild the in-memory index after TXT changes
+# - /debug/retrieve_batch + retrieve_many() for vectorised bulk scoring
+# - /admin/reindex queues a background rebuild (incremental, per-file manifest)
+#   and hot-swaps the index under a new generation; optional polling via
+#   INDEX_POLL_SECONDS
+# - Index snapshot under runtime/index (mmapped; skips re-parsing on restart)
+# - Chunks stored compactly: one corpus buffer + interned token ids
+#   (server/chunk_store.py); /admin/memory reports bytes per chunk
+# - /metrics in Prometheus text format (per-stage latency, tokens, index);
+#   Server-Timing header on /chat responses
 # - Serves /static and /brand.json for the desktop wrapper
 #
 # Dev run:
@@ -14,28 +31,59 @@
 
 from __future__ import annotations
 
+import io
 import os
 import re
 import json
 import time
 import math
+import heapq
 import random
-from dataclasses import dataclass
+import hashlib
+import threading
+import copy
+from array import array
+from dataclasses import dataclass, field
 from pathlib import Path
-from collections import Counter
-from typing import Callable, Dict, List, Tuple
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Tuple
 
 # --- FastAPI & static serving -------------------------------------------------
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-# --- OpenAI minimal wrapper (official SDK v1) ---------------------------------
+# --- Vectorised scoring (optional; falls back to the pure-Python index) -------
 try:
-    from openai import OpenAI
+    import numpy as np
+    from scipy import sparse
 except Exception:
-    OpenAI = None  # clear error if SDK missing
+    np = None
+    sparse = None
+
+from server import index_snapshot
+from server.chunk_store import Chunk, ChunkStore, Vocab, memory_report
+
+# --- Local embeddings + ANN for hybrid retrieval (optional) -------------------
+try:
+    from server import vector_index
+except Exception:
+    vector_index = None
+from server.answer_cache import AnswerCache, cache_key
+from server.context_packer import TokenCounter, pack_context
+from server.single_flight import Flight, SingleFlight
+from server.admission import AdmissionController, Rejected
+from server.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+# --- OpenAI minimal wrapper (official SDK v1, async) --------------------------
+try:
+    import httpx
+    from openai import AsyncOpenAI
+except Exception:
+    AsyncOpenAI = None  # clear error if SDK missing
 
 # ============================================================================
 # 1) PATHS & FILE IO
@@ -57,6 +105,7 @@ def _effective_paths() -> Dict[str, str]:
         "root": str(root),
         "txt_dir": str(chosen_txt),            # <- retrieval reads from here
         "chroma_dir": str(root / "db" / "chroma"),
+        "index_dir": str(root / "runtime" / "index"),  # <- BM25 snapshots
     }
 
 def _read_txt_files(txt_dir: Path) -> List[Tuple[str, str]]:
@@ -74,20 +123,43 @@ def _read_txt_files(txt_dir: Path) -> List[Tuple[str, str]]:
             pass
     return docs
 
+def _load_txt_file(p: Path) -> Tuple[str, Dict]:
+    """
+    Read one corpus file; return (text, manifest entry).
+    Text matches _read_txt_files() (utf-8, errors ignored, universal newlines, stripped).
+    """
+    st = p.stat()
+    data = p.read_bytes()
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", errors="ignore").read().strip()
+    entry = {"sha256": hashlib.sha256(data).hexdigest(), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return text, entry
+
 # ============================================================================
 # 2) CHUNKED BM25 RETRIEVER  (replaces old cosine BoW)
 # ============================================================================
-@dataclass
-class Chunk:
-    source: str      # original filename
-    text: str        # chunk text
-    tokens: List[str]
+CHUNK_MAX_CHARS = 1200
+CHUNK_OVERLAP = 200
+BM25_K1, BM25_B = 1.5, 0.75
+_TOKEN_PATTERN = r"[a-z0-9][a-z0-9\-]+"
+# Persist/reuse the built index across restarts (set false to always rebuild)
+INDEX_SNAPSHOT = os.getenv("INDEX_SNAPSHOT", "true").lower() == "true"
+# Memoised retrievals per index generation (entries; 0 = off)
+RETRIEVAL_MEMO_SIZE = int(os.getenv("RETRIEVAL_MEMO_SIZE", "2048"))
+# Poll the TXT dir and apply changes automatically every N seconds (0 = off)
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "0"))
+# Vector side of hybrid retrieval: "" disables it; "hashing" is the deterministic
+# offline embedder, "chroma-default" / "st:<model>" are real local CPU models
+VECTOR_EMBEDDER = os.getenv("VECTOR_EMBEDDER", "")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "bm25")   # default when a request names none
+RETRIEVAL_MODES = ("bm25", "vector", "hybrid")
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", "30"))    # candidates per ranker before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
 
 def _tokenise_norm(s: str) -> List[str]:
     """Lowercase alnum/hyphen tokens for robust matching."""
-    return re.findall(r"[a-z0-9][a-z0-9\-]+", s.lower())
+    return re.findall(_TOKEN_PATTERN, s.lower())
 
-def _chunk_text(text: str, max_chars: int = 1200, overlap: int = 200) -> List[str]:
+def _chunk_text(text: str, max_chars: int = CHUNK_MAX_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """
     Split long documents into overlapping chunks at paragraph boundaries.
     - Keeps paragraphs together where possible
@@ -111,54 +183,577 @@ def _chunk_text(text: str, max_chars: int = 1200, overlap: int = 200) -> List[st
     return chunks
 
 class BM25Index:
-    """Tiny BM25 over Chunk[] with k1/b hyper-params."""
-    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+    """
+    BM25 over the chunks of a ChunkStore with k1/b hyper-params, backed by an inverted index.
+    - Term frequencies, doc lengths, idf and length norms are computed once here
+    - A query only walks the postings of its own terms
+    - Top-k comes from a heap, not a full sort
+    """
+    def __init__(self, store: ChunkStore, k1: float = BM25_K1, b: float = BM25_B,
+                 postings: Dict[str, Dict[int, int]] | None = None,
+                 manifest: Dict[str, Dict] | None = None):
         self.k1, self.b = k1, b
-        self.chunks = chunks
-        self.N = len(chunks)
-        self.df = Counter()
-        for ch in chunks:
-            for t in set(ch.tokens):
-                self.df[t] += 1
-        self.avgdl = (sum(len(ch.tokens) for ch in chunks) / max(1, self.N)) if self.N else 0.0
-
-    def score(self, q_tokens: List[str], ch: Chunk) -> float:
-        tf = Counter(ch.tokens)
-        dl = len(ch.tokens) or 1
+        # shared, append-only; apply_delta() adds rows to it
+        self.store = store
+        # chunk slots (== store rows); apply_delta() leaves None tombstones for removed chunks
+        n = len(store)
+        self.chunks: List[Chunk | None] = [Chunk(store, i) for i in range(n)]
+        self.doc_len: List[int] = [store.n_tokens(i) for i in range(n)]
+        self.by_source: Dict[str, List[int]] = {}
+        for i in range(n):
+            self.by_source.setdefault(store.source(i), []).append(i)
+        # manifest: filename -> {sha256, size, mtime_ns} of the files indexed
+        self.manifest: Dict[str, Dict] = manifest or {}
+        if postings is None:  # prebuilt postings come from a snapshot
+            postings = {}
+            terms = store.vocab.terms
+            for i in range(n):
+                for t, f in Counter(store.token_ids(i)).items():
+                    postings.setdefault(terms[t], {})[i] = f
+        # postings: term -> {chunk_no: tf}
+        self.postings: Dict[str, Dict[int, int]] = postings
+        self.df = Counter({t: len(p) for t, p in self.postings.items()})
+        self.N = n
+        self.total_len = sum(self.doc_len)
+        self._derive()
+
+    def _derive(self) -> None:
+        """Recompute the N/avgdl-dependent parts: idf, per-chunk norms, matrix cache."""
+        self.avgdl = (self.total_len / max(1, self.N)) if self.N else 0.0
+        self.idf = {t: math.log(1 + (self.N - n + 0.5) / (n + 0.5)) for t, n in self.df.items()}
+        # k1 * (1 - b + b * dl/avgdl) per chunk; only the tf term varies per query
+        self.norm = [
+            self.k1 * (1 - self.b + self.b * ((dl or 1) / self.avgdl if self.avgdl else 1.0))
+            for dl in self.doc_len
+        ]
+        # sparse weight matrix for search_many(), built lazily
+        self._W = None
+        self._term_row: Dict[str, int] = {}
+        self._matrix_lock = threading.Lock()
+
+    def chunk_ids(self, source: str) -> List[int]:
+        return list(self.by_source.get(source, []))
+
+    def memory(self, sample: int = 2000) -> Dict:
+        """Chunk storage bytes per chunk, compact vs the old per-chunk str/list layout."""
+        return memory_report(self.store, [i for i, ch in enumerate(self.chunks) if ch is not None], sample)
+
+    # ---- incremental update (copy-on-write) -------------------------------
+    def apply_delta(self, remove_sources: List[str], add_chunks: List[Chunk],
+                    manifest: Dict[str, Dict]) -> "BM25Index":
+        """
+        Return a new index with every chunk of remove_sources dropped and
+        add_chunks (rows just appended to self.store) added. Only postings of
+        touched terms are copied; the rest are shared with self, which stays
+        valid for in-flight queries.
+        df and total length are adjusted per chunk; idf/norms are re-derived.
+        """
+        new = copy.copy(self)
+        new.chunks = list(self.chunks)
+        new.doc_len = list(self.doc_len)
+        new.by_source = dict(self.by_source)
+        new.postings = dict(self.postings)
+        new.df = Counter(self.df)
+        new.manifest = manifest
+        owned: set = set()
+
+        def _own(t: str) -> Dict[int, int]:
+            if t not in owned:
+                new.postings[t] = dict(new.postings.get(t, {}))
+                owned.add(t)
+            return new.postings[t]
+
+        for src in remove_sources:
+            for i in new.by_source.pop(src, []):
+                ch = new.chunks[i]
+                for t in set(ch.tokens):
+                    post = _own(t)
+                    post.pop(i, None)
+                    new.df[t] -= 1
+                    if not post:
+                        del new.postings[t], new.df[t]
+                        owned.discard(t)
+                new.total_len -= new.doc_len[i]
+                new.chunks[i] = None
+                new.doc_len[i] = 0
+                new.N -= 1
+        for ch in add_chunks:
+            i = len(new.chunks)
+            while i < ch.row:  # rows a failed earlier delta appended but never indexed
+                new.chunks.append(None)
+                new.doc_len.append(0)
+                i += 1
+            new.chunks.append(ch)
+            new.doc_len.append(ch.n_tokens)
+            new.by_source.setdefault(ch.source, []).append(i)
+            for t, f in Counter(ch.tokens).items():
+                _own(t)[i] = f
+                new.df[t] += 1
+            new.total_len += ch.n_tokens
+            new.N += 1
+        new._derive()
+        return new
+
+    # ---- snapshot round-trip ---------------------------------------------
+    @classmethod
+    def from_snapshot(cls, snap: Dict) -> "BM25Index":
+        """
+        Rebuild from index_snapshot.load_snapshot() output -- no chunking/tokenising.
+        The chunk store wraps the mmapped corpus and token arrays as-is (no copy).
+        """
+        vocab, meta = snap["vocab"], snap["meta"]
+        store = ChunkStore(Vocab(vocab), snap["sources"], corpus=snap["corpus"], text_off=snap["chunk_off"],
+                           src=snap["chunk_src"], tok_off=snap["tok_off"], tok_ids=snap["tok_ids"])
+        po, pc, pt = snap["post_off"].tolist(), snap["post_chunk"].tolist(), snap["post_tf"].tolist()
+        postings = {t: dict(zip(pc[po[r]:po[r + 1]], pt[po[r]:po[r + 1]]))
+                    for r, t in enumerate(vocab) if po[r + 1] > po[r]}
+        return cls(store, k1=meta["k1"], b=meta["b"], postings=postings, manifest=snap["manifest"])
+
+    def to_snapshot(self) -> Dict:
+        """
+        Flatten into the arrays/lists index_snapshot.write_snapshot() expects (tombstones dropped).
+        Token ids are the store's own; vocab terms no live chunk uses get empty postings.
+        """
+        store = self.store
+        vocab = list(store.vocab.terms)
+        live = [i for i, ch in enumerate(self.chunks) if ch is not None]
+        slot = {i: j for j, i in enumerate(live)}
+        corpus = bytearray()
+        chunk_off, tok_off, tok_ids = [0], [0], array("I")
+        for i in live:
+            corpus += store.text_bytes(i)
+            chunk_off.append(len(corpus))
+            tok_ids.extend(store.token_ids(i))
+            tok_off.append(len(tok_ids))
+        post_off, post_chunk, post_tf = [0], [], []
+        for t in vocab:
+            post = self.postings.get(t, {})
+            post_chunk.extend(slot[i] for i in post.keys())
+            post_tf.extend(post.values())
+            post_off.append(len(post_chunk))
+        arrays = {
+            "chunk_off": np.asarray(chunk_off, dtype=np.int64),
+            "chunk_src": np.asarray([store.src[i] for i in live], dtype=np.int32),
+            "tok_off": np.asarray(tok_off, dtype=np.int64),
+            "tok_ids": np.frombuffer(tok_ids, dtype=np.uint32),
+            "post_off": np.asarray(post_off, dtype=np.int64),
+            "post_chunk": np.asarray(post_chunk, dtype=np.uint32),
+            "post_tf": np.asarray(post_tf, dtype=np.uint32),
+            "df": np.asarray([self.df[t] for t in vocab], dtype=np.uint32),
+            "doc_len": np.asarray([self.doc_len[i] for i in live], dtype=np.uint32),
+        }
+        meta = {"n_chunks": self.N, "n_terms": len(vocab), "avgdl": self.avgdl, "k1": self.k1, "b": self.b}
+        return {"meta": meta, "vocab": vocab, "sources": list(store.sources), "corpus": bytes(corpus),
+                "manifest": self.manifest, "arrays": arrays}
+
+    def score(self, q_tokens: List[str], i: int) -> float:
+        """Score a single chunk (by position) against query tokens."""
         s = 0.0
         for t in q_tokens:
-            if t not in self.df:
+            post = self.postings.get(t)
+            if not post:
                 continue
-            idf = math.log(1 + (self.N - self.df[t] + 0.5) / (self.df[t] + 0.5))
-            f = tf[t]
-            denom = f + self.k1 * (1 - self.b + self.b * (dl / self.avgdl if self.avgdl else 1.0))
-            s += idf * (f * (self.k1 + 1)) / max(1e-9, denom)
+            f = post.get(i, 0)
+            s += self.idf[t] * (f * (self.k1 + 1)) / max(1e-9, f + self.norm[i])
         return s
 
+    def scores(self, q_tokens: List[str]) -> Dict[int, float]:
+        """Accumulate scores for every chunk sharing at least one term with the query."""
+        acc: Dict[int, float] = {}
+        k1p = self.k1 + 1
+        norm = self.norm
+        for t in q_tokens:
+            post = self.postings.get(t)
+            if not post:
+                continue
+            idf = self.idf[t]
+            for i, f in post.items():
+                acc[i] = acc.get(i, 0.0) + idf * (f * k1p) / max(1e-9, f + norm[i])
+        return acc
+
     def search(self, query: str, k: int = 5) -> List[Tuple[float, Chunk]]:
-        q = _tokenise_norm(query)
-        scored = [(self.score(q, ch), ch) for ch in self.chunks]
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return scored[:max(1, k)]
+        return self.search_tokens(_tokenise_norm(query), k=k)
+
+    def search_tokens(self, q_tokens: List[str], k: int = 5) -> List[Tuple[float, Chunk]]:
+        k = max(1, k)
+        acc = self.scores(q_tokens)
+        # ties resolve to corpus order, same as a stable descending sort
+        top = heapq.nlargest(k, acc.items(), key=lambda kv: (kv[1], -kv[0]))
+        hits = [(s, self.chunks[i]) for i, s in top]
+        return self._pad(hits, acc, k)
+
+    def _pad(self, hits: List[Tuple[float, Chunk]], matched, k: int) -> List[Tuple[float, Chunk]]:
+        """Fewer matches than k: pad with zero-score chunks in corpus order."""
+        i = 0
+        while len(hits) < k and i < len(self.chunks):
+            if i not in matched and self.chunks[i] is not None:
+                hits.append((0.0, self.chunks[i]))
+            i += 1
+        return hits
+
+    # ---- vectorised path (numpy/scipy) ------------------------------------
+    def _ensure_matrix(self) -> None:
+        """
+        Build the term-by-chunk weight matrix once, on first use.
+        W[t, i] = idf[t] * tf*(k1+1) / (tf + norm[i]) -- i.e. the full per-term
+        BM25 contribution, so a query score is just q @ W.
+        """
+        if self._W is not None:
+            return
+        with self._matrix_lock:
+            if self._W is not None:
+                return
+            terms = list(self.postings)
+            term_row = {t: r for r, t in enumerate(terms)}
+            indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+            cols, tfs = [], []
+            for r, t in enumerate(terms):
+                post = self.postings[t]
+                indptr[r + 1] = indptr[r] + len(post)
+                cols.extend(post.keys())
+                tfs.extend(post.values())
+            cols = np.asarray(cols, dtype=np.int32)
+            tf = np.asarray(tfs, dtype=np.float64)
+            idf = np.asarray([self.idf[t] for t in terms], dtype=np.float64)
+            norm = np.asarray(self.norm, dtype=np.float64)
+            row_idf = np.repeat(idf, np.diff(indptr))
+            data = row_idf * (tf * (self.k1 + 1)) / np.maximum(1e-9, tf + norm[cols])
+            self._term_row = term_row
+            self._W = sparse.csr_matrix((data, cols, indptr), shape=(len(terms), len(self.chunks)))
+
+    def _query_matrix(self, queries: List[str]):
+        """Sparse (n_queries x n_terms) matrix of query term counts (repeats count twice, as in score())."""
+        indptr, cols = [0], []
+        for q in queries:
+            cols.extend(r for r in (self._term_row.get(t) for t in _tokenise_norm(q)) if r is not None)
+            indptr.append(len(cols))
+        data = np.ones(len(cols), dtype=np.float64)
+        return sparse.csr_matrix((data, np.asarray(cols, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+                                 shape=(len(queries), len(self._term_row)))
+
+    def search_many(self, queries: List[str], k: int = 5) -> List[List[Tuple[float, Chunk]]]:
+        """
+        Score a batch of queries with one sparse mat-mul (Q @ W) + argpartition.
+        Same ranking and tie order as search(); scores agree to float rounding.
+        Falls back to looping search() when numpy/scipy are unavailable.
+        """
+        if sparse is None or not self.N:
+            return [self.search(q, k=k) for q in queries]
+        k = max(1, k)
+        self._ensure_matrix()
+        S = (self._query_matrix(queries) @ self._W).tocsr()
+        out: List[List[Tuple[float, Chunk]]] = []
+        for r in range(len(queries)):
+            a, b = S.indptr[r], S.indptr[r + 1]
+            idx, val = S.indices[a:b], S.data[a:b]
+            if len(val) > k:
+                # keep everything tied with the k-th best so the tie-break below is exact
+                kth = val[np.argpartition(-val, k - 1)[k - 1]]
+                keep = val >= kth
+                idx, val = idx[keep], val[keep]
+            order = np.lexsort((idx, -val))[:k]
+            hits = [(float(val[j]), self.chunks[int(idx[j])]) for j in order]
+            if len(hits) < k:
+                hits = self._pad(hits, set(idx.tolist()), k)
+            out.append(hits)
+        return out
+
+class RetrievalMemo:
+    """
+    Size-bounded LRU of (query term multiset, k) -> ranked hits.
+    BM25 ignores term order, so "leave policy" and "policy leave" share an entry;
+    repeats still count (they change the score). One memo per BM25Retriever, so
+    publishing a new index generation starts from an empty memo atomically.
+    """
+    def __init__(self, max_entries: int = RETRIEVAL_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple, List[Tuple[float, Chunk]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def key(q_tokens: List[str], k: int, mode: str = "bm25", query: str = "") -> Tuple:
+        if mode == "bm25":
+            return tuple(sorted(Counter(q_tokens).items())), max(1, k)
+        # embeddings see word order and casing-insensitive text, not a term multiset
+        return mode, " ".join(query.lower().split()), max(1, k)
+
+    def get(self, key: Tuple) -> List[Tuple[float, Chunk]] | None:
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            hits = self._data.get(key)
+            if hits is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hits
+
+    def put(self, key: Tuple, hits: List[Tuple[float, Chunk]]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = hits
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"enabled": self.max_entries > 0, "entries": len(self._data), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+class BM25Retriever:
+    """
+    Callable (query,k,mode)->[{source,text,score}] over a BM25Index, plus batched .many().
+    With a VectorStore attached, mode "vector" ranks by embedding similarity and
+    "hybrid" fuses BM25 and ANN rankings with RRF (score = fused RRF score).
+    Immutable once published: a reindex builds a new one with the next generation
+    (and with it a fresh RetrievalMemo).
+    """
+    def __init__(self, index: BM25Index, generation: int = 0, vectors=None):
+        self.index = index
+        self.generation = generation
+        self.version = _index_version(index.manifest)
+        self.memo = RetrievalMemo()
+        self.vectors = vectors
+        self.vectors_report: Dict | None = None  # last sync, for reindex reports
+        self._by_id: Dict[str, Chunk] | None = None
+
+    def modes(self) -> List[str]:
+        return list(RETRIEVAL_MODES) if self.vectors is not None else ["bm25"]
+
+    def _mode(self, mode: str | None) -> str:
+        mode = (mode or RETRIEVAL_MODE).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; use one of {', '.join(RETRIEVAL_MODES)}.")
+        if mode != "bm25" and self.vectors is None:
+            raise ValueError(f"Retrieval mode {mode!r} needs VECTOR_EMBEDDER to be set.")
+        return mode
+
+    def _chunk_by_id(self) -> Dict[str, Chunk]:
+        if self._by_id is None:
+            self._by_id = {_chunk_id(ch.source, ch.text): ch for ch in self.index.chunks if ch is not None}
+        return self._by_id
+
+    def _ann(self, query: str, n: int) -> List[Tuple[float, Chunk]]:
+        # ids the store knows but this generation does not (a newer sync) are skipped
+        by_id = self._chunk_by_id()
+        return [(sim, by_id[cid]) for cid, sim in self.vectors.query(query, n) if cid in by_id]
+
+    def _hybrid(self, query: str, q_tokens: List[str], k: int) -> List[Tuple[float, Chunk]]:
+        depth = max(k, HYBRID_DEPTH)
+        ann = _ann_pool.submit(self._ann, query, depth)   # embedding + ANN overlap BM25 scoring
+        lexical = [ch for score, ch in self.index.search_tokens(q_tokens, k=depth) if score > 0]
+        semantic = [ch for _, ch in ann.result()]
+        by_id = {_chunk_id(ch.source, ch.text): ch for ch in lexical + semantic}
+        fused = vector_index.rrf_fuse([[_chunk_id(ch.source, ch.text) for ch in lexical],
+                                       [_chunk_id(ch.source, ch.text) for ch in semantic]], k=RRF_K)
+        return [(score, by_id[cid]) for cid, score in fused[:k]]
+
+    def _search(self, query: str, q_tokens: List[str], k: int, mode: str) -> List[Tuple[float, Chunk]]:
+        if mode == "vector":
+            return self._ann(query, k)
+        if mode == "hybrid":
+            return self._hybrid(query, q_tokens, k)
+        return self.index.search_tokens(q_tokens, k=k)
+
+    def __call__(self, query: str, k: int = 5, mode: str | None = None) -> List[Dict[str, str]]:
+        mode = self._mode(mode)
+        q_tokens = _tokenise_norm(query)
+        key = RetrievalMemo.key(q_tokens, k, mode, query)
+        hits = self.memo.get(key)
+        if hits is None:
+            hits = self._search(query, q_tokens, k, mode)
+            self.memo.put(key, hits)
+        return [_hit_dict(score, ch) for score, ch in hits]
+
+    def many(self, queries: List[str], k: int = 5, mode: str | None = None) -> List[List[Dict[str, str]]]:
+        """Memo hits are served directly; only the misses go through one search_many() batch."""
+        mode = self._mode(mode)
+        if mode != "bm25":
+            return [self(q, k=k, mode=mode) for q in queries]
+        keys = [RetrievalMemo.key(_tokenise_norm(q), k) for q in queries]
+        found = [self.memo.get(key) for key in keys]
+        todo = [i for i, hits in enumerate(found) if hits is None]
+        if todo:
+            for i, hits in zip(todo, self.index.search_many([queries[i] for i in todo], k=k)):
+                found[i] = hits
+                self.memo.put(keys[i], hits)
+        return [[_hit_dict(score, ch) for score, ch in hits] for hits in found]
+
+def _hit_dict(score: float, ch: Chunk) -> Dict[str, str]:
+    return {"source": ch.source, "text": ch.text, "score": float(score)}
+
+def _chunk_id(source: str, text: str) -> str:
+    """Content id of a chunk; stable across rebuilds, shared by the answer cache and vector store."""
+    return hashlib.blake2b(f"{source}\0{text}".encode("utf-8"), digest_size=8).hexdigest()
+
+_ann_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ann")
+_vectors = None  # VectorStore, created on first sync
+
+def _sync_vectors(index: BM25Index) -> Dict | None:
+    """
+    Embed any chunks of `index` the vector store lacks and drop the ones it no longer
+    holds; vectors persist in the Chroma dir, so restarts and reindexes only embed new text.
+    Returns a report, or None when vector retrieval is disabled/unavailable.
+    """
+    global _vectors
+    if not VECTOR_EMBEDDER:
+        return None
+    try:
+        if _vectors is None:
+            if vector_index is None:
+                raise RuntimeError("numpy is required for vector retrieval")
+            _vectors = vector_index.VectorStore(Path(_effective_paths()["chroma_dir"]),
+                                                vector_index.make_embedder(VECTOR_EMBEDDER))
+        t0 = time.perf_counter()
+        live = {_chunk_id(ch.source, ch.text): ch.text for ch in index.chunks if ch is not None}
+        report = _vectors.sync(live)
+        report["duration_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return report
+    except Exception as e:
+        print(f"[WARN] Vector index unavailable ({e!r}); serving BM25 only.")
+        _vectors = None
+        return None
+
+def _chunks_for(store: ChunkStore, source: str, text: str) -> List[Chunk]:
+    """Chunk, tokenise and append one document to store."""
+    return [store.add(source, ch, _tokenise_norm(ch)) for ch in _chunk_text(text)]
+
+def _txt_paths(txt_dir: Path) -> List[Path]:
+    return sorted(txt_dir.glob("*.txt")) if txt_dir.exists() else []
+
+def _fingerprint(files: List[Tuple[str, int, int | str]]) -> str:
+    """Identity of the corpus (name, size, mtime_ns or hash) + every parameter that shapes the index."""
+    params = {"max_chars": CHUNK_MAX_CHARS, "overlap": CHUNK_OVERLAP,
+              "token_pattern": _TOKEN_PATTERN, "k1": BM25_K1, "b": BM25_B}
+    return index_snapshot.corpus_fingerprint(files, params)
 
-def build_bm25_retriever() -> Callable[[str, int], List[Dict[str, str]]]:
-    """Build BM25 over chunked TXT corpus; returns (query,k)->[{source,text,score}]."""
+def _corpus_fingerprint(txt_dir: Path) -> str:
+    """Fingerprint of the corpus as it is on disk right now (stat only)."""
+    files = []
+    for p in _txt_paths(txt_dir):
+        st = p.stat()
+        files.append((p.name, st.st_size, st.st_mtime_ns))
+    return _fingerprint(files)
+
+def _manifest_fingerprint(manifest: Dict[str, Dict]) -> str:
+    """Fingerprint of the corpus as recorded when the index was built."""
+    return _fingerprint([(n, e["size"], e["mtime_ns"]) for n, e in manifest.items()])
+
+def _index_version(manifest: Dict[str, Dict]) -> str:
+    """Content identity of an index: file hashes + params (ignores mtime-only touches)."""
+    return _fingerprint([(n, e["size"], e["sha256"]) for n, e in manifest.items()])
+
+def _save_snapshot(index: BM25Index) -> None:
+    """Best-effort snapshot write; a failure only costs the next cold start."""
+    if not (INDEX_SNAPSHOT and index_snapshot.available()):
+        return
+    try:
+        flat = index.to_snapshot()
+        index_snapshot.write_snapshot(Path(_effective_paths()["index_dir"]), _manifest_fingerprint(index.manifest),
+                                      flat["meta"], flat["vocab"], flat["sources"], flat["manifest"],
+                                      flat["corpus"], flat["arrays"])
+    except Exception as e:
+        print(f"[WARN] Could not write index snapshot: {e!r}")
+
+def _build_index(txt_dir: Path) -> BM25Index:
+    """Full build: read, chunk and tokenise every file, recording the manifest."""
+    store = ChunkStore()
+    manifest: Dict[str, Dict] = {}
+    for p in _txt_paths(txt_dir):
+        try:
+            text, entry = _load_txt_file(p)
+        except Exception:
+            # skip unreadable files
+            continue
+        manifest[p.name] = entry
+        if text:
+            _chunks_for(store, p.name, text)
+    return BM25Index(store, manifest=manifest)
+
+def build_bm25_retriever(reuse_snapshot: bool = True) -> BM25Retriever:
+    """
+    Build BM25 over chunked TXT corpus; returns (query,k)->[{source,text,score}].
+    With snapshots enabled, a snapshot matching the corpus fingerprint is loaded
+    instead of re-reading/re-chunking; otherwise the index is built and saved.
+    reuse_snapshot=False forces a rebuild (the fresh snapshot is still saved).
+    """
     paths = _effective_paths()
     txt_dir = Path(paths["txt_dir"])
-    raw_docs = _read_txt_files(txt_dir)
 
-    chunks: List[Chunk] = []
-    for src, text in raw_docs:
-        for ch in _chunk_text(text):
-            chunks.append(Chunk(source=src, text=ch, tokens=_tokenise_norm(ch)))
+    if reuse_snapshot and INDEX_SNAPSHOT and index_snapshot.available():
+        snap = index_snapshot.load_snapshot(Path(paths["index_dir"]), _corpus_fingerprint(txt_dir))
+        if snap is not None:
+            return BM25Retriever(BM25Index.from_snapshot(snap))
 
-    index = BM25Index(chunks)
+    index = _build_index(txt_dir)
+    _save_snapshot(index)
+    return BM25Retriever(index)
 
-    def _retrieve(query: str, k: int = 5) -> List[Dict[str, str]]:
-        hits = index.search(query, k=k)
-        return [{"source": ch.source, "text": ch.text, "score": float(score)} for score, ch in hits]
+def _scan_corpus(index: BM25Index, txt_dir: Path) -> Dict:
+    """
+    Diff txt_dir against index.manifest. Files whose size and mtime are unchanged
+    are trusted without reading; the rest are hashed and only re-chunked if the
+    content actually differs ("touched" = new mtime, same hash).
+    """
+    manifest: Dict[str, Dict] = {}
+    texts: Dict[str, str] = {}
+    added, changed, touched = [], [], []
+    for p in _txt_paths(txt_dir):
+        old = index.manifest.get(p.name)
+        st = p.stat()
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            manifest[p.name] = old
+            continue
+        try:
+            text, entry = _load_txt_file(p)
+        except Exception:
+            # skip unreadable files (treated as removed)
+            continue
+        manifest[p.name] = entry
+        if old and old["sha256"] == entry["sha256"]:
+            touched.append(p.name)
+            continue
+        (changed if old else added).append(p.name)
+        texts[p.name] = text
+    removed = [n for n in index.manifest if n not in manifest]
+    return {"added": added, "changed": changed, "removed": removed, "touched": touched,
+            "texts": texts, "manifest": manifest}
 
-    return _retrieve
+def reindex_incremental(index: BM25Index, txt_dir: Path) -> Tuple[BM25Index, Dict]:
+    """
+    Apply on-disk changes to index: drop chunks of changed/removed files, chunk
+    and add changed/new files, leave everything else untouched. Returns the new
+    index (or the same one if nothing changed) and a change report.
+    """
+    t0 = time.perf_counter()
+    scan = _scan_corpus(index, txt_dir)
+    stale = scan["changed"] + scan["removed"]
+    fresh = [ch for name in scan["added"] + scan["changed"]
+             for ch in _chunks_for(index.store, name, scan["texts"][name])]
+    new = index
+    if stale or fresh or scan["touched"]:
+        new = index.apply_delta(stale, fresh, scan["manifest"])
+        # mostly tombstones after many deltas: repack into a fresh store
+        if len(new.chunks) > 2 * max(1, new.N):
+            live = [i for i, ch in enumerate(new.chunks) if ch is not None]
+            new = BM25Index(new.store.compact(live), new.k1, new.b, manifest=new.manifest)
+    report = {
+        "mode": "incremental",
+        "added": scan["added"], "changed": scan["changed"], "removed": scan["removed"],
+        "touched": scan["touched"],
+        "chunks_removed": sum(len(index.by_source.get(n, [])) for n in stale),
+        "chunks_added": len(fresh),
+        "n_chunks": new.N,
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+    return new, report
 
 # ============================================================================
 # 3) HUMOUR (kept as-is, lightly)
@@ -207,26 +802,103 @@ def _inject_humor(answer: str, user_query: str) -> str:
 # ============================================================================
 # 4) OPENAI CALL
 # ============================================================================
-def call_openai(messages: List[Dict[str, str]], temperature: float = 0.2, top_p: float = 0.9) -> str:
-    """Minimal Chat Completions call (official SDK v1)."""
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not set in environment.")
-    if OpenAI is None:
-        raise RuntimeError("OpenAI SDK not installed. `pip install openai`")
+# One client per process: keeps HTTP keep-alive/TLS sessions across requests.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))            # seconds, per request
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_STREAM_USAGE = os.getenv("OPENAI_STREAM_USAGE", "true").lower() == "true"  # usage chunk on streams
 
-    client = OpenAI(api_key=api_key)
+OPENAI_REQUESTS = REGISTRY.counter("openai_requests_total", "Chat Completions calls.", ["model", "stream", "outcome"])
+OPENAI_PROMPT_TOKENS = REGISTRY.counter("openai_prompt_tokens_total", "Prompt tokens billed (usage field).", ["model"])
+OPENAI_COMPLETION_TOKENS = REGISTRY.counter("openai_completion_tokens_total",
+                                            "Completion tokens billed (usage field).", ["model"])
+
+def _record_usage(model: str, usage) -> None:
+    if usage is not None:
+        OPENAI_PROMPT_TOKENS.inc(usage.prompt_tokens or 0, model=model)
+        OPENAI_COMPLETION_TOKENS.inc(usage.completion_tokens or 0, model=model)
+
+_openai: "AsyncOpenAI | None" = None
+
+def _openai_client() -> "AsyncOpenAI":
+    """The shared AsyncOpenAI client (created at startup, or on first use if the key came later)."""
+    global _openai
+    if _openai is None:
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY not set in environment.")
+        if AsyncOpenAI is None:
+            raise RuntimeError("OpenAI SDK not installed. `pip install openai`")
+        _openai = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            ),
+        )
+    return _openai
+
+# Answer cache in front of call_openai (raw answers; humour is added per request)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))   # entries; 0 = off
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))   # seconds
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")                 # e.g. runtime/answer_cache.sqlite
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, db_path=ANSWER_CACHE_DB or None)
+
+async def _close_openai() -> None:
+    global _openai
+    if _openai is not None:
+        await _openai.close()
+        _openai = None
+
+async def call_openai(messages: List[Dict[str, str]], temperature: float = 0.2, top_p: float = 0.9) -> str:
+    """Minimal Chat Completions call (official SDK v1)."""
+    client = _openai_client()
     model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        top_p=top_p,
-        messages=messages,
-    )
+    try:
+        resp = await client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            top_p=top_p,
+            messages=messages,
+        )
+    except Exception:
+        OPENAI_REQUESTS.inc(model=model, stream="false", outcome="error")
+        raise
+    OPENAI_REQUESTS.inc(model=model, stream="false", outcome="ok")
+    _record_usage(model, resp.usage)
     text = resp.choices[0].message.content or ""
     return text.strip()
 
+async def stream_openai(messages: List[Dict[str, str]], temperature: float = 0.2,
+                        top_p: float = 0.9) -> AsyncIterator[str]:
+    """Same call as call_openai() with stream=True; yields content deltas as they arrive."""
+    client = _openai_client()
+    model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+
+    outcome = "error"
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            top_p=top_p,
+            messages=messages,
+            stream=True,
+            **({"stream_options": {"include_usage": True}} if OPENAI_STREAM_USAGE else {}),
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+            if getattr(event, "usage", None) is not None:  # final chunk, empty choices
+                _record_usage(model, event.usage)
+        outcome = "ok"
+    finally:
+        OPENAI_REQUESTS.inc(model=model, stream="true", outcome=outcome)
+
 # ============================================================================
 # 5) FASTAPI APP + STATIC
 # ============================================================================
@@ -259,65 +931,200 @@ def brand_json():
 # ============================================================================
 # 6) LIFECYCLE & HEALTH
 # ============================================================================
-retriever: Callable[[str, int], List[Dict[str, str]]] | None = None
+retriever: BM25Retriever | None = None
+
+_poll_stop = threading.Event()
+
+def _publish(index: BM25Index) -> BM25Retriever:
+    """
+    Atomically swap in a new index under the next generation number.
+    Requests that already grabbed the old retriever finish against it.
+    """
+    global retriever
+    generation = (retriever.generation if retriever is not None else 0) + 1
+    vectors_report = _sync_vectors(index)  # embed new chunks before the swap
+    retriever = BM25Retriever(index, generation=generation,
+                              vectors=_vectors if vectors_report is not None else None)
+    retriever.vectors_report = vectors_report
+    answer_cache.set_version(retriever.version)  # new content -> drop cached answers
+    return retriever
 
 @app.on_event("startup")
 def _startup() -> None:
-    global retriever
-    retriever = build_bm25_retriever()  # <= NEW sharp retriever
+    _publish(build_bm25_retriever().index)  # <= NEW sharp retriever
+    _poll_stop.clear()
+    threading.Thread(target=_reindex_worker, name="reindex-worker", daemon=True).start()
+    if INDEX_POLL_SECONDS > 0:
+        threading.Thread(target=_poll_corpus, name="corpus-poll", daemon=True).start()
+
+@app.on_event("startup")
+async def _startup_openai() -> None:
+    if os.environ.get("OPENAI_API_KEY") and AsyncOpenAI is not None:
+        _openai_client()  # open the pool up front rather than on the first /chat
+
+@app.on_event("shutdown")
+def _shutdown() -> None:
+    _poll_stop.set()
+    with _reindex_cv:
+        _reindex_cv.notify_all()
+
+@app.on_event("shutdown")
+async def _shutdown_openai() -> None:
+    await _close_openai()
 
 @app.get("/healthz")
 def healthz():
-    return JSONResponse({"status": "ok", "paths": _effective_paths(), "time": int(time.time())})
+    return JSONResponse({"status": "ok", "paths": _effective_paths(), "time": int(time.time()),
+                         "index_generation": retriever.generation if retriever is not None else 0,
+                         "retrieval_modes": retriever.modes() if retriever is not None else []})
 
 # ============================================================================
 # 7) DEBUG: INSPECT RETRIEVAL
 # ============================================================================
 @app.get("/debug/retrieve")
-def debug_retrieve(q: str, k: int = 6):
-    """Return top-k retrieval results to verify coverage/grounding."""
-    global retriever
-    if retriever is None:
+def debug_retrieve(q: str, k: int = 6, mode: str | None = None):
+    """Return top-k retrieval results to verify coverage/grounding (?mode=bm25|vector|hybrid)."""
+    live = retriever
+    if live is None:
         raise HTTPException(status_code=503, detail="Retriever not ready.")
-    docs = retriever(q, k=k)
+    try:
+        docs = live(q, k=k, mode=mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return JSONResponse({
         "query": q,
         "k": k,
+        "mode": mode or RETRIEVAL_MODE,
+        "index_generation": live.generation,
         "results": [
             {"score": round(d["score"], 4), "source": d["source"], "preview": (d["text"][:600] if d["text"] else "")}
             for d in docs
         ]
     })
 
-# ============================================================================
-# 8) CHAT
-# ============================================================================
-@app.post("/chat")
-def chat(payload: Dict):
+def retrieve_many(queries: List[str], k: int = 5, mode: str | None = None) -> List[List[Dict[str, str]]]:
+    """Batched retrieval against the live index; one result list per query, in order."""
+    if retriever is None:
+        raise RuntimeError("Retriever not ready.")
+    return retriever.many(queries, k=k, mode=mode)
+
+@app.post("/debug/retrieve_batch")
+def debug_retrieve_batch(payload: Dict):
     """
     POST body:
       {
-        "message": "...",
-        "k": 6,               # optional: top-k chunks to fetch (default 6)
-        "temperature": 0.35,  # optional: creativity level (default 0.35)
-        "top_p": 0.9          # optional: nucleus sampling (default 0.9)
+        "queries": ["...", "..."],
+        "k": 6,               # optional: top-k per query (default 6)
+        "mode": "hybrid"      # optional: bm25 | vector | hybrid (default RETRIEVAL_MODE)
       }
     """
+    queries = (payload or {}).get("queries") or []
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        raise HTTPException(status_code=400, detail="'queries' must be a list of strings.")
+    k = int((payload or {}).get("k", 6))
+    mode = (payload or {}).get("mode")
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever not ready.")
+    t0 = time.perf_counter()
+    try:
+        batches = retrieve_many(queries, k=k, mode=mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({
+        "k": k,
+        "mode": mode or RETRIEVAL_MODE,
+        "count": len(queries),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "results": [
+            {"query": q, "results": [
+                {"score": round(d["score"], 4), "source": d["source"], "preview": (d["text"][:600] if d["text"] else "")}
+                for d in docs
+            ]}
+            for q, docs in zip(queries, batches)
+        ]
+    })
+
+# ============================================================================
+# 8) CHAT
+# ============================================================================
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))        # INTERNAL_CONTEXT tokens
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.85"))  # shingle Jaccard
+CHAT_MAX_K = int(os.getenv("CHAT_MAX_K", "50"))                                # cap on request "k"
+
+_token_counters: Dict[str, TokenCounter] = {}
+
+# Per-stage latency; the same numbers go out per response as Server-Timing
+CHAT_STAGE_SECONDS = REGISTRY.histogram("chat_stage_seconds", "/chat latency by pipeline stage.", ["stage"])
+CHAT_FIRST_TOKEN_SECONDS = REGISTRY.histogram("chat_openai_first_token_seconds",
+                                              "Streamed generations: time to the first token.")
+CHAT_REQUESTS = REGISTRY.counter("chat_requests_total", "/chat responses.",
+                                 ["mode", "stream", "cache", "coalesced"])
+CHAT_CHUNKS_RETRIEVED = REGISTRY.counter("chat_chunks_retrieved_total", "Chunks returned by retrieval for /chat.")
+CHAT_CONTEXT_PASSAGES = REGISTRY.counter("chat_context_passages_total", "Passages packed into prompts.")
+CHAT_CONTEXT_TOKENS = REGISTRY.histogram("chat_context_tokens", "INTERNAL_CONTEXT size per prompt (tokens).",
+                                         buckets=(100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000))
+
+def _stage(turn: "ChatTurn", stage: str, seconds: float) -> None:
+    turn.timings[stage] = round(seconds * 1000, 2)
+    CHAT_STAGE_SECONDS.observe(seconds, stage=stage)
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+def _token_counter() -> TokenCounter:
+    model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+    counter = _token_counters.get(model)
+    if counter is None:
+        counter = _token_counters[model] = TokenCounter(model)
+    return counter
+
+@dataclass
+class ChatTurn:
+    """One /chat request after retrieval and prompt build; shared by the JSON and SSE paths."""
+    query: str
+    k: int
+    temperature: float
+    top_p: float
+    generation: int
+    mode: str
+    citations: List[Dict]
+    messages: List[Dict[str, str]]
+    context: Dict
+    cache_key: str = ""
+    index_version: str = ""
+    cache: str = "off"   # off | hit | miss
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> ms (shared work only)
+
+    def meta(self, coalesced: bool = False) -> Dict:
+        return {"k": self.k, "temperature": self.temperature, "top_p": self.top_p,
+                "model": os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
+                "index_generation": self.generation, "retrieval_mode": self.mode, "cache": self.cache,
+                "context_tokens": self.context["tokens"], "context": self.context, "coalesced": coalesced}
+
+def _prepare_chat(payload: Dict) -> ChatTurn:
     user_query = (payload or {}).get("message", "").strip()
     if not user_query:
         raise HTTPException(status_code=400, detail="Missing message.")
 
-    k = int((payload or {}).get("k", 6))
+    k = max(1, min(int((payload or {}).get("k", 6)), CHAT_MAX_K))
     temperature = float((payload or {}).get("temperature", 0.35))
     top_p = float((payload or {}).get("top_p", 0.9))
+    mode = (payload or {}).get("mode") or RETRIEVAL_MODE
 
-    global retriever
-    if retriever is None:
+    live = retriever  # pin one index generation for the whole request
+    if live is None:
         raise HTTPException(status_code=503, detail="Retriever not ready.")
 
     # 1) Retrieve internal context
-    docs = retriever(user_query, k=k)
-    internal_ctx = "\n\n".join(d["text"].strip() for d in docs if d.get("text"))
+    t0 = time.perf_counter()
+    try:
+        docs = live(user_query, k=k, mode=mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    t_retrieved = time.perf_counter()
+    internal_ctx, context_report = pack_context(docs, _token_counter(), CONTEXT_TOKEN_BUDGET,
+                                                dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+                                                min_overlap=CHUNK_OVERLAP // 2)
     internal_cites = [
         {"source": d.get("source", "internal"), "score": round(d.get("score", 0.0), 4),
          "preview": (d.get("text", "") or "")[:300]}
@@ -362,28 +1169,363 @@ def chat(payload: Dict):
         f"{tone_instructions}"
     )
 
-    # 3) Generate
-    answer_text = call_openai(
+    turn = ChatTurn(
+        query=user_query, k=k, temperature=temperature, top_p=top_p,
+        generation=live.generation, mode=mode, citations=internal_cites,
         messages=[{"role": "system", "content": "You are Macrocomm Assistant."},
                   {"role": "user", "content": prompt}],
-        temperature=temperature,
-        top_p=top_p,
+        context=context_report,
+        cache_key=cache_key(_tokenise_norm(user_query), [_chunk_id(d["source"], d["text"]) for d in docs],
+                            os.environ.get("OPENAI_MODEL", "gpt-4o-mini"), temperature, top_p),
+        index_version=live.version,
     )
-    answer_text = _inject_humor(answer_text, user_query)
+    _stage(turn, "retrieval", t_retrieved - t0)
+    _stage(turn, "prompt", time.perf_counter() - t_retrieved)
+    CHAT_CHUNKS_RETRIEVED.inc(len(docs))
+    CHAT_CONTEXT_PASSAGES.inc(context_report["passages"])
+    CHAT_CONTEXT_TOKENS.observe(context_report["tokens"])
+    return turn
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Identical concurrent /chat requests share one retrieval + generation. A finished
+# answer stays joinable for CHAT_COALESCE_WINDOW seconds; failures are never reused.
+CHAT_COALESCE = os.getenv("CHAT_COALESCE", "true").lower() == "true"
+CHAT_COALESCE_WINDOW = float(os.getenv("CHAT_COALESCE_WINDOW", "2"))
+chat_flights = SingleFlight(window=CHAT_COALESCE_WINDOW, enabled=CHAT_COALESCE)
 
-    return JSONResponse({"answer": answer_text, "citations": internal_cites,
-                         "meta": {"k": k, "temperature": temperature, "top_p": top_p,
-                                  "model": os.environ.get("OPENAI_MODEL", "gpt-4o-mini")}})
+def _coalesce_key(payload: Dict) -> Tuple:
+    """Normalised question + every parameter that changes the answer, on the live generation."""
+    p = payload or {}
+    return (" ".join(str(p.get("message", "")).lower().split()),
+            str(p.get("k", 6)), str(p.get("temperature", 0.35)), str(p.get("top_p", 0.9)),
+            p.get("mode") or RETRIEVAL_MODE, os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
+            retriever.generation if retriever is not None else 0)
+
+# Generations in flight at once; the rest wait (fairly, per client) in a bounded queue
+chat_admission = AdmissionController(
+    "chat",
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "16")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+    max_queue_per_client=int(os.getenv("CHAT_MAX_QUEUE_PER_CLIENT", "8")),
+    max_wait=float(os.getenv("CHAT_MAX_WAIT", "30")),   # seconds before a queued request gets 503
+)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"  # behind a proxy
+
+def _client_id(request: Request) -> str:
+    """Fairness key: API key if the caller sent one, else client IP."""
+    key = request.headers.get("x-api-key") or request.headers.get("authorization")
+    if key:
+        return "key:" + hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+    if TRUST_FORWARDED_FOR and request.headers.get("x-forwarded-for"):
+        return "ip:" + request.headers["x-forwarded-for"].split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+@app.exception_handler(Rejected)
+async def _rejected(request: Request, exc: Rejected):
+    return JSONResponse({"detail": f"Server busy: {exc.reason}.", "retry_after": exc.retry_after},
+                        status_code=exc.status, headers={"Retry-After": str(exc.retry_after)})
+
+# BM25 retrieval stays on the event loop while it is cheap; past this many
+# chunks it is pushed to the threadpool so scoring never stalls other requests.
+# Vector/hybrid retrieval always goes there: embedding the query and waiting
+# on the ANN search would block the loop at any index size.
+RETRIEVAL_OFFLOAD_MIN_CHUNKS = int(os.getenv("RETRIEVAL_OFFLOAD_MIN_CHUNKS", "5000"))
+
+async def _answer(flight: Flight, payload: Dict, stream: bool, client: str) -> Tuple[ChatTurn, str]:
+    """
+    The shared work behind one coalesced /chat: retrieval + prompt, answer cache,
+    then generation. Publishes ("turn", ChatTurn) followed by ("token", delta)
+    parts; returns (turn, raw answer) -- humour is left to each caller.
+    A cache miss takes an admission slot *before* the turn is published, so
+    overload surfaces as 429/503 to every caller rather than mid-stream.
+    """
+    live = retriever
+    mode = str((payload or {}).get("mode") or RETRIEVAL_MODE).lower()
+    if live is not None and (mode != "bm25" or live.index.N >= RETRIEVAL_OFFLOAD_MIN_CHUNKS):
+        turn = await run_in_threadpool(_prepare_chat, payload)
+    else:
+        turn = _prepare_chat(payload)
+
+    cached = answer_cache.get(turn.cache_key)
+    if answer_cache.enabled:
+        turn.cache = "miss" if cached is None else "hit"
+    if cached is not None:
+        await flight.publish(("turn", turn))
+        await flight.publish(("token", cached))
+        return turn, cached
+
+    t0 = time.perf_counter()
+    async with chat_admission.slot(client):
+        _stage(turn, "queue", time.perf_counter() - t0)
+        await flight.publish(("turn", turn))
+        t0 = time.perf_counter()
+        raw = await _generate(flight, turn, stream)
+        _stage(turn, "openai", time.perf_counter() - t0)
+        return turn, raw
+
+async def _generate(flight: Flight, turn: ChatTurn, stream: bool) -> str:
+    """OpenAI call for a turn (streamed or not); deltas go to the flight, the answer to the cache."""
+    # 3) Generate (the answer cache missed)
+    if stream:
+        parts: List[str] = []
+        t0 = time.perf_counter()
+        async for delta in stream_openai(turn.messages, temperature=turn.temperature, top_p=turn.top_p):
+            if not parts:
+                delta = delta.lstrip()  # call_openai() strips; match it
+                if not delta:
+                    continue
+                CHAT_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t0)
+            parts.append(delta)
+            await flight.publish(("token", delta))
+        raw = "".join(parts).rstrip()
+        answer_cache.put(turn.cache_key, raw, version=turn.index_version)
+    else:
+        raw = await call_openai(
+            messages=turn.messages,
+            temperature=turn.temperature,
+            top_p=turn.top_p,
+        )
+        answer_cache.put(turn.cache_key, raw, version=turn.index_version)
+        await flight.publish(("token", raw))  # streaming followers get it in one piece
+    return raw
+
+async def _chat_events(flight: Flight, turn: ChatTurn, coalesced: bool) -> AsyncIterator[str]:
+    """
+    SSE stream for one caller of a flight:
+      event: citations  -> [{source, score, preview}, ...]   (before generation starts)
+      event: token      -> {"delta": "..."}                  (repeated; one token on a cache hit)
+      event: meta       -> {"answer": full text, "meta": {...}}
+      event: error      -> {"error": "..."}                  (instead of meta on failure)
+    """
+    yield _sse("citations", turn.citations)
+    try:
+        async for _, delta in flight.stream(start=1):
+            yield _sse("token", {"delta": delta})
+        _, raw = await flight.wait()
+    except Exception as e:
+        yield _sse("error", {"error": str(e)})
+        return
+    t0 = time.perf_counter()
+    answer = _inject_humor(raw, turn.query)
+    CHAT_STAGE_SECONDS.observe(time.perf_counter() - t0, stage="humour")
+    CHAT_REQUESTS.inc(mode=turn.mode, stream="true", cache=turn.cache, coalesced=str(coalesced).lower())
+    if answer != raw:  # humour is appended, so stream just the tail
+        yield _sse("token", {"delta": answer[len(raw):]})
+    yield _sse("meta", {"answer": answer, "meta": turn.meta(coalesced)})
+
+@app.post("/chat")
+async def chat(payload: Dict, request: Request):
+    """
+    POST body:
+      {
+        "message": "...",
+        "k": 6,               # optional: top-k chunks to fetch (default 6, capped at CHAT_MAX_K)
+        "temperature": 0.35,  # optional: creativity level (default 0.35)
+        "top_p": 0.9,         # optional: nucleus sampling (default 0.9)
+        "mode": "hybrid",     # optional: bm25 | vector | hybrid (default RETRIEVAL_MODE)
+        "stream": false       # optional: true -> text/event-stream (see _chat_events)
+      }
+    Under overload: 429 (this client has too many queued) or 503 (queue full /
+    waited CHAT_MAX_WAIT), both with Retry-After.
+    """
+    stream = bool((payload or {}).get("stream"))
+    client = _client_id(request)
+    flight, leader = chat_flights.join(_coalesce_key(payload), lambda f: _answer(f, payload, stream, client))
+    _, turn = await flight.first()  # bad request / not ready / rejected raise here, for every caller
+
+    if stream:  # headers go out before generation: Server-Timing covers retrieval/prompt/queue
+        return StreamingResponse(_chat_events(flight, turn, coalesced=not leader), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                          "Server-Timing": _server_timing(turn.timings)})
+
+    _, answer_text = await flight.wait()
+    t0 = time.perf_counter()
+    answer_text = _inject_humor(answer_text, turn.query)
+    humour_s = time.perf_counter() - t0
+    CHAT_STAGE_SECONDS.observe(humour_s, stage="humour")
+    CHAT_REQUESTS.inc(mode=turn.mode, stream="false", cache=turn.cache, coalesced=str(not leader).lower())
+
+    timings = dict(turn.timings, humour=round(humour_s * 1000, 2))
+    return JSONResponse({"answer": answer_text, "citations": turn.citations, "meta": turn.meta(coalesced=not leader)},
+                        headers={"Server-Timing": _server_timing(timings)})
 
 # ============================================================================
 # 9) ADMIN: REINDEX
 # ============================================================================
+# Rebuilds run on one background worker thread: requests only queue a job,
+# the worker builds a complete new index off to the side and _publish()es it.
+_reindex_cv = threading.Condition()
+_reindex_pending: Dict | None = None     # at most one queued job; repeats coalesce
+_reindex_jobs: Dict[int, Dict] = {}      # job id -> status, most recent last
+_REINDEX_JOBS_KEPT = 20
+_reindex_seq = 0
+
+def _request_reindex(full: bool = False) -> Dict:
+    """Queue a rebuild (or fold into the one already queued); returns its status."""
+    global _reindex_pending, _reindex_seq
+    with _reindex_cv:
+        if _reindex_pending is not None:
+            _reindex_pending["mode"] = "full" if full else _reindex_pending["mode"]
+        else:
+            _reindex_seq += 1
+            _reindex_pending = {"job": _reindex_seq, "state": "queued", "mode": "full" if full else "incremental",
+                                "queued_at": time.time()}
+            _reindex_jobs[_reindex_seq] = _reindex_pending
+            for old in list(_reindex_jobs)[:-_REINDEX_JOBS_KEPT]:
+                del _reindex_jobs[old]
+        _reindex_cv.notify_all()
+        return dict(_reindex_pending)
+
+def _wait_reindex(job_id: int, timeout: float | None = None) -> Dict:
+    with _reindex_cv:
+        _reindex_cv.wait_for(lambda: _reindex_jobs.get(job_id, {}).get("state") in (None, "done", "error"),
+                             timeout=timeout)
+        return dict(_reindex_jobs.get(job_id, {}))
+
+def _run_reindex(full: bool) -> Dict:
+    """Build the next index (incremental unless full) and publish it; returns a report."""
+    live = retriever
+    if full or live is None:
+        t0 = time.perf_counter()
+        index = build_bm25_retriever(reuse_snapshot=False).index
+        report = {"chunks_removed": live.index.N if live is not None else 0, "chunks_added": index.N,
+                  "n_chunks": index.N, "duration_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    else:
+        index, report = reindex_incremental(live.index, Path(_effective_paths()["txt_dir"]))
+        report.pop("mode", None)
+        if index is not live.index:
+            _save_snapshot(index)
+    if live is None or index is not live.index:
+        live = _publish(index)
+        report["vectors"] = live.vectors_report
+    report["generation"] = live.generation
+    return report
+
+def _reindex_worker() -> None:
+    global _reindex_pending
+    while True:
+        with _reindex_cv:
+            _reindex_cv.wait_for(lambda: _reindex_pending is not None or _poll_stop.is_set())
+            if _poll_stop.is_set():
+                return
+            job, _reindex_pending = _reindex_pending, None
+            job.update(state="running", started_at=time.time())
+            _reindex_cv.notify_all()
+        try:
+            report = _run_reindex(full=job["mode"] == "full")
+            update = {"state": "done", **report}
+        except Exception as e:
+            update = {"state": "error", "error": repr(e)}
+        with _reindex_cv:
+            job.update(update, finished_at=time.time())
+            _reindex_cv.notify_all()
+        if update["state"] == "error":
+            print(f"[WARN] Reindex job {job['job']} failed: {update['error']}")
+        elif job["mode"] == "incremental" and (report["added"] or report["changed"] or report["removed"]):
+            print(f"[INFO] Reindex job {job['job']}: +{len(report['added'])} ~{len(report['changed'])} "
+                  f"-{len(report['removed'])} files in {report['duration_ms']} ms -> gen {report['generation']}")
+
+def _poll_corpus() -> None:
+    """Background loop for INDEX_POLL_SECONDS: cheap stat check, queue a job on change."""
+    txt_dir = Path(_effective_paths()["txt_dir"])
+    while not _poll_stop.wait(INDEX_POLL_SECONDS):
+        try:
+            live = retriever
+            if live is not None and _corpus_fingerprint(txt_dir) != _manifest_fingerprint(live.index.manifest):
+                _request_reindex()
+        except Exception as e:
+            print(f"[WARN] Corpus poll failed: {e!r}")
+
 @app.post("/admin/reindex")
-def reindex():
-    """Rebuild the in-memory BM25 index (call after adding/removing TXT files)."""
-    global retriever
-    try:
-        retriever = build_bm25_retriever()
-        return JSONResponse({"status": "ok", "reindexed": True})
-    except Exception as e:
-        return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
\ No newline at end of file
+def reindex(full: bool = False, wait: bool = False):
+    """
+    Queue a background rebuild of the BM25 index (call after adding/removing/editing TXT files).
+    Returns immediately (202) with the job status; live traffic keeps using the
+    current generation until the new one is swapped in.
+    - ?full=true  rebuild everything instead of only the changed files
+    - ?wait=true  block until the job finishes (scripts/CI)
+    """
+    job = _request_reindex(full=full)
+    if wait:
+        job = _wait_reindex(job["job"])
+        code = 500 if job.get("state") == "error" else 200
+        return JSONResponse({"status": "error" if code == 500 else "ok", "reindexed": code == 200, **job},
+                            status_code=code)
+    return JSONResponse({"status": "queued", **job}, status_code=202)
+
+@app.get("/admin/reindex/status")
+def reindex_status(job: int | None = None):
+    """Live index generation plus the status of one job (default: the most recent)."""
+    with _reindex_cv:
+        if job is None and _reindex_jobs:
+            job = next(reversed(_reindex_jobs))
+        info = dict(_reindex_jobs.get(job, {})) if job is not None else None
+    if job is not None and not info:
+        raise HTTPException(status_code=404, detail=f"Unknown reindex job {job}.")
+    live = retriever
+    return JSONResponse({
+        "generation": live.generation if live is not None else 0,
+        "n_chunks": live.index.N if live is not None else 0,
+        "job": info,
+    })
+
+@app.get("/admin/cache")
+def cache_stats():
+    """Answer cache, /chat coalescing and retrieval memo: size, hit rate, eviction/invalidation counters."""
+    live = retriever
+    return JSONResponse({
+        "answers": answer_cache.stats(),
+        "coalescing": chat_flights.stats(),
+        "retrieval": {"index_generation": live.generation, **live.memo.stats()} if live is not None else None,
+    })
+
+@app.get("/admin/admission")
+def admission_stats():
+    """/chat generation limiter: in-flight, queue depth, wait/service times, rejections."""
+    return JSONResponse(chat_admission.stats())
+
+@app.get("/admin/manifest")
+def manifest():
+    """Per-file manifest of the live index: content hash, size, mtime and chunk ids."""
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever not ready.")
+    index = retriever.index
+    return JSONResponse({
+        "n_chunks": index.N,
+        "files": {name: {**entry, "chunk_ids": index.chunk_ids(name)} for name, entry in index.manifest.items()},
+    })
+
+@app.get("/admin/memory")
+def memory(sample: int = 2000):
+    """Bytes per chunk of the live index's chunk store, vs an estimate of the old layout."""
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever not ready.")
+    index = retriever.index
+    return JSONResponse({"generation": retriever.generation, **index.memory(sample=max(1, sample))})
+
+# ============================================================================
+# 10) METRICS
+# ============================================================================
+REGISTRY.gauge("index_generation", "Live index generation.",
+               fn=lambda: retriever.generation if retriever is not None else 0)
+REGISTRY.gauge("index_chunks", "Chunks in the live index.",
+               fn=lambda: retriever.index.N if retriever is not None else 0)
+REGISTRY.gauge("index_chunk_store_bytes", "Bytes held by the live chunk store (text, token ids, offsets, vocab).",
+               fn=lambda: sum(retriever.index.store.nbytes().values()) if retriever is not None else 0)
+REGISTRY.gauge("chat_admission_in_flight", "Generations holding an admission slot.",
+               fn=lambda: chat_admission.stats()["in_flight"])
+REGISTRY.gauge("chat_admission_queue_depth", "Requests waiting for an admission slot.",
+               fn=lambda: chat_admission.stats()["queue_depth"])
+REGISTRY.counter("chat_admission_rejected_total", "Requests rejected with 429/503.",
+                 fn=lambda: sum(chat_admission.rejected.values()))
+REGISTRY.counter("chat_coalesced_total", "/chat requests served by another request's generation.",
+                 fn=lambda: chat_flights.followers)
+REGISTRY.counter("answer_cache_hits_total", "Answer cache hits.", fn=lambda: answer_cache.hits)
+REGISTRY.counter("answer_cache_misses_total", "Answer cache misses.", fn=lambda: answer_cache.misses)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
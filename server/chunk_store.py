@@ -0,0 +1,212 @@
+# server/chunk_store.py
+# Compact chunk storage for the BM25 index (struct-of-arrays)
+# -----------------------------------------------------------------------
+# - All chunk texts live back to back in one UTF-8 corpus buffer and are
+#   sliced/decoded on demand via byte offsets
+# - Tokens are interned once in a Vocab; a chunk's tokens are uint32 ids in
+#   one flat array('I'), sliced via token offsets (4 bytes per token instead
+#   of a str object per token)
+# - Chunk is a __slots__ view (store, row); .text / .tokens materialise on access
+# - Append-only: rows never move, so an older index generation sharing the
+#   store with a newer one stays valid (it never looks past its own rows)
+# - Can wrap a memory-mapped snapshot (numpy arrays + mmap) without copying;
+#   the first append copies it into growable buffers
+# - memory_report(): bytes per chunk, compact vs the old dataclass + list[str] layout
+
+from __future__ import annotations
+
+import sys
+from array import array
+from typing import Dict, Iterable, List, Sequence
+
+class Vocab:
+    """Interned terms; list position == token id."""
+    __slots__ = ("terms", "ids")
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self.terms: List[str] = list(terms)
+        self.ids: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def intern(self, tokens: Iterable[str]) -> List[int]:
+        ids, terms = self.ids, self.terms
+        out = []
+        for t in tokens:
+            i = ids.get(t)
+            if i is None:
+                i = len(terms)
+                terms.append(t)  # before ids[t]: an id is never handed out ahead of its term
+                ids[t] = i
+            out.append(i)
+        return out
+
+def _growable(typecode: str, values) -> array:
+    """array(typecode) copy of an array/numpy (mmapped) buffer."""
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    out = array(typecode)
+    if hasattr(values, "astype"):  # numpy
+        out.frombytes(values.astype(f"=u{out.itemsize}").tobytes())
+    else:
+        out.extend(values)
+    return out
+
+def _nbytes(buf) -> int:
+    return len(buf) * getattr(buf, "itemsize", 1)
+
+class ChunkStore:
+    """
+    Struct-of-arrays chunk table. Row r:
+      text    corpus[text_off[r]:text_off[r+1]]   (UTF-8)
+      tokens  tok_ids[tok_off[r]:tok_off[r+1]]    (Vocab ids)
+      source  sources[src[r]]
+    """
+    def __init__(self, vocab: Vocab | None = None, sources: Sequence[str] = (),
+                 corpus=None, text_off=None, src=None, tok_off=None, tok_ids=None):
+        self.vocab = vocab if vocab is not None else Vocab()
+        self.sources: List[str] = list(sources)
+        self._source_id: Dict[str, int] = {s: i for i, s in enumerate(self.sources)}
+        # bytearray/array('Q'/'I') when built here; bytes/mmap + numpy arrays when wrapping a snapshot
+        self.corpus = corpus if corpus is not None else bytearray()
+        self.text_off = text_off if text_off is not None else array("Q", [0])
+        self.src = src if src is not None else array("I")
+        self.tok_off = tok_off if tok_off is not None else array("Q", [0])
+        self.tok_ids = tok_ids if tok_ids is not None else array("I")
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    @property
+    def mapped(self) -> bool:
+        """True while still backed by a read-only snapshot mapping."""
+        return not isinstance(self.corpus, bytearray)
+
+    # ---- rows -------------------------------------------------------------
+    def add(self, source: str, text: str, tokens: Iterable[str]) -> "Chunk":
+        if self.mapped:
+            self._thaw()
+        sid = self._source_id.get(source)
+        if sid is None:
+            sid = self._source_id[source] = len(self.sources)
+            self.sources.append(source)
+        self.corpus += text.encode("utf-8")
+        self.tok_ids.extend(self.vocab.intern(tokens))
+        # offsets/src last: a row becomes visible only once its data is in place
+        self.text_off.append(len(self.corpus))
+        self.tok_off.append(len(self.tok_ids))
+        self.src.append(sid)
+        return Chunk(self, len(self.src) - 1)
+
+    def _thaw(self) -> None:
+        """Copy a snapshot-backed store into growable buffers (readers see identical rows throughout)."""
+        corpus = bytearray(self.corpus)
+        text_off, src = _growable("Q", self.text_off), _growable("I", self.src)
+        tok_off, tok_ids = _growable("Q", self.tok_off), _growable("I", self.tok_ids)
+        self.text_off, self.src, self.tok_off, self.tok_ids = text_off, src, tok_off, tok_ids
+        self.corpus = corpus
+
+    def text(self, row: int) -> str:
+        return self.corpus[self.text_off[row]:self.text_off[row + 1]].decode("utf-8")
+
+    def text_bytes(self, row: int) -> bytes:
+        return bytes(self.corpus[self.text_off[row]:self.text_off[row + 1]])
+
+    def source(self, row: int) -> str:
+        return self.sources[self.src[row]]
+
+    def token_ids(self, row: int) -> List[int]:
+        return self.tok_ids[self.tok_off[row]:self.tok_off[row + 1]].tolist()
+
+    def tokens(self, row: int) -> List[str]:
+        return list(map(self.vocab.terms.__getitem__, self.token_ids(row)))
+
+    def n_tokens(self, row: int) -> int:
+        return int(self.tok_off[row + 1] - self.tok_off[row])
+
+    def compact(self, rows: Iterable[int]) -> "ChunkStore":
+        """New store holding only `rows` (in order), with a vocabulary re-interned from them."""
+        out = ChunkStore()
+        for r in rows:
+            out.add(self.source(r), self.text(r), self.tokens(r))
+        return out
+
+    # ---- accounting -------------------------------------------------------
+    def nbytes(self) -> Dict[str, int]:
+        terms = self.vocab.terms
+        return {
+            "corpus": _nbytes(self.corpus),
+            "offsets": _nbytes(self.text_off) + _nbytes(self.tok_off) + _nbytes(self.src),
+            "token_ids": _nbytes(self.tok_ids),
+            "vocab": (sum(map(sys.getsizeof, terms)) + sys.getsizeof(terms)
+                      + sys.getsizeof(self.vocab.ids)),
+        }
+
+class Chunk:
+    """A row of a ChunkStore; same attributes as the old (source, text, tokens) record."""
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: ChunkStore, row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def source(self) -> str:
+        return self.store.source(self.row)
+
+    @property
+    def text(self) -> str:
+        return self.store.text(self.row)
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.store.tokens(self.row)
+
+    @property
+    def token_ids(self) -> List[int]:
+        return self.store.token_ids(self.row)
+
+    @property
+    def n_tokens(self) -> int:
+        return self.store.n_tokens(self.row)
+
+    def __repr__(self) -> str:
+        return f"Chunk(source={self.source!r}, row={self.row}, tokens={self.n_tokens})"
+
+class _Legacy:
+    def __init__(self):
+        self.source, self.text, self.tokens = "", "", []
+
+_LEGACY_RECORD = sys.getsizeof(_Legacy()) + sys.getsizeof(_Legacy().__dict__)
+
+def _legacy_chunk_bytes(source: str, text: str, tokens: List[str]) -> int:
+    """Approximate footprint of the old @dataclass Chunk(source, text, tokens: list[str])."""
+    return (_LEGACY_RECORD + sys.getsizeof(text) + sys.getsizeof(tokens)
+            + sum(map(sys.getsizeof, tokens)))  # re.findall() made one str object per token
+
+def memory_report(store: ChunkStore, rows: Sequence[int], sample: int = 2000) -> Dict:
+    """
+    Bytes per chunk for `rows` of `store`: the compact layout (measured: buffers,
+    vocab, one Chunk view + list slot per row) vs the previous layout (estimated
+    from an evenly spaced sample of up to `sample` rows). Shared buffers are
+    counted in full, so dead rows left by incremental updates count against compact.
+    """
+    n = len(rows)
+    parts = store.nbytes()
+    parts["views"] = n * (sys.getsizeof(Chunk(store, 0)) + 8)
+    compact = sum(parts.values())
+    step = max(1, n // max(1, sample))
+    picked = rows[::step]
+    legacy_sampled = sum(_legacy_chunk_bytes(store.source(r), store.text(r), store.tokens(r)) for r in picked)
+    legacy = legacy_sampled / len(picked) * n + n * 8 if picked else 0
+    return {
+        "chunks": n,
+        "tokens": sum(store.n_tokens(r) for r in rows),
+        "vocab": len(store.vocab),
+        "mapped": store.mapped,
+        "compact": {"bytes": compact, "bytes_per_chunk": round(compact / n, 1) if n else 0.0, "parts": parts},
+        "legacy_estimate": {"bytes": int(legacy), "bytes_per_chunk": round(legacy / n, 1) if n else 0.0,
+                            "sampled_chunks": len(picked)},
+        "ratio": round(legacy / compact, 2) if compact else None,
+    }
@@ -0,0 +1,169 @@
+# server/context_packer.py
+# Token-budgeted INTERNAL_CONTEXT assembly for /chat
+# -----------------------------------------------------------------------
+# Retrieved chunks go through three passes before they reach the prompt:
+#   1) merge    chunks of the same source whose text overlaps (the chunker
+#               repeats the last CHUNK_OVERLAP chars of a chunk at the start of
+#               the next) or contains one another -> one passage, no repeats
+#   2) dedup    drop passages whose word-shingle Jaccard similarity with a
+#               better-ranked passage is >= threshold (copies across files)
+#   3) budget   keep passages in rank order while they fit the token budget;
+#               the first one that does not fit is cut to the remaining room
+# Tokens are counted with tiktoken for the configured model; when the encoding
+# is unavailable (offline, unknown model) a ~4 chars/token estimate is used.
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+SEPARATOR = "\n\n"
+
+@dataclass
+class Passage:
+    source: str
+    text: str
+    score: float
+    rank: int        # best rank among the chunks merged into it
+    chunks: int = 1
+
+class TokenCounter:
+    """tiktoken encoding for `model`, or a character estimate when it cannot be loaded."""
+    def __init__(self, model: str):
+        self._enc = None
+        if tiktoken is not None:
+            try:
+                self._enc = tiktoken.encoding_for_model(model)
+            except Exception:
+                try:
+                    self._enc = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    self._enc = None  # no cached encoding and no network
+        self.name = self._enc.name if self._enc is not None else "approx-4cpt"
+
+    def count(self, text: str) -> int:
+        if self._enc is not None:
+            return len(self._enc.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / 4)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self._enc is not None:
+            ids = self._enc.encode(text, disallowed_special=())
+            return text if len(ids) <= max_tokens else self._enc.decode(ids[:max_tokens])
+        return text[:max_tokens * 4]
+
+def _overlap(a: str, b: str, min_overlap: int) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 if shorter than min_overlap)."""
+    probe = b[:min_overlap]
+    if min_overlap <= 0 or len(probe) < min_overlap:
+        return 0
+    start = max(0, len(a) - len(b))
+    pos = a.find(probe, start)
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos   # earliest match = longest overlap
+        pos = a.find(probe, pos + 1)
+    return 0
+
+def _join(a: str, b: str, min_overlap: int) -> str | None:
+    """a and b glued without the repeated text, or None if they do not overlap."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    n = _overlap(a, b, min_overlap)
+    if n:
+        return a + b[n:]
+    n = _overlap(b, a, min_overlap)
+    if n:
+        return b + a[n:]
+    return None
+
+def _merge_same_source(passages: List[Passage], min_overlap: int) -> List[Passage]:
+    out: List[Passage] = []
+    for p in passages:
+        merged = True
+        while merged:  # a new join can bridge two passages already kept
+            merged = False
+            for i, q in enumerate(out):
+                if q.source != p.source:
+                    continue
+                text = _join(q.text, p.text, min_overlap)
+                if text is not None:
+                    p = Passage(q.source, text, max(q.score, p.score), min(q.rank, p.rank), q.chunks + p.chunks)
+                    del out[i]
+                    merged = True
+                    break
+        out.append(p)
+    return sorted(out, key=lambda p: p.rank)
+
+def _shingles(text: str, n: int = 5) -> set:
+    words = text.lower().split()
+    if len(words) <= n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def pack_context(
+    docs: List[Dict],
+    counter: TokenCounter,
+    budget: int,
+    dedup_threshold: float = 0.85,
+    min_overlap: int = 100,
+) -> Tuple[str, Dict]:
+    """
+    Ranked retrieval hits [{source, text, score}] -> (context string, report).
+    The report carries the packed token count plus what each pass removed.
+    min_overlap should sit well below the chunker overlap but above the length of
+    boilerplate lines (headers, TOC dots) that repeat within a document.
+    """
+    passages = [Passage(d.get("source", ""), d["text"].strip(), float(d.get("score", 0.0)), r)
+                for r, d in enumerate(docs) if (d.get("text") or "").strip()]
+    merged = _merge_same_source(passages, min_overlap)
+
+    kept: List[Passage] = []
+    kept_shingles: List[set] = []
+    near_dupes = 0
+    for p in merged:
+        sh = _shingles(p.text)
+        if any(len(sh & other) / len(sh | other) >= dedup_threshold for other in kept_shingles):
+            near_dupes += 1
+            continue
+        kept.append(p)
+        kept_shingles.append(sh)
+
+    sep_tokens = counter.count(SEPARATOR)
+    parts: List[str] = []
+    used, truncated, dropped = 0, False, 0
+    for p in kept:
+        cost = counter.count(p.text) + (sep_tokens if parts else 0)
+        if used + cost <= budget:
+            parts.append(p.text)
+            used += cost
+            continue
+        room = budget - used - (sep_tokens if parts else 0)
+        if not truncated and room >= 32:  # a stub of a passage is not worth its tokens
+            parts.append(counter.truncate(p.text, room))
+            truncated = True
+            used = budget
+        else:
+            dropped += 1
+    context = SEPARATOR.join(parts)
+    return context, {
+        "tokens": counter.count(context) if parts else 0,
+        "budget": budget,
+        "tokenizer": counter.name,
+        "chunks": len(passages),
+        "passages": len(parts),
+        "merged": len(passages) - len(merged),
+        "near_duplicates": near_dupes,
+        "dropped": dropped,
+        "truncated": truncated,
+    }
@@ -0,0 +1,182 @@
+# server/graph_client.py
+# Shared Graph API client + outbound send scheduler (WhatsApp Cloud API)
+# -----------------------------------------------------------------------
+# - One httpx.AsyncClient for the application lifetime: keep-alive pool with
+#   limits, HTTP/2 when the optional `h2` package is installed
+# - RateLimiter: messages-per-second budget with a small burst (GCRA);
+#   rate <= 0 disables it
+# - request(): retries with full-jitter exponential backoff (Retry-After
+#   honoured, capped). Idempotent methods (GET, ...) retry 429, 5xx and any
+#   transport error; others (POST /messages) only retry 429 and errors that
+#   prove the request never reached Graph (connect / pool timeouts), since
+#   a read timeout or 5xx may follow an accepted message and a retry would
+#   send the user a duplicate. retry_unsafe=True opts a POST into full retries
+# - Per-recipient ordering: calls for the same recipient hold a FIFO lock
+#   across rate-limit waits and retries, so a retried message is never
+#   overtaken by the next one
+# - base_url is configurable, so everything can run against a local mock
+#   Graph server
+
+from __future__ import annotations
+
+import time
+import random
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (httpx HTTP/2 support)
+except Exception:
+    h2 = None
+
+_IDEMPOTENT = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# the request was never sent: safe to retry any method
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class RateLimiter:
+    """At most `rate` acquisitions per second on average, up to `burst` back to back."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._tat = 0.0  # theoretical arrival time of the next acquisition
+        self.waited = 0.0
+
+    async def acquire(self) -> None:
+        if self._interval <= 0:
+            return
+        now = time.monotonic()
+        t = max(self._tat, now)
+        self._tat = t + self._interval  # reserve before sleeping: callers are served in call order
+        delay = t - (self.burst - 1) * self._interval - now
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+class _RecipientLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class GraphClient:
+    """Pooled, rate-limited, retrying client for the Graph API."""
+    def __init__(self, base_url: str, token: str, rate: float = 20.0, burst: int = 5,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 http2: bool = True, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.limiter = RateLimiter(rate, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http2 = http2 and h2 is not None
+        if http2 and h2 is None:
+            print("[WARN] HTTP/2 requested but 'h2' is not installed; using HTTP/1.1 keep-alive")
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._recipients: Dict[str, _RecipientLock] = {}
+        self.requests = self.retries = self.throttled = self.failed = 0
+
+    # --- lifecycle -----------------------------------------------------------
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:  # lazily, for callers outside the app lifespan
+            self.start()
+        return self._client
+
+    def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, http2=self.http2, limits=self.limits, timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- requests ------------------------------------------------------------
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("Retry-After", ""))
+                return min(self.backoff_max, max(0.0, retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _send(self, method: str, url: str, rate_limited: bool, retry_unsafe: bool,
+                    **kwargs) -> httpx.Response:
+        full_retry = retry_unsafe or method.upper() in _IDEMPOTENT
+        attempt = 0
+        while True:
+            if rate_limited:
+                await self.limiter.acquire()
+            self.requests += 1
+            response: Optional[httpx.Response] = None
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response
+                if response.status_code == 429:
+                    self.throttled += 1
+                error: Exception = httpx.HTTPStatusError(
+                    f"{response.status_code} from {method} {url}", request=response.request, response=response)
+                retryable = full_retry or response.status_code == 429
+            except httpx.TransportError as e:
+                error = e
+                retryable = full_retry or isinstance(e, _NOT_SENT)
+            except httpx.HTTPStatusError:
+                self.failed += 1  # 4xx other than 429: not retryable
+                raise
+            if not retryable or attempt >= self.max_retries:
+                self.failed += 1
+                raise error
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    async def request(self, method: str, url: str, *, recipient: Optional[str] = None,
+                      rate_limited: bool = False, retry_unsafe: bool = False, **kwargs) -> httpx.Response:
+        """
+        Call the Graph API (url relative to base_url, or absolute). Calls naming
+        the same recipient run one at a time in call order; rate_limited ones
+        spend the messages-per-second budget. retry_unsafe=True retries a
+        non-idempotent call like a GET (only where a duplicate is harmless).
+        Raises after the last retry.
+        """
+        if recipient is None:
+            return await self._send(method, url, rate_limited, retry_unsafe, **kwargs)
+        slot = self._recipients.get(recipient)
+        if slot is None:
+            slot = self._recipients[recipient] = _RecipientLock()
+        slot.users += 1
+        try:
+            async with slot.lock:
+                return await self._send(method, url, rate_limited, retry_unsafe, **kwargs)
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self._recipients[recipient]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "rate_per_s": self.limiter.rate,
+            "rate_wait_s": round(self.limiter.waited, 3),
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "recipients_pending": len(self._recipients),
+        }
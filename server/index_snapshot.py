@@ -0,0 +1,127 @@
+# server/index_snapshot.py
+# On-disk BM25 index snapshots -- versioned, fingerprinted, memory-mapped
+# -----------------------------------------------------------------------
+# One snapshot lives in <index_dir>/<fingerprint[:16]>/ :
+#   meta.json     format version, full corpus fingerprint, scalars (N, avgdl, k1, b)
+#   vocab.json    interned terms; list position == token id
+#   sources.json  source filenames; list position == source id
+#   manifest.json per-file {sha256, size, mtime_ns} (drives incremental reindex)
+#   corpus.bin    UTF-8 chunk texts back to back (sliced via chunk_off)
+#   *.npy         chunk_off, chunk_src, tok_off, tok_ids,
+#                 post_off, post_chunk, post_tf, df, doc_len
+#
+# Arrays are opened with mmap_mode="r" and corpus.bin is mmapped, so a load
+# does no tokenising, chunking or df counting. A snapshot whose fingerprint
+# (file names/sizes/mtimes + chunker/tokeniser params) no longer matches the
+# corpus is simply not found, and the caller rebuilds.
+
+from __future__ import annotations
+
+import os
+import json
+import mmap
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # snapshots are disabled without numpy
+
+SNAPSHOT_VERSION = 2
+
+ARRAY_NAMES = (
+    "chunk_off", "chunk_src", "tok_off", "tok_ids",
+    "post_off", "post_chunk", "post_tf", "df", "doc_len",
+)
+
+def available() -> bool:
+    return np is not None
+
+def corpus_fingerprint(files: List[Tuple[str, int, int | str]], params: Dict) -> str:
+    """Hash of (name, size, mtime_ns or content hash) for every corpus file plus the index params."""
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": SNAPSHOT_VERSION, "params": params}, sort_keys=True).encode())
+    for name, size, mtime_ns in sorted(files):
+        h.update(f"\0{name}\0{size}\0{mtime_ns}".encode())
+    return h.hexdigest()
+
+def _snapshot_dir(index_dir: Path, fingerprint: str) -> Path:
+    return index_dir / fingerprint[:16]
+
+def write_snapshot(
+    index_dir: Path,
+    fingerprint: str,
+    meta: Dict,
+    vocab: List[str],
+    sources: List[str],
+    manifest: Dict[str, Dict],
+    corpus: bytes,
+    arrays: Dict[str, "np.ndarray"],
+) -> Path:
+    """
+    Write a snapshot atomically (temp dir + rename) and prune stale siblings.
+    Safe when several workers race: the first rename wins, the rest are discarded.
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    final = _snapshot_dir(index_dir, fingerprint)
+    tmp = index_dir / f".tmp-{fingerprint[:16]}-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    try:
+        for name in ARRAY_NAMES:
+            np.save(tmp / f"{name}.npy", arrays[name], allow_pickle=False)
+        (tmp / "corpus.bin").write_bytes(corpus)
+        (tmp / "vocab.json").write_text(json.dumps(vocab, ensure_ascii=False), encoding="utf-8")
+        (tmp / "sources.json").write_text(json.dumps(sources, ensure_ascii=False), encoding="utf-8")
+        (tmp / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        # meta.json last: its presence marks a complete snapshot
+        meta = dict(meta, version=SNAPSHOT_VERSION, fingerprint=fingerprint)
+        (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        try:
+            tmp.rename(final)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # another worker got there first
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    for other in index_dir.iterdir():
+        if other.is_dir() and other != final and not other.name.startswith(".tmp-"):
+            shutil.rmtree(other, ignore_errors=True)
+    return final
+
+def load_snapshot(index_dir: Path, fingerprint: str) -> Optional[Dict]:
+    """
+    Return {"meta", "vocab", "sources", "manifest", "corpus", <array names>...} or None if
+    there is no complete snapshot for this exact fingerprint and format version.
+    """
+    if np is None:
+        return None
+    d = _snapshot_dir(index_dir, fingerprint)
+    meta_path = d / "meta.json"
+    if not meta_path.exists():
+        return None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("version") != SNAPSHOT_VERSION or meta.get("fingerprint") != fingerprint:
+            return None
+        snap: Dict = {
+            "meta": meta,
+            "vocab": json.loads((d / "vocab.json").read_text(encoding="utf-8")),
+            "sources": json.loads((d / "sources.json").read_text(encoding="utf-8")),
+            "manifest": json.loads((d / "manifest.json").read_text(encoding="utf-8")),
+        }
+        for name in ARRAY_NAMES:
+            snap[name] = np.load(d / f"{name}.npy", mmap_mode="r", allow_pickle=False)
+        corpus_path = d / "corpus.bin"
+        if corpus_path.stat().st_size:
+            with open(corpus_path, "rb") as f:
+                snap["corpus"] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            snap["corpus"] = b""
+        return snap
+    except Exception:
+        # corrupt/partial snapshot: treat as missing, caller rebuilds
+        return None
@@ -0,0 +1,191 @@
+# server/job_queue.py
+# Background work queue for webhooks (asyncio)
+# -----------------------------------------------------------------------
+# - KeyedJobQueue: bounded queue drained by a fixed pool of worker tasks.
+#   Jobs with the same key (e.g. a WhatsApp sender) run one at a time in
+#   submit order; different keys run concurrently, served round-robin
+# - submit() never blocks: it returns False when the queue is full, so the
+#   caller can shed load (e.g. answer 503 and let the sender redeliver)
+# - A failing job is logged and counted; it never stops its worker
+# - stats(): depth, running, wait / run time percentiles, outcome counters
+# - TTLSet: recently seen ids (message-id idempotency), in memory, bounded
+
+from __future__ import annotations
+
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Set
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class TTLSet:
+    """Ids seen in the last `ttl` seconds (oldest forgotten first beyond max_entries)."""
+    def __init__(self, ttl: float = 86400.0, max_entries: int = 100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()  # id -> expires_at, oldest first
+
+    def _expire(self, now: float) -> None:
+        while self._seen:
+            key, expires = next(iter(self._seen.items()))
+            if expires > now and len(self._seen) <= self.max_entries:
+                break
+            del self._seen[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._expire(time.monotonic())
+        return key in self._seen
+
+    def add(self, key: Hashable) -> bool:
+        """Remember key; False if it was already seen within the TTL."""
+        now = time.monotonic()
+        self._expire(now)
+        if key in self._seen:
+            return False
+        self._seen[key] = now + self.ttl
+        return True
+
+    def discard(self, key: Hashable) -> None:
+        self._seen.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+class _Job:
+    __slots__ = ("payload", "queued_at")
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self.queued_at = time.perf_counter()
+
+class KeyedJobQueue:
+    """Bounded per-key FIFO work queue served by `workers` asyncio tasks."""
+    def __init__(self, name: str, handler: Callable[[Hashable, Any], Awaitable[Any]],
+                 workers: int = 4, max_pending: int = 256):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending: Dict[Hashable, Deque[_Job]] = {}   # key -> jobs not started yet
+        self._ready: Deque[Hashable] = deque()            # keys with a job and none running
+        self._running: Set[Hashable] = set()
+        self._depth = 0
+        self._cond: asyncio.Condition | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        self._waits: Deque[float] = deque(maxlen=1000)   # seconds queued before start
+        self._runs: Deque[float] = deque(maxlen=1000)    # seconds in the handler
+        self.submitted = self.completed = self.failed = self.rejected = 0
+        self.max_depth = 0
+        self.on_done: Callable[[str, float, float], None] | None = None  # (outcome, wait_s, run_s)
+
+    # --- lifecycle -----------------------------------------------------------
+    def start(self) -> None:
+        """Spawn the workers (call from the running event loop, e.g. app startup)."""
+        if self._tasks:
+            return
+        self._cond = asyncio.Condition()
+        self._closing = False
+        self._tasks = [asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+                       for i in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Finish queued jobs for up to `timeout` seconds, then cancel the rest."""
+        if not self._tasks:
+            return
+        async with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        _, late = await asyncio.wait(self._tasks, timeout=timeout)
+        for t in late:
+            t.cancel()
+        if late:
+            await asyncio.gather(*late, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self) -> None:
+        """Wait until every submitted job has finished."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._depth and not self._running)
+
+    # --- submit / work -------------------------------------------------------
+    async def submit(self, key: Hashable, payload: Any) -> bool:
+        """Queue a job behind any earlier ones for the same key; False if the queue is full."""
+        if self._cond is None or self._closing or self._depth >= self.max_pending:
+            self.rejected += 1
+            return False
+        async with self._cond:
+            queue = self._pending.get(key)
+            if queue is None:
+                queue = self._pending[key] = deque()
+                if key not in self._running:
+                    self._ready.append(key)
+            queue.append(_Job(payload))
+            self._depth += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self._depth)
+            self._cond.notify()
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._ready or (self._closing and not self._depth))
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                queue = self._pending[key]
+                job = queue.popleft()
+                if not queue:
+                    del self._pending[key]
+                self._depth -= 1
+                self._running.add(key)
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                await self.handler(key, job.payload)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                outcome = "error"
+                self.failed += 1
+                print(f"[WARN] {self.name} job for {key!r} failed: {e!r}")
+            finally:
+                run_s = time.perf_counter() - started
+                wait_s = started - job.queued_at
+                self._waits.append(wait_s)
+                self._runs.append(run_s)
+                if self.on_done is not None:
+                    self.on_done(outcome, wait_s, run_s)
+                async with self._cond:
+                    self._running.discard(key)
+                    if key in self._pending:  # next job of this key goes to the back: round-robin
+                        self._ready.append(key)
+                    self._cond.notify_all()
+
+    # --- metrics -------------------------------------------------------------
+    def stats(self) -> Dict:
+        waits, runs = list(self._waits), list(self._runs)
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "queue_depth": self._depth,
+            "queue_max_depth": self.max_depth,
+            "queue_limit": self.max_pending,
+            "running": len(self._running),
+            "queued_keys": len(self._pending),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": {"p50": round(_pct(waits, 0.5) * 1000, 1), "p95": round(_pct(waits, 0.95) * 1000, 1),
+                        "max": round(max(waits, default=0.0) * 1000, 1)},
+            "run_ms": {"p50": round(_pct(runs, 0.5) * 1000, 1), "p95": round(_pct(runs, 0.95) * 1000, 1),
+                       "max": round(max(runs, default=0.0) * 1000, 1)},
+        }
@@ -0,0 +1,127 @@
+# server/single_flight.py
+# In-flight request coalescing (asyncio)
+# -----------------------------------------------------------------------
+# - SingleFlight.join(key, run) starts run(flight) once per key; concurrent
+#   callers with the same key get the same Flight instead of doing the work
+# - A Flight is a replayable log: the leader publish()es parts as they are
+#   produced (so streaming followers see them live), then finishes with a
+#   value or an error that every waiter receives
+# - A finished flight stays joinable for `window` seconds (a burst of the same
+#   question a moment later reuses it); failed flights are dropped at once
+# - The work runs in its own task, so a disconnecting caller -- leader
+#   included -- never cancels it for the others
+
+from __future__ import annotations
+
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+class Flight:
+    """Outcome of one shared call: parts in publish order, then a value or an error."""
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.parts: List[Any] = []
+        self.value: Any = None
+        self.error: BaseException | None = None
+        self.done = False
+        self.followers = 0
+        self._cond = asyncio.Condition()
+
+    async def publish(self, part: Any) -> None:
+        async with self._cond:
+            self.parts.append(part)
+            self._cond.notify_all()
+
+    async def _finish(self, value: Any = None, error: BaseException | None = None) -> None:
+        async with self._cond:
+            self.value, self.error, self.done = value, error, True
+            self._cond.notify_all()
+
+    async def first(self) -> Any:
+        """The first published part; raises the flight's error if it failed before publishing."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.parts or self.done)
+            if self.parts:
+                return self.parts[0]
+            raise self.error if self.error is not None else RuntimeError("Flight finished without output.")
+
+    async def stream(self, start: int = 0) -> AsyncIterator[Any]:
+        """Replay parts from `start`, then follow new ones until the flight is done."""
+        i = start
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.parts) > i or self.done)
+                new, finished = self.parts[i:], self.done  # done is set after the last publish
+            for part in new:
+                yield part
+            i += len(new)
+            if finished:
+                return
+
+    async def wait(self) -> Any:
+        """The flight's value; re-raises its error in every waiter."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class SingleFlight:
+    """Registry of live flights keyed by request identity."""
+    def __init__(self, window: float = 0.0, enabled: bool = True):
+        self.window = window
+        self.enabled = enabled
+        self._flights: Dict[Hashable, Tuple[Flight, float | None]] = {}  # key -> (flight, finished_at)
+        self._tasks: set = set()  # strong refs; the loop only keeps weak ones
+        self.leaders = self.followers = self.errors = 0
+
+    def join(self, key: Hashable, run: Callable[[Flight], Awaitable[Any]]) -> Tuple[Flight, bool]:
+        """
+        Return (flight, is_leader). Runs on the event loop thread, so look-up and
+        registration happen without an await in between.
+        """
+        entry = self._flights.get(key) if self.enabled else None
+        if entry is not None:
+            flight, finished_at = entry
+            if finished_at is None or time.monotonic() - finished_at <= self.window:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+        flight = Flight(key)
+        self.leaders += 1
+        if self.enabled:
+            self._flights[key] = (flight, None)
+        task = asyncio.get_running_loop().create_task(self._run(flight, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight, True
+
+    async def _run(self, flight: Flight, run: Callable[[Flight], Awaitable[Any]]) -> None:
+        try:
+            value = await run(flight)
+        except BaseException as e:  # incl. cancellation: waiters must not hang
+            self.errors += 1
+            self._forget(flight)
+            await flight._finish(error=e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        await flight._finish(value=value)
+        if self.window > 0 and self._flights.get(flight.key, (None,))[0] is flight:
+            self._flights[flight.key] = (flight, time.monotonic())
+            asyncio.get_running_loop().call_later(self.window, self._forget, flight)
+        else:
+            self._forget(flight)
+
+    def _forget(self, flight: Flight) -> None:
+        if self._flights.get(flight.key, (None,))[0] is flight:
+            del self._flights[flight.key]
+
+    def stats(self) -> Dict:
+        calls = self.leaders + self.followers
+        running = sum(1 for _, finished_at in self._flights.values() if finished_at is None)
+        return {"enabled": self.enabled, "window_s": self.window, "in_flight": running,
+                "recent": len(self._flights) - running,
+                "leaders": self.leaders, "coalesced": self.followers, "errors": self.errors,
+                "coalesce_rate": round(self.followers / calls, 4) if calls else 0.0}
@@ -0,0 +1,164 @@
+# server/stt_service.py
+# Warm, pooled speech-to-text (faster-whisper)
+# -----------------------------------------------------------------------
+# - Loads N WhisperModel instances once, in the background at startup
+#   (requests arriving earlier wait for the first model)
+# - One worker thread per instance: CTranslate2 releases the GIL while
+#   decoding, so threads give real parallelism without a model copy per
+#   process; cpu_threads is split across instances
+# - Bounded: at most `instances` transcriptions run and `max_queue` wait;
+#   beyond that transcribe() raises SttBusy straight away
+# - Audio is decoded from memory (no temp file)
+# - stats(): model load times, audio seconds processed, real-time factor
+#   (processing time / audio duration; < 1 is faster than real time)
+
+from __future__ import annotations
+
+import io
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List
+
+try:
+    from faster_whisper import WhisperModel  # pip install faster-whisper
+except Exception:
+    WhisperModel = None
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+class SttBusy(Exception):
+    """All instances busy and the wait queue is full."""
+
+class SttService:
+    def __init__(self, model_name: str, instances: int = 1, device: str = "cpu", compute_type: str = "int8",
+                 cpu_threads: int = 0, max_queue: int = 16, beam_size: int = 1):
+        self.model_name = model_name
+        self.instances = max(1, instances)
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // self.instances)
+        self.max_queue = max_queue
+        self.beam_size = beam_size
+        self._pool: ThreadPoolExecutor | None = None
+        self._idle: "queue.Queue" = queue.Queue()  # loaded models not in use
+        self._pending = 0                          # accepted, not finished (running + waiting)
+        self._running = 0
+        self._lock = threading.Lock()              # counters updated from worker threads
+        self.load_seconds: List[float] = []
+        self.load_errors = 0
+        self.requests = self.rejected = self.failed = 0
+        self.audio_seconds = 0.0
+        self.processing_seconds = 0.0
+        self._rtf: Deque[float] = deque(maxlen=500)
+
+    # --- lifecycle -----------------------------------------------------------
+    def start(self) -> None:
+        """Begin loading the instances in the worker threads."""
+        if self._pool is not None:
+            return
+        if WhisperModel is None:
+            print("[WARN] faster-whisper not installed; speech-to-text unavailable.")
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.instances, thread_name_prefix="stt")
+        for _ in range(self.instances):
+            self._pool.submit(self._load)
+
+    def _load(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            model = WhisperModel(self.model_name, device=self.device, compute_type=self.compute_type,
+                                 cpu_threads=self.cpu_threads)
+        except Exception as e:
+            with self._lock:
+                self.load_errors += 1
+            print(f"[WARN] Whisper model '{self.model_name}' failed to load :: {e}")
+            return
+        self.load_seconds.append(time.perf_counter() - t0)
+        print(f"[INFO] Whisper '{self.model_name}' instance {len(self.load_seconds)}/{self.instances} "
+              f"loaded in {self.load_seconds[-1]:.1f}s")
+        self._idle.put(model)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- transcription -------------------------------------------------------
+    def _transcribe(self, wav_bytes: bytes) -> str:
+        while True:  # waits for a model still loading
+            try:
+                model = self._idle.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if self.load_errors >= self.instances:
+                    raise RuntimeError("no Whisper model could be loaded")
+        with self._lock:
+            self._running += 1
+        try:
+            t0 = time.perf_counter()
+            segments, info = model.transcribe(io.BytesIO(wav_bytes), beam_size=self.beam_size)
+            text = " ".join([s.text for s in segments]).strip()  # decoding happens while iterating
+            elapsed = time.perf_counter() - t0
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._idle.put(model)
+        with self._lock:
+            self.audio_seconds += info.duration
+            self.processing_seconds += elapsed
+            if info.duration > 0:
+                self._rtf.append(elapsed / info.duration)
+        return text
+
+    async def transcribe(self, wav_bytes: bytes) -> str:
+        """Transcribe WAV bytes (16k mono) on a warm instance, off the event loop."""
+        if self._pool is None:
+            raise RuntimeError("speech-to-text service not started")
+        if self._pending >= self.instances + self.max_queue:
+            self.rejected += 1
+            raise SttBusy()
+        self._pending += 1
+        self.requests += 1
+        try:
+            text = await asyncio.get_running_loop().run_in_executor(self._pool, self._transcribe, wav_bytes)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._pending -= 1
+        return text or "(no speech detected)"
+
+    # --- metrics -------------------------------------------------------------
+    def queue_depth(self) -> int:
+        return max(0, self._pending - self._running)
+
+    def stats(self) -> Dict:
+        rtf = list(self._rtf)
+        return {
+            "model": self.model_name,
+            "instances": self.instances,
+            "loaded": len(self.load_seconds),
+            "load_errors": self.load_errors,
+            "load_s": [round(t, 2) for t in self.load_seconds],
+            "cpu_threads": self.cpu_threads,
+            "running": self._running,
+            "queue_depth": self.queue_depth(),
+            "queue_limit": self.max_queue,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "audio_s": round(self.audio_seconds, 1),
+            "processing_s": round(self.processing_seconds, 1),
+            "rtf": round(self.processing_seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+            "rtf_p50": round(_pct(rtf, 0.5), 3),
+            "rtf_p95": round(_pct(rtf, 0.95), 3),
+        }
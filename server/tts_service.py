@@ -0,0 +1,263 @@
+# server/tts_service.py
+# Resident text-to-speech with sentence streaming and an audio cache (Coqui TTS)
+# -----------------------------------------------------------------------
+# - The TTS model is loaded once, at startup, on a dedicated worker thread
+#   and every synthesis runs there (off the event loop, one at a time)
+# - Text is split into sentences and synthesised progressively: stream()
+#   yields each sentence's MP3 as soon as it is ready while the next one is
+#   already being synthesised. MP3 frames concatenate, so the pieces form
+#   one playable stream
+# - AudioCache: content-addressed MP3 files, key = sha256(model, voice,
+#   whitespace-normalised sentence), least recently used evicted above max_bytes;
+#   repeated (standard) sentences are never synthesised twice. All cache file
+#   I/O (including the first-use scan of the folder) runs in a thread, never
+#   on the event loop
+# - Encoding to MP3 goes through ffmpeg (same dependency as the STT path)
+
+from __future__ import annotations
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+try:
+    from TTS.api import TTS  # pip install TTS
+except Exception:
+    TTS = None
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+def split_sentences(text: str, min_chars: int = 20, max_chars: int = 300) -> List[str]:
+    """Sentences for progressive synthesis; short fragments merge forward, long ones split on commas/spaces."""
+    out: List[str] = []
+    buf = ""
+    for part in _SENTENCE_END.split(text.strip()):
+        part = " ".join(part.split())
+        if not part:
+            continue
+        buf = f"{buf} {part}" if buf else part
+        if len(buf) >= min_chars:
+            out.append(buf)
+            buf = ""
+    if buf:
+        if out and len(out[-1]) + len(buf) < max_chars:
+            out[-1] = f"{out[-1]} {buf}"
+        else:
+            out.append(buf)
+    pieces: List[str] = []
+    for s in out:
+        while len(s) > max_chars:
+            cut = s.rfind(",", 0, max_chars)
+            if cut < max_chars // 2:  # no clause break in the back half: last word boundary
+                cut = s.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(s[:cut + 1].strip())
+            s = s[cut + 1:].strip()
+        if s:
+            pieces.append(s)
+    return pieces
+
+class AudioCache:
+    """Content-addressed MP3 files under `root`, LRU-evicted above max_bytes."""
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # key -> bytes, least recently used first
+        self._lock = threading.Lock()  # get/put run in worker threads
+        self._scanned = False
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def _scan(self) -> None:
+        """Index files left by earlier runs (once, on first use, under the lock)."""
+        self._scanned = True
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for p in self.root.glob("*/*.mp3"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, p.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+        self.bytes = sum(self._sizes.values())
+        self._evict()
+
+    @staticmethod
+    def key(text: str, model: str, voice: str) -> str:
+        norm = " ".join(text.split())
+        return hashlib.sha256("\0".join((model, voice, norm)).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.mp3"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Blocking (file I/O): call from a thread."""
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            if key not in self._sizes:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)  # recency survives restarts
+            except OSError:
+                self.bytes -= self._sizes.pop(key)
+                self.misses += 1
+                return None
+            self._sizes.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Blocking (file I/O): call from a thread."""
+        if not data or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            path = self._path(key)
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            self.bytes += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._sizes), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+def _encode_mp3(samples, sample_rate: int, bitrate: str) -> bytes:
+    """Float samples in [-1, 1] -> MP3 bytes (no ID3/Xing headers, so pieces concatenate cleanly)."""
+    import ffmpeg  # pip install ffmpeg-python
+    import numpy as np
+    pcm = (np.clip(np.asarray(samples, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    out, _ = (
+        ffmpeg
+        .input("pipe:", format="s16le", ac=1, ar=str(sample_rate))
+        .output("pipe:", format="mp3", acodec="libmp3lame", audio_bitrate=bitrate, write_xing=0, id3v2_version=0)
+        .run(input=pcm, capture_stdout=True, quiet=True)
+    )
+    return out
+
+class TtsService:
+    def __init__(self, model_name: str, voice: str = "", cache_dir: Path | None = None,
+                 cache_max_bytes: int = 256 * 1024 * 1024, bitrate: str = "64k"):
+        self.model_name = model_name
+        self.voice = voice
+        self.bitrate = bitrate
+        self.cache = AudioCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+        self._pool: ThreadPoolExecutor | None = None
+        self._model = None
+        self.load_seconds: Optional[float] = None
+        self.load_error: Optional[str] = None
+        self.sentences = 0
+        self.synth_seconds = 0.0
+        self.audio_seconds = 0.0
+
+    # --- lifecycle -----------------------------------------------------------
+    def start(self) -> None:
+        """Load the model on the worker thread (synthesis requests queue behind it)."""
+        if self._pool is not None:
+            return
+        if TTS is None:
+            print("[WARN] Coqui TTS not installed; text-to-speech unavailable.")
+            self.load_error = "TTS not installed"
+            return
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+        self._pool.submit(self._load)
+
+    def _load(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            self._model = TTS(model_name=self.model_name)
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"[WARN] TTS model '{self.model_name}' failed to load :: {e}")
+            return
+        self.load_seconds = time.perf_counter() - t0
+        print(f"[INFO] TTS '{self.model_name}' loaded in {self.load_seconds:.1f}s")
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- synthesis -----------------------------------------------------------
+    def _synthesize(self, sentence: str) -> bytes:
+        if self._model is None:
+            raise RuntimeError(f"TTS model unavailable: {self.load_error or 'not loaded'}")
+        t0 = time.perf_counter()
+        wav = self._model.tts(text=sentence, speaker=self.voice or None)
+        sample_rate = self._model.synthesizer.output_sample_rate
+        mp3 = _encode_mp3(wav, sample_rate, self.bitrate)
+        self.synth_seconds += time.perf_counter() - t0
+        self.audio_seconds += len(wav) / sample_rate
+        self.sentences += 1
+        return mp3
+
+    async def _sentence(self, sentence: str) -> bytes:
+        key = AudioCache.key(sentence, self.model_name, self.voice) if self.cache is not None else ""
+        if self.cache is not None:
+            data = await asyncio.to_thread(self.cache.get, key)
+            if data is not None:
+                return data
+        if self._pool is None:
+            raise RuntimeError("text-to-speech service not started")
+        data = await asyncio.get_running_loop().run_in_executor(self._pool, self._synthesize, sentence)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, data)
+        return data
+
+    async def stream(self, text: str) -> AsyncIterator[bytes]:
+        """MP3 bytes sentence by sentence; the next sentence is synthesised while the current one is sent."""
+        sentences = split_sentences(text)
+        if not sentences:
+            return
+        nxt = asyncio.ensure_future(self._sentence(sentences[0]))
+        try:
+            for i in range(len(sentences)):
+                current = await nxt
+                if i + 1 < len(sentences):
+                    nxt = asyncio.ensure_future(self._sentence(sentences[i + 1]))
+                yield current
+        finally:
+            if not nxt.done():
+                nxt.cancel()
+
+    async def synthesize(self, text: str) -> bytes:
+        """Whole answer as one MP3 (cached sentences are reused)."""
+        return b"".join([piece async for piece in self.stream(text)])
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "voice": self.voice or None,
+            "loaded": self._model is not None,
+            "load_s": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            "load_error": self.load_error,
+            "sentences_synthesized": self.sentences,
+            "synth_s": round(self.synth_seconds, 1),
+            "audio_s": round(self.audio_seconds, 1),
+            "rtf": round(self.synth_seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
@@ -0,0 +1,194 @@
+# server/vector_index.py
+# Local chunk embeddings + ANN lookup for hybrid retrieval
+# -----------------------------------------------------------------------
+# - Pluggable CPU embedders (make_embedder):
+#     "hashing"               deterministic feature-hashing stand-in (offline, tests)
+#     "chroma-default"        Chroma's bundled ONNX all-MiniLM-L6-v2
+#     "st:<model name>"       sentence-transformers model, e.g. st:all-MiniLM-L6-v2
+# - VectorStore persists one collection per embedder under the configured
+#   Chroma directory; vectors are keyed by chunk content id, so only new or
+#   changed chunks are ever embedded (across reindexes and restarts)
+# - Without chromadb the same store falls back to a NumPy matrix (.npz) +
+#   exact cosine search in that directory; its (ids, vecs, row) are replaced
+#   as one tuple, so a query overlapping a sync() sees a consistent snapshot
+# - rrf_fuse() merges ranked id lists with reciprocal-rank fusion
+
+from __future__ import annotations
+
+import re
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import chromadb
+    import chromadb.config
+except Exception:
+    chromadb = None  # NumPy fallback store
+
+# ============================================================================
+# EMBEDDERS
+# ============================================================================
+class HashingEmbedder:
+    """
+    Signed feature hashing of word unigrams + bigrams into `dim` buckets, L2-normalised.
+    No model, no network, identical output on every machine -- a stand-in for tests
+    and offline runs, not a semantic model.
+    """
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for r, text in enumerate(texts):
+            for feat in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+                out[r, h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+class ChromaDefaultEmbedder:
+    """Chroma's bundled ONNX MiniLM (CPU; model files are fetched once and cached)."""
+    def __init__(self):
+        from chromadb.utils import embedding_functions
+        self._fn = embedding_functions.DefaultEmbeddingFunction()
+        self.name = "chroma-default"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.asarray(self._fn(list(texts)), dtype=np.float32)
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model: str):
+        from sentence_transformers import SentenceTransformer  # pip install sentence-transformers
+        self._model = SentenceTransformer(model, device="cpu")
+        self.name = f"st-{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.asarray(self._model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+def make_embedder(spec: str):
+    """Embedder from a VECTOR_EMBEDDER spec; "" -> None (vector retrieval disabled)."""
+    spec = (spec or "").strip()
+    if not spec:
+        return None
+    if spec == "hashing" or spec.startswith("hashing:"):
+        return HashingEmbedder(int(spec.split(":", 1)[1]) if ":" in spec else 512)
+    if spec == "chroma-default":
+        return ChromaDefaultEmbedder()
+    if spec.startswith("st:"):
+        return SentenceTransformerEmbedder(spec[3:])
+    raise ValueError(f"Unknown VECTOR_EMBEDDER {spec!r} (use hashing, chroma-default or st:<model>)")
+
+# ============================================================================
+# STORE
+# ============================================================================
+class VectorStore:
+    """Chunk vectors for one embedder, persisted under `path`, queried by cosine ANN."""
+    def __init__(self, path: Path, embedder, batch_size: int = 64):
+        self.path = Path(path)
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.collection_name = "chunks_" + re.sub(r"[^A-Za-z0-9_-]", "_", embedder.name)[:50]
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        if chromadb is not None:
+            client = chromadb.PersistentClient(path=str(self.path),
+                                               settings=chromadb.config.Settings(anonymized_telemetry=False))
+            self._col = client.get_or_create_collection(self.collection_name, metadata={"hnsw:space": "cosine"})
+        else:
+            self._col = None
+            self._npz = self.path / f"{self.collection_name}.npz"
+            ids: List[str] = []
+            vecs = np.zeros((0, 0), dtype=np.float32)
+            if self._npz.exists():
+                data = np.load(self._npz, allow_pickle=False)
+                ids, vecs = data["ids"].tolist(), data["vecs"]
+            # (ids, vecs, row): never mutated, only swapped whole by _add/_delete
+            self._snap: Tuple[List[str], np.ndarray, Dict[str, int]] = (
+                ids, vecs, {cid: r for r, cid in enumerate(ids)})
+
+    @property
+    def backend(self) -> str:
+        return "chroma" if self._col is not None else "numpy"
+
+    def _stored_ids(self) -> set:
+        if self._col is not None:
+            return set(self._col.get(include=[])["ids"])
+        return set(self._snap[0])
+
+    def sync(self, chunks: Dict[str, str]) -> Dict:
+        """
+        Make the store hold exactly `chunks` (content id -> text): embed the ids it
+        lacks, drop the ones no longer live. Returns counts for reporting.
+        """
+        with self._lock:
+            stored = self._stored_ids()
+            missing = [cid for cid in chunks if cid not in stored]
+            stale = [cid for cid in stored if cid not in chunks]
+            for a in range(0, len(missing), self.batch_size):
+                batch = missing[a:a + self.batch_size]
+                self._add(batch, self.embedder.embed([chunks[c] for c in batch]))
+            if stale:
+                self._delete(stale)
+            if self._col is None and (missing or stale):
+                ids, vecs, _ = self._snap
+                np.savez(self._npz, ids=np.asarray(ids, dtype=str), vecs=vecs)
+            return {"backend": self.backend, "embedder": self.embedder.name,
+                    "embedded": len(missing), "deleted": len(stale), "total": len(chunks)}
+
+    def _add(self, ids: List[str], vecs: np.ndarray) -> None:
+        if self._col is not None:
+            self._col.upsert(ids=ids, embeddings=vecs.tolist())
+            return
+        old_ids, old_vecs, old_row = self._snap
+        new_ids = old_ids + list(ids)
+        new_vecs = vecs if not len(old_ids) else np.vstack([old_vecs, vecs])
+        new_row = dict(old_row)
+        new_row.update((cid, len(old_ids) + i) for i, cid in enumerate(ids))
+        self._snap = (new_ids, new_vecs, new_row)
+
+    def _delete(self, ids: List[str]) -> None:
+        if self._col is not None:
+            self._col.delete(ids=ids)
+            return
+        old_ids, old_vecs, _ = self._snap
+        gone = set(ids)
+        keep = [r for r, cid in enumerate(old_ids) if cid not in gone]
+        new_ids = [old_ids[r] for r in keep]
+        self._snap = (new_ids, old_vecs[keep], {cid: r for r, cid in enumerate(new_ids)})
+
+    def query(self, text: str, n: int) -> List[Tuple[str, float]]:
+        """Top-n (content id, cosine similarity) for a query string."""
+        q = self.embedder.embed([text])[0]
+        if self._col is not None:
+            count = self._col.count()
+            if not count:
+                return []
+            res = self._col.query(query_embeddings=[q.tolist()], n_results=min(n, count), include=["distances"])
+            return [(cid, 1.0 - float(d)) for cid, d in zip(res["ids"][0], res["distances"][0])]
+        ids, vecs, _ = self._snap  # one read: ids and vecs always belong together
+        if not len(vecs):
+            return []
+        sims = vecs @ q
+        top = np.argpartition(-sims, min(n, len(sims)) - 1)[:n]
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(ids[r], float(sims[r])) for r in top]
+
+# ============================================================================
+# FUSION
+# ============================================================================
+def rrf_fuse(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Reciprocal-rank fusion: score(id) = sum over lists of 1 / (k + rank), rank from 1."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
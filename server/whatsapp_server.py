@@ -8,6 +8,26 @@ Capabilities:
 - POST /webhook  : Receive messages (text + audio)
 - Text -> agent  : Send text reply
 - Audio -> STT -> agent : Send text reply (and optional TTS reply back)
+- GET /metrics   : Prometheus metrics (webhook queue depth, job latency)
+
+Delivery:
+- POST /webhook acks immediately; every message of every entry/change in a
+  (batched) delivery becomes a job on a bounded local worker pool: different
+  senders run concurrently, one job at a time per sender, in timestamp order
+- Each message succeeds or fails on its own (metrics, /health, log)
+- All Graph API calls share one pooled client (keep-alive, HTTP/2 if `h2` is
+  installed); message sends spend a messages-per-second budget and sends to
+  one recipient stay in order. Retries use jittered backoff; message sends
+  only retry 429 and connect failures (a retry after a timeout or 5xx could
+  deliver the message twice), reads and media uploads also retry 5xx/timeouts.
+  WA_GRAPH_BASE can point at a local mock Graph server
+- Speech-to-text runs on STT_INSTANCES warm Whisper models loaded at startup
+  (server/stt_service.py), off the event loop with a bounded queue
+- Text-to-speech keeps one resident model (server/tts_service.py), speaks
+  answers sentence by sentence and caches each sentence's MP3 by content;
+  GET /say streams the audio as it is produced
+- Redeliveries are dropped by WhatsApp message id (TTL store); when the
+  queue is full the webhook answers 503 so Meta redelivers later
 
 IMPORTANT:
 - This service calls your LangGraph agent (`src/workflow/graph.py:app`).
@@ -17,18 +37,26 @@ IMPORTANT:
 from __future__ import annotations
 
 import os
-import io
 import json
+import time
 import tempfile
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Deque, Dict, List, Optional
 
-import httpx
 from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, StreamingResponse
 
+from server.admission import AdmissionController, Rejected
+from server.graph_client import GraphClient
+from server.stt_service import SttBusy, SttService
+from server.tts_service import TtsService
+from server.job_queue import KeyedJobQueue, TTLSet
+from server.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
 # --- WhatsApp Cloud API config (set in .env) ---
-GRAPH_BASE = "https://graph.facebook.com/v20.0"
+GRAPH_BASE = os.getenv("WA_GRAPH_BASE", "https://graph.facebook.com/v20.0")
 PHONE_NUMBER_ID = os.getenv("WA_PHONE_NUMBER_ID", "")
 GRAPH_TOKEN = os.getenv("WA_GRAPH_TOKEN", "")
 VERIFY_TOKEN = os.getenv("WA_VERIFY_TOKEN", "macrocomm-verify-token")
@@ -37,12 +65,34 @@ VERIFY_TOKEN = os.getenv("WA_VERIFY_TOKEN", "macrocomm-verify-token")
 ENABLE_STT = os.getenv("ENABLE_STT", "true").lower() == "true"
 ENABLE_TTS = os.getenv("ENABLE_TTS", "false").lower() == "true"
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+STT_INSTANCES = int(os.getenv("STT_INSTANCES", "2"))       # warm models = concurrent transcriptions
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0"))   # per instance; 0 = cores / instances
+STT_MAX_QUEUE = int(os.getenv("STT_MAX_QUEUE", "16"))      # voice notes waiting for a model
 TTS_MODEL = os.getenv("TTS_MODEL", "tts_models/en/vctk/vits")  # coqui TTS id
+TTS_VOICE = os.getenv("TTS_VOICE", "")                         # speaker id for multi-speaker models
+TTS_CACHE_MB = int(os.getenv("TTS_CACHE_MB", "256"))
+
+# --- Graph API client / outbound sends ---
+WA_SEND_RATE = float(os.getenv("WA_SEND_RATE", "20"))      # messages per second (0 = unlimited)
+WA_SEND_BURST = int(os.getenv("WA_SEND_BURST", "5"))
+WA_SEND_RETRIES = int(os.getenv("WA_SEND_RETRIES", "4"))   # retries on 429 / connect errors (+5xx for reads)
+WA_HTTP2 = os.getenv("WA_HTTP2", "true").lower() == "true"
+WA_HTTP_MAX_CONNECTIONS = int(os.getenv("WA_HTTP_MAX_CONNECTIONS", "20"))
+WA_HTTP_MAX_KEEPALIVE = int(os.getenv("WA_HTTP_MAX_KEEPALIVE", "10"))
+
+# --- Webhook job queue ---
+WA_WORKERS = int(os.getenv("WA_WORKERS", "8"))             # concurrent jobs (distinct senders)
+WA_QUEUE_MAX = int(os.getenv("WA_QUEUE_MAX", "256"))       # queued jobs before 503
+WA_DEDUP_TTL = float(os.getenv("WA_DEDUP_TTL", "86400"))   # seconds a message id is remembered
+WA_DEDUP_MAX = int(os.getenv("WA_DEDUP_MAX", "100000"))
 
 # Ensure runtime/media folders
 RUNTIME_DIR = Path("./runtime").resolve()
 MEDIA_DIR = RUNTIME_DIR / "media"
 MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+TTS_CACHE_DIR = RUNTIME_DIR / "tts_cache"
 
 # ---- Import the agent and build a tiny wrapper ----
 # We stream the graph and return the last state's "generation" value.
@@ -58,6 +108,23 @@ def run_agent(question: str) -> str:
         return str(last["generation"])
     return str(last)
 
+# ---- Admission control: bounded agent concurrency, fair per sender ----
+agent_admission = AdmissionController(
+    "agent",
+    max_concurrent=int(os.getenv("AGENT_MAX_CONCURRENT", "4")),
+    max_queue=int(os.getenv("AGENT_MAX_QUEUE", "32")),
+    max_queue_per_client=int(os.getenv("AGENT_MAX_QUEUE_PER_SENDER", "3")),
+    max_wait=float(os.getenv("AGENT_MAX_WAIT", "60")),
+)
+
+async def ask_agent(sender: str, question: str) -> str:
+    """run_agent() under admission control, off the event loop; a polite busy reply when rejected."""
+    try:
+        async with agent_admission.slot(sender):
+            return await run_in_threadpool(run_agent, question)
+    except Rejected as e:
+        return f"We're handling a lot of messages right now. Please try again in about {e.retry_after} seconds."
+
 # ---- Audio helpers: OGG/OPUS -> WAV16k, STT, TTS ----
 
 def transcode_to_wav16k(input_bytes: bytes) -> bytes:
@@ -79,72 +146,179 @@ def transcode_to_wav16k(input_bytes: bytes) -> bytes:
         fout.seek(0)
         return fout.read()
 
-def stt_transcribe(wav_bytes: bytes) -> str:
-    """Transcribe WAV bytes (16k mono) using faster-whisper locally."""
-    from faster_whisper import WhisperModel
-    model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as f:
-        f.write(wav_bytes)
-        f.flush()
-        segments, _ = model.transcribe(f.name, beam_size=1)
-    text = " ".join([s.text for s in segments]).strip()
-    return text or "(no speech detected)"
-
-def tts_synthesize_to_mp3(text: str) -> bytes:
-    """Synthesize TTS to MP3 using Coqui TTS model if enabled."""
-    if not ENABLE_TTS:
-        return b""
-    from TTS.api import TTS  # pip install TTS
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=True) as f:
-        TTS(model_name=TTS_MODEL).tts_to_file(text=text, file_path=f.name)
-        f.seek(0)
-        return f.read()
+stt = SttService(WHISPER_MODEL, instances=STT_INSTANCES, device=WHISPER_DEVICE,
+                 compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS, max_queue=STT_MAX_QUEUE)
+
+tts = TtsService(TTS_MODEL, voice=TTS_VOICE, cache_dir=TTS_CACHE_DIR if ENABLE_TTS else None,
+                 cache_max_bytes=TTS_CACHE_MB * 1024 * 1024)
 
 # ---- WhatsApp API helpers ----
 
+graph = GraphClient(
+    GRAPH_BASE, GRAPH_TOKEN,
+    rate=WA_SEND_RATE, burst=WA_SEND_BURST, max_retries=WA_SEND_RETRIES, http2=WA_HTTP2,
+    max_connections=WA_HTTP_MAX_CONNECTIONS, max_keepalive=WA_HTTP_MAX_KEEPALIVE,
+)
+
 async def wa_send_text(to_phone: str, text: str) -> Dict[str, Any]:
-    url = f"{GRAPH_BASE}/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {GRAPH_TOKEN}"}
     payload = {
         "messaging_product": "whatsapp",
         "to": to_phone,
         "type": "text",
         "text": {"body": text},
     }
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        return r.json()
+    r = await graph.request("POST", f"/{PHONE_NUMBER_ID}/messages", recipient=to_phone, rate_limited=True,
+                            json=payload)
+    return r.json()
 
 async def wa_upload_audio(mp3_bytes: bytes) -> Optional[str]:
     """Upload mp3 to WhatsApp and return media_id."""
-    url = f"{GRAPH_BASE}/{PHONE_NUMBER_ID}/media"
-    headers = {"Authorization": f"Bearer {GRAPH_TOKEN}"}
     files = {"file": ("reply.mp3", mp3_bytes, "audio/mpeg")}
     data = {"messaging_product": "whatsapp"}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, headers=headers, data=data, files=files)
-        r.raise_for_status()
-        return r.json().get("id")
+    # a repeated upload only leaves an unused media id behind, so it may retry like a read
+    r = await graph.request("POST", f"/{PHONE_NUMBER_ID}/media", retry_unsafe=True, data=data, files=files)
+    return r.json().get("id")
 
 async def wa_send_audio(to_phone: str, media_id: str) -> Dict[str, Any]:
-    url = f"{GRAPH_BASE}/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {GRAPH_TOKEN}"}
     payload = {
         "messaging_product": "whatsapp",
         "to": to_phone,
         "type": "audio",
         "audio": {"id": media_id},
     }
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        return r.json()
+    r = await graph.request("POST", f"/{PHONE_NUMBER_ID}/messages", recipient=to_phone, rate_limited=True,
+                            json=payload)
+    return r.json()
+
+async def wa_download_media(media_id: str) -> bytes:
+    """Resolve a media id to its URL, then download the bytes."""
+    meta = await graph.request("GET", f"/{media_id}")
+    media_url = meta.json().get("url")
+    r = await graph.request("GET", media_url, timeout=60)
+    return r.content
 
 # ---- FastAPI app ----
 
 app = FastAPI(title="Macrocomm WhatsApp Webhook", version="1.0")
 
+# ---- Webhook job queue: ack first, work later ----
+
+async def answer_message(from_phone: str, msg: Dict[str, Any]) -> None:
+    """
+    Reply to one WhatsApp message.
+    - Text: forward to agent and reply with text
+    - Audio: download, transcode, STT, forward transcript to agent, reply with text
+    """
+    mtype = msg.get("type")
+    if mtype == "text":
+        text = (msg.get("text", {}) or {}).get("body", "").strip()
+        if not text:
+            await wa_send_text(from_phone, "Empty message.")
+            return
+        answer = await ask_agent(from_phone, text)
+        await wa_send_text(from_phone, answer)
+
+    elif mtype == "audio" and ENABLE_STT:
+        audio_id = (msg.get("audio", {}) or {}).get("id")
+        if not audio_id:
+            await wa_send_text(from_phone, "Couldn't read audio.")
+            return
+        ogg = await wa_download_media(audio_id)
+        # Transcode (blocking: off the event loop) + STT on a warm model
+        wav16 = await run_in_threadpool(transcode_to_wav16k, ogg)
+        try:
+            text = await stt.transcribe(wav16)
+        except SttBusy:
+            await wa_send_text(from_phone, "We're receiving a lot of voice notes right now. "
+                                           "Please send your question as text or try again shortly.")
+            return
+        answer = await ask_agent(from_phone, text)
+        await wa_send_text(from_phone, answer)
+
+        # Optional: send TTS reply as audio
+        if ENABLE_TTS:
+            mp3 = await tts.synthesize(answer)
+            if mp3:
+                media_id = await wa_upload_audio(mp3)
+                if media_id:
+                    await wa_send_audio(from_phone, media_id)
+    else:
+        await wa_send_text(from_phone, "Send text or a voice note, please.")
+
+async def handle_message(from_phone: str, msg: Dict[str, Any]) -> None:
+    """Queue job for one message (a sender's jobs run one at a time, in order); outcome recorded per message."""
+    mtype = str(msg.get("type") or "unknown")
+    t0 = time.perf_counter()
+    try:
+        await answer_message(from_phone, msg)
+    except Exception as e:
+        _message_done(msg, from_phone, mtype, "error", t0)
+        try:
+            await wa_send_text(from_phone, "Sorry, we couldn't process your message. Please try again.")
+        except Exception:
+            pass
+        raise RuntimeError(f"message {msg.get('id')} ({mtype}): {e!r}") from e
+    _message_done(msg, from_phone, mtype, "ok", t0)
+
+recent_messages: Deque[Dict[str, Any]] = deque(maxlen=50)  # last outcomes, for /health
+
+def _message_done(msg: Dict[str, Any], sender: str, mtype: str, outcome: str, t0: float) -> None:
+    MESSAGES.inc(type=mtype, outcome=outcome)
+    recent_messages.append({"id": msg.get("id"), "from": sender, "type": mtype, "outcome": outcome,
+                            "ms": round((time.perf_counter() - t0) * 1000, 1)})
+
+wa_queue = KeyedJobQueue("whatsapp", handle_message, workers=WA_WORKERS, max_pending=WA_QUEUE_MAX)
+seen_messages = TTLSet(ttl=WA_DEDUP_TTL, max_entries=WA_DEDUP_MAX)
+
+WEBHOOK_MESSAGES = REGISTRY.counter("whatsapp_webhook_messages_total", "Webhook messages by intake result.",
+                                    ["result"])
+JOB_SECONDS = REGISTRY.histogram("whatsapp_job_seconds", "Message job latency: queue wait and handling.", ["phase"])
+MESSAGES = REGISTRY.counter("whatsapp_messages_total", "Handled messages by type and outcome.", ["type", "outcome"])
+JOBS = REGISTRY.counter("whatsapp_jobs_total", "Finished message jobs.", ["outcome"])
+REGISTRY.gauge("whatsapp_queue_depth", "Message jobs waiting for a worker.", fn=lambda: wa_queue.stats()["queue_depth"])
+REGISTRY.gauge("whatsapp_jobs_running", "Message jobs being handled.", fn=lambda: wa_queue.stats()["running"])
+REGISTRY.counter("graph_requests_total", "Graph API HTTP requests (including retries).", fn=lambda: graph.requests)
+REGISTRY.counter("graph_retries_total", "Graph API retries after 429/5xx/network errors.", fn=lambda: graph.retries)
+REGISTRY.counter("graph_throttled_total", "Graph API 429 responses.", fn=lambda: graph.throttled)
+REGISTRY.counter("graph_failed_total", "Graph API calls failed after retries.", fn=lambda: graph.failed)
+REGISTRY.gauge("stt_model_load_seconds", "Total time spent loading the warm Whisper models.",
+               fn=lambda: sum(stt.load_seconds))
+REGISTRY.gauge("stt_models_loaded", "Warm Whisper models.", fn=lambda: len(stt.load_seconds))
+REGISTRY.gauge("stt_queue_depth", "Voice notes waiting for a Whisper model.", fn=lambda: stt.queue_depth())
+REGISTRY.counter("stt_audio_seconds_total", "Seconds of audio transcribed.", fn=lambda: stt.audio_seconds)
+REGISTRY.counter("stt_processing_seconds_total", "Seconds spent transcribing (RTF = this / audio seconds).",
+                 fn=lambda: stt.processing_seconds)
+REGISTRY.counter("stt_rejected_total", "Voice notes rejected with the STT queue full.", fn=lambda: stt.rejected)
+REGISTRY.counter("tts_sentences_synthesized_total", "Sentences synthesised (cache misses).",
+                 fn=lambda: tts.sentences)
+REGISTRY.counter("tts_cache_hits_total", "Sentences served from the audio cache.",
+                 fn=lambda: tts.cache.hits if tts.cache else 0)
+REGISTRY.gauge("tts_cache_bytes", "Bytes held by the audio cache.", fn=lambda: tts.cache.bytes if tts.cache else 0)
+REGISTRY.gauge("whatsapp_dedup_ids", "Message ids remembered for de-duplication.", fn=lambda: len(seen_messages))
+
+def _job_done(outcome: str, wait_s: float, run_s: float) -> None:
+    JOBS.inc(outcome=outcome)
+    JOB_SECONDS.observe(wait_s, phase="wait")
+    JOB_SECONDS.observe(run_s, phase="run")
+
+wa_queue.on_done = _job_done
+
+@app.on_event("startup")
+async def _startup():
+    graph.start()
+    if ENABLE_STT:
+        stt.start()  # loads in the background; early voice notes wait for the first model
+    if ENABLE_TTS:
+        tts.start()
+    wa_queue.start()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await wa_queue.stop()  # drains jobs first: they still send replies
+    await graph.aclose()
+    stt.shutdown()
+    tts.shutdown()
+
 @app.get("/webhook")
 def webhook_verify(hub_mode: str = "", hub_challenge: str = "", hub_verify_token: str = ""):
     """Meta verification handshake."""
@@ -152,83 +326,79 @@ def webhook_verify(hub_mode: str = "", hub_challenge: str = "", hub_verify_token
         return Response(content=hub_challenge, media_type="text/plain")
     return Response(status_code=403)
 
+def _timestamp(msg: Dict[str, Any]) -> int:
+    try:
+        return int(msg.get("timestamp") or 0)
+    except (TypeError, ValueError):
+        return 0
+
 @app.post("/webhook")
 async def webhook_receive(request: Request):
     """
-    Receive WhatsApp messages (text and audio).
-    - Text: forward to agent and reply with text
-    - Audio: download, transcode, STT, forward transcript to agent, reply with text
+    Receive WhatsApp messages and ack at once; handle_message() runs them on the job queue.
+    Every message of every entry/change is queued; already-seen ids are skipped. The
+    body reports each message id as queued/duplicate/rejected; 503 if any was rejected
+    (queue full), so Meta redelivers and only the rejected ones are queued again.
     """
     try:
         payload = await request.json()
-        # Navigate entry -> changes -> messages
-        for entry in payload.get("entry", []):
-            for change in entry.get("changes", []):
-                value = change.get("value", {})
-                messages = value.get("messages", [])
-                if not messages:
-                    continue
-                from_phone = messages[0].get("from", "")
-
-                msg = messages[0]
-                mtype = msg.get("type")
-                if mtype == "text":
-                    text = (msg.get("text", {}) or {}).get("body", "").strip()
-                    if not text:
-                        await wa_send_text(from_phone, "Empty message.")
-                        continue
-                    answer = run_agent(text)
-                    await wa_send_text(from_phone, answer)
-
-                elif mtype == "audio" and ENABLE_STT:
-                    audio_id = (msg.get("audio", {}) or {}).get("id")
-                    if not audio_id:
-                        await wa_send_text(from_phone, "Couldn't read audio.")
-                        continue
-                    # Download audio
-                    url_media = f"{GRAPH_BASE}/{audio_id}"
-                    headers = {"Authorization": f"Bearer {GRAPH_TOKEN}"}
-                    async with httpx.AsyncClient(timeout=60) as client:
-                        meta = await client.get(url_media, headers=headers)
-                        meta.raise_for_status()
-                        media_url = meta.json().get("url")
-                        audio = await client.get(media_url, headers=headers)
-                        audio.raise_for_status()
-                        ogg = audio.content
-                    # Transcode + STT
-                    wav16 = transcode_to_wav16k(ogg)
-                    text = stt_transcribe(wav16)
-                    answer = run_agent(text)
-                    await wa_send_text(from_phone, answer)
-
-                    # Optional: send TTS reply as audio
-                    if ENABLE_TTS:
-                        mp3 = tts_synthesize_to_mp3(answer)
-                        if mp3:
-                            media_id = await wa_upload_audio(mp3)
-                            if media_id:
-                                await wa_send_audio(from_phone, media_id)
-                else:
-                    await wa_send_text(from_phone, "Send text or a voice note, please.")
-
     except Exception as e:
-        # Never crash the webhook; log locally and ack 200 so Meta doesn't retry forever
         print("[webhook error]", repr(e))
-
-    return Response(status_code=200)
+        return Response(status_code=200)
+
+    # Navigate entry -> changes -> messages; batches may interleave senders
+    messages: List[Dict[str, Any]] = []
+    for entry in payload.get("entry", []) if isinstance(payload, dict) else []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            messages.extend(m for m in value.get("messages", []) or [] if isinstance(m, dict))
+    # Stable sort: per-sender order follows the message timestamps, delivery order breaks ties
+    messages.sort(key=_timestamp)
+
+    results: Dict[str, List[str]] = {"queued": [], "duplicate": [], "rejected": []}
+    for msg in messages:
+        msg_id = msg.get("id")
+        if msg_id and not seen_messages.add(msg_id):
+            result = "duplicate"
+        elif await wa_queue.submit(msg.get("from", ""), msg):
+            result = "queued"
+        else:
+            if msg_id:
+                seen_messages.discard(msg_id)  # not handled: accept the redelivery
+            result = "rejected"
+        WEBHOOK_MESSAGES.inc(result=result)
+        results[result].append(msg_id or "")
+
+    if results["rejected"]:
+        return JSONResponse({"ok": False, "error": "busy", **results}, status_code=503, headers={"Retry-After": "30"})
+    return JSONResponse({"ok": True, **results})
 
 # --- Dev helpers ---
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {
+        "ok": True,
+        "queue": wa_queue.stats(),
+        "dedup_ids": len(seen_messages),
+        "recent_messages": list(recent_messages),
+        "graph": graph.stats(),
+        "stt": stt.stats(),
+        "tts": tts.stats(),
+        "agent_admission": agent_admission.stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/say")
 async def say(text: str = "Macrocomm test"):
     if not ENABLE_TTS:
         return JSONResponse({"ok": False, "error": "ENABLE_TTS=false"})
-    mp3 = tts_synthesize_to_mp3(text)
-    return StreamingResponse(io.BytesIO(mp3), media_type="audio/mpeg")
+    if tts.load_error:
+        return JSONResponse({"ok": False, "error": tts.load_error}, status_code=503)
+    return StreamingResponse(tts.stream(text), media_type="audio/mpeg")
 
 # Run locally:
 # uvicorn server.whatsapp_server:app --host 0.0.0.0 --port 8000 --reload
@@ -1,6 +1,7 @@
 // static/macrocomm-widget.js  (v3 stable)
 // Minimal, robust widget with fixed-height header, full-rounded card,
 // and start-of-message scrolling so answers are readable from the top.
+// Answers stream in token by token (SSE from /chat with stream:true).
 
 (() => {
   const BRAND_URL = "/brand.json";
@@ -46,23 +47,53 @@
   }
 
   /* ------------- transport ------------- */
-  async function sendMessage(apiChatPath, message, history) {
+  // POST to /chat with stream:true and read Server-Sent Events off the body.
+  // onEvent(name, data) fires for "citations", "token" ({delta}), "meta" ({answer, meta}) and "error".
+  async function streamMessage(apiChatPath, message, history, onEvent) {
     const payload = {
       message: typeof message === "string" ? message : String(message ?? ""),
-      history: Array.isArray(history) ? history : []
+      history: Array.isArray(history) ? history : [],
+      stream: true
     };
-    if (!payload.message.trim()) return { answer: "" };
+    if (!payload.message.trim()) return;
 
     const r = await fetch(apiChatPath || "/chat", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
       body: JSON.stringify(payload)
     });
     if (!r.ok) {
       const t = await r.text().catch(() => "");
       throw new Error(`${r.status} ${r.statusText}${t ? ` — ${t}` : ""}`);
     }
-    return await r.json();
+
+    // Server without streaming support: hand back the whole answer as one meta event
+    const ctype = r.headers.get("content-type") || "";
+    if (!ctype.includes("text/event-stream") || !r.body) {
+      const data = await r.json();
+      onEvent("meta", { answer: data?.answer ?? data?.text ?? data?.output ?? "", meta: data?.meta });
+      return;
+    }
+
+    const reader = r.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buf.indexOf("\n\n")) >= 0) {
+        const block = buf.slice(0, sep);
+        buf = buf.slice(sep + 2);
+        let name = "message", data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event:")) name = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).replace(/^ /, "");
+        }
+        if (data) onEvent(name, JSON.parse(data));
+      }
+    }
   }
 
   /* ------------- styles (injected quickly to avoid FOUC) ------------- */
@@ -141,7 +172,7 @@
 
   /* ------------- behaviour ------------- */
   function appendMsg(container, text, isUser=false){
-    if (!text) return;
+    if (!text) return null;
     const m = ce("div", `mc-msg${isUser ? " mc-user" : ""}`);
 
     // Format bot messages with HTML, keep user messages as plain text
@@ -163,6 +194,15 @@
       // For user messages: normal bottom scroll
       container.scrollTop = container.scrollHeight;
     }
+    return m;
+  }
+
+  // Streamed bot text: first call creates the bubble (and scrolls to its start),
+  // later calls only re-render it so the reader isn't yanked around.
+  function renderBotText(container, bubble, text){
+    if (!bubble) return appendMsg(container, text, false);
+    bubble.innerHTML = sanitiseAndFormatLLM(text);
+    return bubble;
   }
 
   function showWelcome(container, welcome){
@@ -209,14 +249,29 @@
       if (!q) return;
       appendMsg(body, q, true);
       input.value = "";
+      let bubble = null, text = "", frame = 0;
       try {
-        const data = await sendMessage(apiChat, q, history);
-        const answer =
-          data?.answer ?? data?.text ?? data?.output ??
-          (typeof data === "string" ? data : JSON.stringify(data));
-        appendMsg(body, answer, false);
+        let answer = null;
+        await streamMessage(apiChat, q, history, (name, data) => {
+          if (name === "token") {
+            text += data?.delta || "";
+            // re-render at most once per animation frame
+            if (!frame) frame = requestAnimationFrame(() => {
+              frame = 0;
+              bubble = renderBotText(body, bubble, text);
+            });
+          } else if (name === "meta") {
+            answer = data?.answer ?? text;
+          } else if (name === "error") {
+            throw new Error(data?.error || "stream failed");
+          }
+        });
+        if (frame) { cancelAnimationFrame(frame); frame = 0; }
+        answer = answer ?? text;
+        bubble = renderBotText(body, bubble, answer);
         history.push([q, answer]);
       } catch (err) {
+        if (frame) { cancelAnimationFrame(frame); frame = 0; }
         appendMsg(body, `Sorry, I hit an error: ${err.message}`, false);
       }
     }
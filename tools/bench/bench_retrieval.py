@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+tools/bench/bench_retrieval.py
+------------------------------
+Retrieval micro-benchmarks: _chunk_text, _tokenise_norm, BM25Index build and
+BM25Index.search, on the real txt/ corpus and on synthetic corpora derived
+from it (default 1x, 10x, 100x, 1000x).
+
+Per scale it reports:
+  • build time split into chunk / tokenise / index stages
+  • peak RSS of the process and the RSS added by chunks and by the index
+  • chunk storage bytes per chunk, compact store vs the old per-chunk layout
+  • p50/p95/p99 latency of search(q, k) over a fixed query set
+  • batched search_many() cost per query (when numpy/scipy are installed)
+
+Each scale runs in its own subprocess, so peak RSS is per scale. With the
+current in-memory index, 1000x needs tens of GB of RAM; pick --scales to fit.
+
+Synthetic corpora: copy #c of every document has its paragraphs shuffled and
+~20 of its words renamed to copy-specific variants ("policyv37"), so chunk
+boundaries, df and vocabulary all grow with scale (vocabulary linearly --
+a pessimistic assumption). Everything is seeded, so runs are comparable.
+
+The query set is sampled once from the real corpus (seeded) and is identical
+at every scale; its hash is recorded so results from different commits are
+only compared like for like.
+
+USAGE:
+  python tools/bench/bench_retrieval.py                       # all scales -> runtime/bench/
+  python tools/bench/bench_retrieval.py --scales 1 10 --out bench.json
+  python tools/bench/bench_retrieval.py --scales 1 10 --compare runtime/bench/<older>.json
+"""
+
+from __future__ import annotations
+import os, re, sys, json, time, random, hashlib, argparse, platform, subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+SEED = 1234
+DEFAULT_SCALES = [1, 10, 100, 1000]
+RENAMES_PER_COPY = 20
+CANNED_QUERIES = [
+    "leave application procedure", "annual leave days", "sick leave certificate",
+    "travel and accommodation entitlements", "company vehicle usage policy",
+    "who is the ceo", "chief operating officer", "disciplinary code",
+    "social media policy", "expense claim approval", "credit control and debt collection",
+    "information security password", "overtime approval", "remote work",
+]
+
+# ---- memory helpers ---------------------------------------------------------
+def _rss_mb() -> Optional[float]:
+    """Current resident set size (Linux /proc; None elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except Exception:
+        return None
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB on Linux
+
+def _delta(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return round(b - a, 1) if a is not None and b is not None else None
+
+def _pcts(samples_s: List[float]) -> Dict[str, float]:
+    s = sorted(samples_s)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000
+    return {"p50_ms": round(pick(0.50), 4), "p95_ms": round(pick(0.95), 4), "p99_ms": round(pick(0.99), 4),
+            "mean_ms": round(sum(s) / len(s) * 1000, 4), "max_ms": round(s[-1] * 1000, 4)}
+
+# ---- corpus + queries -------------------------------------------------------
+def _query_set(docs, n: int) -> List[str]:
+    from server.api_server import _tokenise_norm
+    rng = random.Random(SEED)
+    queries = list(CANNED_QUERIES)
+    while len(queries) < n:
+        _, text = docs[rng.randrange(len(docs))]
+        toks = _tokenise_norm(text)
+        if len(toks) < 6:
+            continue
+        width = rng.randint(2, 5)
+        start = rng.randrange(len(toks) - width)
+        queries.append(" ".join(toks[start:start + width]))
+    return queries[:n]
+
+def _synthetic(docs, scale: int) -> List[tuple]:
+    """scale copies of every (name, text); copy 0 is the original."""
+    out = list(docs)
+    word_re = re.compile(r"[A-Za-z]{5,}")
+    for c in range(1, scale):
+        rng = random.Random(SEED * 1_000_003 + c)
+        for name, text in docs:
+            paras = re.split(r"\n\s*\n", text)
+            rng.shuffle(paras)
+            text_c = "\n\n".join(paras)
+            words = sorted(set(word_re.findall(text_c)))
+            if words:
+                chosen = rng.sample(words, min(RENAMES_PER_COPY, len(words)))
+                pat = re.compile(r"\b(" + "|".join(map(re.escape, chosen)) + r")\b")
+                text_c = pat.sub(lambda m: f"{m.group(1)}v{c}", text_c)
+            out.append((f"{Path(name).stem}__copy{c}.txt", text_c))
+    return out
+
+def _chunk_bytes(index) -> Dict:
+    """Bytes per chunk of the compact store vs the old dataclass + list[str] layout (estimated)."""
+    rep = index.memory()
+    return {"compact_per_chunk": rep["compact"]["bytes_per_chunk"],
+            "legacy_per_chunk": rep["legacy_estimate"]["bytes_per_chunk"], "ratio": rep["ratio"]}
+
+# ---- one scale (runs in a subprocess) ----------------------------------------
+def run_scale(txt_dir: Path, scale: int, k: int, n_queries: int, repeats: int) -> Dict:
+    from server.api_server import (BM25Index, ChunkStore, _chunk_text, _read_txt_files, _tokenise_norm)
+
+    rss_base = _rss_mb()  # interpreter + server imports
+    t0 = time.perf_counter()
+    real = _read_txt_files(txt_dir)
+    load_s = time.perf_counter() - t0
+    queries = _query_set(real, n_queries)
+
+    t0 = time.perf_counter()
+    docs = _synthetic(real, scale)
+    synth_s = time.perf_counter() - t0
+    corpus_mb = sum(len(t.encode("utf-8")) for _, t in docs) / 2**20
+
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    pieces = [(name, piece) for name, text in docs for piece in _chunk_text(text)]
+    chunk_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    store = ChunkStore()
+    for name, piece in pieces:
+        store.add(name, piece, _tokenise_norm(piece))
+    tokenise_s = time.perf_counter() - t0
+    del pieces
+    rss1 = _rss_mb()
+
+    t0 = time.perf_counter()
+    index = BM25Index(store)
+    index_s = time.perf_counter() - t0
+    rss2 = _rss_mb()
+
+    for q in queries[:20]:  # warm-up
+        index.search(q, k=k)
+    samples: List[float] = []
+    for _ in range(repeats):
+        for q in queries:
+            t = time.perf_counter()
+            index.search(q, k=k)
+            samples.append(time.perf_counter() - t)
+
+    batch = None
+    try:
+        t = time.perf_counter()
+        index._ensure_matrix()
+        matrix_s = time.perf_counter() - t
+        t = time.perf_counter()
+        index.search_many(queries, k=k)
+        batch_s = time.perf_counter() - t
+        batch = {"matrix_build_s": round(matrix_s, 4), "total_s": round(batch_s, 4),
+                 "per_query_ms": round(batch_s / len(queries) * 1000, 4)}
+    except Exception as e:  # numpy/scipy missing
+        batch = {"skipped": repr(e)}
+
+    return {
+        "scale": scale,
+        "docs": len(docs),
+        "corpus_mb": round(corpus_mb, 2),
+        "chunks": index.N,
+        "vocab": len(index.postings),
+        "postings": sum(len(p) for p in index.postings.values()),
+        "build_s": {"load": round(load_s, 4), "synthesise": round(synth_s, 4), "chunk": round(chunk_s, 4),
+                    "tokenise": round(tokenise_s, 4), "index": round(index_s, 4),
+                    "total": round(chunk_s + tokenise_s + index_s, 4)},
+        "memory_mb": {"peak_rss": round(_peak_rss_mb(), 1) if _peak_rss_mb() is not None else None,
+                      "baseline_rss": round(rss_base, 1) if rss_base is not None else None,
+                      "chunks_rss": _delta(rss0, rss1), "index_rss": _delta(rss1, rss2)},
+        "chunk_bytes": _chunk_bytes(index),
+        "query": {"k": k, "n": len(samples), **_pcts(samples)},
+        "batch": batch,
+    }
+
+# ---- driver -----------------------------------------------------------------
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _compare(current: Dict, baseline_path: Path) -> None:
+    base = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if base["meta"].get("query_set_sha") != current["meta"]["query_set_sha"]:
+        print("[WARN] Query sets differ; latency comparison is not like for like.")
+    by_scale = {r["scale"]: r for r in base["results"] if "error" not in r}
+    print(f"\nvs {baseline_path.name} (commit {base['meta'].get('commit')}): ratio new/old, <1 is faster")
+    for r in current["results"]:
+        b = by_scale.get(r["scale"])
+        if b is None or "error" in r:
+            continue
+        ratio = lambda new, old: f"{new / old:.2f}x" if old else "n/a"
+        print(f"  {r['scale']:>5}x  build {ratio(r['build_s']['total'], b['build_s']['total'])}"
+              f"  p50 {ratio(r['query']['p50_ms'], b['query']['p50_ms'])}"
+              f"  p99 {ratio(r['query']['p99_ms'], b['query']['p99_ms'])}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--txt-dir", default=None, help="Corpus folder (default: the server's txt dir)")
+    ap.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Corpus multipliers")
+    ap.add_argument("--k", type=int, default=6, help="top-k per query")
+    ap.add_argument("--queries", type=int, default=200, help="Size of the fixed query set")
+    ap.add_argument("--repeats", type=int, default=3, help="Passes over the query set per scale")
+    ap.add_argument("--out", default=None, help="JSON output (default runtime/bench/bench_<ts>.json; '-' = stdout)")
+    ap.add_argument("--compare", default=None, help="Earlier JSON result to print ratios against")
+    ap.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)  # one scale, JSON on stdout
+    args = ap.parse_args()
+
+    if args.txt_dir is None:
+        from server.api_server import _effective_paths
+        args.txt_dir = _effective_paths()["txt_dir"]
+    txt_dir = Path(args.txt_dir)
+
+    if args.worker is not None:
+        print(json.dumps(run_scale(txt_dir, args.worker, args.k, args.queries, args.repeats)))
+        return
+
+    from server.api_server import _read_txt_files, CHUNK_MAX_CHARS, CHUNK_OVERLAP, BM25_K1, BM25_B
+    queries = _query_set(_read_txt_files(txt_dir), args.queries)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "txt_dir": str(txt_dir),
+            "params": {"k": args.k, "queries": args.queries, "repeats": args.repeats, "seed": SEED,
+                       "chunk_max_chars": CHUNK_MAX_CHARS, "chunk_overlap": CHUNK_OVERLAP,
+                       "k1": BM25_K1, "b": BM25_B},
+            "query_set_sha": hashlib.sha256("\n".join(queries).encode("utf-8")).hexdigest()[:16],
+        },
+        "results": [],
+    }
+    for scale in args.scales:
+        print(f"[INFO] scale {scale}x ...", file=sys.stderr, flush=True)
+        cmd = [sys.executable, str(Path(__file__).resolve()), "--worker", str(scale), "--txt-dir", str(txt_dir),
+               "--k", str(args.k), "--queries", str(args.queries), "--repeats", str(args.repeats)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            report["results"].append({"scale": scale, "error": (proc.stderr or "no output").strip()[-2000:]})
+            print(f"[WARN] scale {scale}x failed (exit {proc.returncode})", file=sys.stderr)
+            continue
+        r = json.loads(lines[-1])
+        report["results"].append(r)
+        print(f"  {scale:>5}x  {r['chunks']:>8} chunks  build {r['build_s']['total']:.2f}s"
+              f"  peak RSS {r['memory_mb']['peak_rss']} MB  chunks +{r['memory_mb']['chunks_rss']} MB"
+              f" ({r['chunk_bytes']['compact_per_chunk']:.0f} B/chunk)  index +{r['memory_mb']['index_rss']} MB"
+              f"  p50 {r['query']['p50_ms']:.3f} ms  p95 {r['query']['p95_ms']:.3f} ms"
+              f"  p99 {r['query']['p99_ms']:.3f} ms", file=sys.stderr, flush=True)
+
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        out = Path(args.out) if args.out else ROOT / "runtime" / "bench" / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(text, encoding="utf-8")
+        print(f"[OK] {out}", file=sys.stderr)
+    if args.compare:
+        _compare(report, Path(args.compare))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+tools/check_corp_to_txt.py
+--------------------------
+Regression check for corp_to_txt.convert_all with a process pool: a page whose
+OCR raises an exception that cannot cross the process boundary (pytesseract's
+TesseractNotFoundError) must fail only its own file; every other file still converts.
+
+Builds synthetic PDFs in a temp folder and stubs pytesseract.image_to_string, so no
+tesseract install is needed. The stub reaches the workers via fork (POSIX only).
+
+USAGE:
+  python tools/check_corp_to_txt.py
+"""
+
+from __future__ import annotations
+import sys, tempfile, multiprocessing
+from pathlib import Path
+
+import fitz
+import pytesseract
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import corp_to_txt
+
+BAD_SIZE = 100   # points; pages this size make the OCR stub raise
+
+def _fake_ocr(img, lang="eng", config=""):
+    if img.width < BAD_SIZE * 5:  # at 300 dpi: bad pages ~420 px wide, good ones ~830
+        raise pytesseract.TesseractNotFoundError()
+    return "SCANNED PAGE TEXT"
+
+def _make_pdfs(src: Path):
+    def scanned(name: str, size: int, pages: int):
+        doc = fitz.open()
+        for _ in range(pages):
+            p = doc.new_page(width=size, height=size)
+            p.draw_rect(fitz.Rect(5, 5, 40, 20), color=(0, 0, 0), fill=(0, 0, 0))
+        doc.save(src / name)
+    scanned("BAD SCAN.pdf", BAD_SIZE, 3)
+    scanned("GOOD SCAN.pdf", 200, 4)
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Digital page " + "policy text " * 20)
+    doc.save(src / "DIGITAL.pdf")
+
+def main() -> int:
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("[SKIP] needs the fork start method (POSIX)")
+        return 0
+    multiprocessing.set_start_method("fork", force=True)
+    pytesseract.image_to_string = _fake_ocr
+    corp_to_txt.pytesseract.image_to_string = _fake_ocr
+    with tempfile.TemporaryDirectory() as tmp:
+        src, out = Path(tmp) / "src", Path(tmp) / "out"
+        src.mkdir()
+        _make_pdfs(src)
+        results = corp_to_txt.convert_all(sorted(src.glob("*.pdf")), out, workers=2)
+        status = {r["file"]: r["status"] for r in results}
+        expected = {"BAD SCAN.pdf": "failed", "GOOD SCAN.pdf": "ok", "DIGITAL.pdf": "ok"}
+        ok = status == expected and (out / "GOOD SCAN.txt").exists() and (out / "DIGITAL.txt").exists()
+    print(f"[{'OK' if ok else 'FAIL'}] statuses: {status}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
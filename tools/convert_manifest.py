@@ -0,0 +1,115 @@
+"""
+tools/convert_manifest.py
+-------------------------
+Content-hash manifest shared by corp_to_txt.py and pdf_ocr_to_txt.py, so a
+refresh only reconverts what changed.
+
+Stored next to the output folder (corp_docs/txt -> corp_docs/txt.manifest.json):
+  {"version": 1, "files": {"<name>.pdf": {
+      "sha256", "size", "mtime_ns",          # source identity
+      "extractor": "text" | "ocr" | "mixed", # what actually produced the output (mixed = some pages OCR'd)
+      "mode": "auto" | "ocr",                # what was asked for (--force-ocr / OCR-only tool)
+      "dpi", "langs",                        # OCR settings
+      "output": "<name>.txt" | null,         # null = converted to empty text
+      "output_sha256", "converted_at"}}}
+
+A source is reconverted when it is new, its content hash changed, its output
+is missing or was modified, the requested mode changed, or any of its pages
+were OCR'd and the DPI/languages changed. Sources whose size and mtime are
+unchanged are trusted without hashing. Outputs of deleted sources are removed.
+"""
+
+from __future__ import annotations
+import os, json, time, hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_VERSION = 1
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ConversionManifest:
+    def __init__(self, out_dir: Path):
+        self.out_dir = out_dir
+        self.path = out_dir.parent / f"{out_dir.name}.manifest.json"
+        self.files: Dict[str, Dict] = {}
+        self._hashes: Dict[str, str] = {}   # source hashes computed during plan()
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data.get("files", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable manifest {self.path.name} :: {e}")
+
+    def _source_hash(self, pdf: Path) -> str:
+        if pdf.name not in self._hashes:
+            self._hashes[pdf.name] = sha256_file(pdf)
+        return self._hashes[pdf.name]
+
+    def _reason(self, pdf: Path, settings: Dict) -> Optional[str]:
+        """Why pdf must be (re)converted, or None if its output is current."""
+        entry = self.files.get(pdf.name)
+        if entry is None:
+            return "new"
+        st = pdf.stat()
+        if (entry["size"], entry["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            if self._source_hash(pdf) != entry["sha256"]:
+                return "changed"
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)  # touched, same content
+        if entry["mode"] != settings["mode"]:
+            return "mode"
+        if entry["extractor"] != "text" and (entry["dpi"], entry["langs"]) != (settings["dpi"], settings["langs"]):
+            return "ocr settings"
+        if entry["output"] is not None:
+            out = self.out_dir / entry["output"]
+            if not out.exists() or sha256_file(out) != entry["output_sha256"]:
+                return "output missing or modified"
+        return None
+
+    def plan(self, pdfs: List[Path], settings: Dict, force: bool = False) -> Tuple[List[Path], List[str]]:
+        """Split pdfs into (to convert, unchanged names)."""
+        todo, skipped = [], []
+        for pdf in pdfs:
+            reason = "forced" if force else self._reason(pdf, settings)
+            if reason is None:
+                skipped.append(pdf.name)
+            else:
+                todo.append(pdf)
+        return todo, skipped
+
+    def record(self, pdf: Path, output: Optional[Path], extractor: str, settings: Dict) -> None:
+        """Note a finished conversion (output=None for empty text) and persist the manifest."""
+        st = pdf.stat()
+        self.files[pdf.name] = {
+            "sha256": self._source_hash(pdf), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "extractor": extractor, "mode": settings["mode"], "dpi": settings["dpi"], "langs": settings["langs"],
+            "output": output.name if output is not None else None,
+            "output_sha256": sha256_file(output) if output is not None else None,
+            "converted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.save()
+
+    def prune(self, present: List[str]) -> List[str]:
+        """Drop entries whose source is gone and delete their outputs; returns the removed outputs."""
+        removed = []
+        for name in [n for n in self.files if n not in set(present)]:
+            output = self.files.pop(name).get("output")
+            if output and (self.out_dir / output).exists():
+                (self.out_dir / output).unlink()
+                removed.append(output)
+        self.save()
+        return removed
+
+    def save(self) -> None:
+        self.out_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": MANIFEST_VERSION, "files": self.files}, indent=2, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
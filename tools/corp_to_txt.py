@@ -5,25 +5,42 @@ tools/corp_to_txt.py
 Convert PDFs in --src to plain text files in --out.
 
 • Parses "born-digital" PDFs with PyMuPDF (fast & accurate).
-• If extracted text is too short, automatically falls back to OCR.
+• Decides per page: only pages without a usable text layer are OCR'd, so
+  mixed PDFs (a few scanned pages) keep both kinds of text. If OCR fails on
+  a page, that page keeps its text layer and the file is retried next run.
 • You can force OCR for all files with --force-ocr.
+• OCR renders straight to 8-bit grayscale and hands the pixmap samples to
+  Pillow (no PNG encode/decode); time per stage is reported.
+• --workers N spreads documents, and the OCR pages of each document, over a
+  process pool (page order in every output file is preserved); per-file
+  timings and a summary are printed at the end. A file that fails is
+  reported as failed; the other files still convert.
+• Incremental: a content-hash manifest next to --out (see convert_manifest.py)
+  skips sources that are unchanged since their last conversion and removes the
+  outputs of deleted sources; --force reconverts everything.
 • Windows-friendly Tesseract detection (no PATH tweaks required).
 
 USAGE:
   python tools/corp_to_txt.py --src corp_docs --out corp_docs/txt
   # only one file (case-insensitive substring match)
   python tools/corp_to_txt.py --src corp_docs --out corp_docs/txt --only "VEHICLE EMERGENCY GUIDE.pdf"
+  # use every core (0 = os.cpu_count())
+  python tools/corp_to_txt.py --src corp_docs --out corp_docs/txt --workers 0
 """
 
 from __future__ import annotations
-import os, io, argparse, platform
+import os, time, argparse, platform
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import fitz                         # PyMuPDF
 from PIL import Image
 import pytesseract
 
+from convert_manifest import ConversionManifest
+
 # --- Windows-friendly: locate tesseract.exe if PATH isn't updated ----------
 def _wire_tesseract():
     if platform.system().lower() != "windows":
@@ -44,37 +61,67 @@ def _wire_tesseract():
 _wire_tesseract()
 # ---------------------------------------------------------------------------
 
-def extract_text_pdf(pdf_path: Path, min_len: int = 250) -> str:
-    """
-    Try structured extraction first; if result is too short, return "" so caller can OCR.
-    min_len guards against "parsed but basically empty" PDFs.
-    """
-    doc = fitz.open(pdf_path)
-    parts = []
-    for p in doc:
-        parts.append(p.get_text("text") or "")
-    text = "\n".join(parts).strip()
-    return text if len(text) >= min_len else ""
+# A page whose text layer has fewer characters than this is treated as scanned
+# (guards against "parsed but basically empty" pages: page numbers, stamps)
+PAGE_MIN_CHARS = 50
+
+# Light threshold (helps faint scans): <80 -> black, >200 -> white, rest kept
+_THRESHOLD_LUT = [255 if x > 200 else (0 if x < 80 else x) for x in range(256)]
+
+def _add_time(stages: Optional[Dict[str, float]], stage: str, seconds: float):
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+def extract_pages(pdf_path: Path, stages: Optional[Dict[str, float]] = None) -> List[str]:
+    """Structured (text layer) extraction, one string per page."""
+    t0 = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pages = [p.get_text("text") or "" for p in doc]
+    _add_time(stages, "text_layer", time.perf_counter() - t0)
+    return pages
+
+def needs_ocr(page_text: str, min_chars: int = PAGE_MIN_CHARS) -> bool:
+    return len(page_text.strip()) < min_chars
+
+def _ocr_page(p, dpi: int, langs: str, stages: Optional[Dict[str, float]] = None) -> str:
+    """OCR one fitz page at high DPI with a little pre-processing for cleaner text."""
+    t0 = time.perf_counter()
+    # Render page straight to an 8-bit grayscale bitmap
+    mat = fitz.Matrix(dpi/72.0, dpi/72.0)
+    pix = p.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+    t1 = time.perf_counter()
+    # Pillow image over the raw samples (no PNG round-trip), then the threshold LUT
+    img = Image.frombytes("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride)
+    img = img.point(_THRESHOLD_LUT)
+    t2 = time.perf_counter()
+    # OCR
+    txt = pytesseract.image_to_string(img, lang=langs, config="--oem 1 --psm 3") or ""
+    t3 = time.perf_counter()
+    _add_time(stages, "render", t1 - t0)
+    _add_time(stages, "preprocess", t2 - t1)
+    _add_time(stages, "ocr", t3 - t2)
+    return txt.strip()
 
 def ocr_pdf(pdf_path: Path, dpi: int = 300, langs: str = "eng") -> str:
     """
     OCR every page at high DPI with a little pre-processing for cleaner text.
     """
     doc = fitz.open(pdf_path)
-    chunks = []
-    for p in doc:
-        # Render page to bitmap
-        mat = fitz.Matrix(dpi/72.0, dpi/72.0)
-        pix = p.get_pixmap(matrix=mat, alpha=False)
-        # Pillow image
-        img = Image.open(io.BytesIO(pix.tobytes("png"))).convert("L")  # grayscale
-        # Light threshold (helps faint scans)
-        img = img.point(lambda x: 255 if x > 200 else (0 if x < 80 else x))
-        # OCR
-        txt = pytesseract.image_to_string(img, lang=langs, config="--oem 1 --psm 3") or ""
-        chunks.append(txt.strip())
+    chunks = [_ocr_page(p, dpi, langs) for p in doc]
     return "\n\n".join([c for c in chunks if c])
 
+def ocr_page(pdf_path: Path, page_no: int, dpi: int = 300, langs: str = "eng") -> Tuple[str, Dict[str, float]]:
+    """OCR a single page (0-based) -- the unit of work for --workers. Returns (text, stage seconds)."""
+    stages: Dict[str, float] = {}
+    with fitz.open(pdf_path) as doc:
+        return _ocr_page(doc[page_no], dpi, langs, stages), stages
+
+def join_pages(pages: List[str], ocr_used: bool) -> str:
+    """Text-layer-only documents keep the original layout; otherwise pages are separated by a blank line."""
+    if not ocr_used:
+        return "\n".join(pages).strip()
+    return "\n\n".join([c.strip() for c in pages if c.strip()])
+
 def save_txt(out_dir: Path, stem: str, content: str):
     out_dir.mkdir(parents=True, exist_ok=True)
     (out_dir / f"{stem}.txt").write_text(content, encoding="utf-8", errors="ignore")
@@ -82,6 +129,183 @@ def save_txt(out_dir: Path, stem: str, content: str):
 def should_process(file_name: str, only: Optional[str]) -> bool:
     return True if not only else (only.lower() in file_name.lower())
 
+# ---- parallel conversion (--workers) -----------------------------------------
+def _init_worker():
+    # one tesseract thread per process; the pool provides the parallelism
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _timed(fn, *args):
+    """(result, seconds, error). Errors come back as repr() strings: some exceptions
+    (e.g. pytesseract's TesseractNotFoundError) can't be unpickled in the parent and
+    would break the whole pool."""
+    t0 = time.perf_counter()
+    try:
+        return fn(*args), time.perf_counter() - t0, ""
+    except Exception as e:
+        return None, time.perf_counter() - t0, repr(e)
+
+def _probe(pdf_path: Path, force_ocr: bool) -> Tuple[List[str], Dict[str, float]]:
+    """Text layer of every page ('' for all of them under --force-ocr) and stage seconds."""
+    stages: Dict[str, float] = {}
+    if force_ocr:
+        with fitz.open(pdf_path) as doc:
+            return [""] * doc.page_count, stages
+    return extract_pages(pdf_path, stages), stages
+
+class _Inline:
+    """Executor stand-in for --workers 1: runs each task when it is submitted."""
+    def submit(self, fn, *args) -> Future:
+        fut: Future = Future()
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+@dataclass
+class _Job:
+    pdf: Path
+    started: float
+    mode: str = "text"                  # text | ocr | mixed (some pages OCR'd)
+    pages: List[str] = field(default_factory=list)
+    ocr_pages: int = 0
+    left: int = 0                       # OCR pages still running
+    ocr_ok: int = 0                     # OCR pages that succeeded
+    page_errors: List[str] = field(default_factory=list)  # OCR pages that failed (text layer kept)
+    work_s: float = 0.0                 # task seconds summed over workers
+    stages: Dict[str, float] = field(default_factory=dict)
+    error: str = ""
+
+def convert_all(pdfs: List[Path], out: Path, workers: int, force_ocr: bool = False,
+                dpi: int = 300, langs: str = "eng",
+                on_file: Optional[Callable[[Path, Dict], None]] = None) -> List[Dict]:
+    """
+    Convert pdfs into out/<stem>.txt. Each document is first probed for its
+    text layer; every page without usable text becomes its own OCR task, so a
+    large scan is spread over every worker. Pages are reassembled in page order.
+    Returns one timing record per file; on_file(pdf, record) fires as each file finishes.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 1 else _Inline()
+    pending: Dict[Future, Tuple[_Job, Optional[int]]] = {}   # future -> (job, page_no or None for the probe)
+    results: List[Dict] = []
+
+    def finish(job: _Job, content: str):
+        if content.strip():
+            save_txt(out, job.pdf.stem, content)
+            status = "ok"
+            print(f"[OK]  .PDF -> TXT: {job.pdf.name}")
+            print(f"[preview] {(out / (job.pdf.stem + '.txt')).name}")
+        else:
+            status = "empty"
+            print(f"[WARN] Empty text after OCR: {job.pdf.name}")
+        results.append({"file": job.pdf.name, "status": status, "mode": job.mode,
+                        "pages": len(job.pages), "ocr_pages": job.ocr_pages,
+                        "wall_s": round(time.perf_counter() - job.started, 3),
+                        "work_s": round(job.work_s, 3), "chars": len(content),
+                        "stages": {k: round(v, 3) for k, v in job.stages.items()},
+                        "page_errors": len(job.page_errors)})
+        if on_file:
+            on_file(job.pdf, results[-1])
+
+    def fail(job: _Job, error: str):
+        job.error = error
+        print(f"[WARN] Failed on {job.pdf.name} :: {error}")
+        results.append({"file": job.pdf.name, "status": "failed", "mode": job.mode,
+                        "pages": len(job.pages), "ocr_pages": job.ocr_pages,
+                        "wall_s": round(time.perf_counter() - job.started, 3),
+                        "work_s": round(job.work_s, 3), "chars": 0,
+                        "stages": {k: round(v, 3) for k, v in job.stages.items()},
+                        "page_errors": len(job.page_errors), "error": job.error})
+
+    def finish_ocr(job: _Job):
+        # a failed OCR page keeps its text layer; only an all-OCR file with no text at all fails
+        content = join_pages(job.pages, ocr_used=job.ocr_ok > 0)
+        if job.page_errors and job.mode == "ocr" and not content.strip():
+            fail(job, job.page_errors[0])
+        else:
+            finish(job, content)
+
+    try:
+        for pdf in pdfs:
+            job = _Job(pdf, time.perf_counter())
+            pending[pool.submit(_timed, _probe, pdf, force_ocr)] = (job, None)
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                job, page_no = pending.pop(fut)
+                if job.error:  # an earlier task of this file failed; drop the rest
+                    continue
+                try:
+                    value, secs, error = fut.result()
+                except Exception as e:  # the pool itself failed
+                    value, secs, error = None, 0.0, repr(e)
+                if error and page_no is not None:
+                    job.page_errors.append(error)
+                    print(f"[WARN] OCR failed on {job.pdf.name} page {page_no + 1}, keeping its text layer :: {error}")
+                    job.left -= 1
+                    if not job.left:
+                        finish_ocr(job)
+                    continue
+                if error:
+                    for other, (j, _) in pending.items():
+                        if j is job:
+                            other.cancel()
+                    fail(job, error)
+                    continue
+                job.work_s += secs
+                value, stages = value
+                for stage, t in stages.items():
+                    _add_time(job.stages, stage, t)
+                if page_no is None:
+                    job.pages = value
+                    # fallback (or forced) OCR for pages without a usable text layer, one task each
+                    todo = [i for i, t in enumerate(job.pages) if force_ocr or needs_ocr(t)]
+                    if not todo:
+                        finish(job, join_pages(job.pages, ocr_used=False))
+                        continue
+                    job.mode = "ocr" if len(todo) == len(job.pages) else "mixed"
+                    job.ocr_pages = job.left = len(todo)
+                    for i in todo:
+                        pending[pool.submit(_timed, ocr_page, job.pdf, i, dpi, langs)] = (job, i)
+                else:
+                    # keep a scrap of text layer (e.g. a page number) if OCR found nothing
+                    job.pages[page_no] = value or job.pages[page_no]
+                    job.ocr_ok += 1
+                    job.left -= 1
+                    if not job.left:
+                        finish_ocr(job)
+    finally:
+        pool.shutdown(wait=True)
+    return results
+
+def print_summary(results: List[Dict], wall_s: float, workers: int):
+    """Per-file timings (slowest first) and totals."""
+    if not results:
+        return
+    print("\n[TIMINGS] file (mode, OCR'd/pages): work s / wall s  [stage s]")
+    for r in sorted(results, key=lambda r: -r["work_s"]):
+        stages = ", ".join(f"{k} {v:.2f}" for k, v in r["stages"].items())
+        print(f"  {r['file']} ({r['mode']}, {r['ocr_pages']}/{r['pages']}, {r['status']}): "
+              f"{r['work_s']:.2f}s / {r['wall_s']:.2f}s  [{stages}]")
+    work = sum(r["work_s"] for r in results)
+    page_errors = sum(r["page_errors"] for r in results)
+    by = lambda key, value: sum(1 for r in results if r[key] == value)
+    totals: Dict[str, float] = {}
+    for r in results:
+        for stage, t in r["stages"].items():
+            _add_time(totals, stage, t)
+    print(f"[SUMMARY] {len(results)} files: {by('status', 'ok')} ok, {by('status', 'empty')} empty, "
+          f"{by('status', 'failed')} failed | "
+          f"text layer {sum(1 for r in results if r['mode'] == 'text' and r['status'] != 'failed')}, "
+          f"mixed {by('mode', 'mixed')}, OCR {by('mode', 'ocr')} | "
+          f"pages OCR'd {sum(r['ocr_pages'] for r in results)} of {sum(r['pages'] for r in results)}"
+          + (f" ({page_errors} failed, text layer kept)" if page_errors else "") + " | "
+          f"wall {wall_s:.2f}s, work {work:.2f}s ({work / max(wall_s, 1e-9):.1f}x on {workers} worker(s))")
+    print("[STAGES] " + ", ".join(f"{k} {v:.2f}s ({v / max(work, 1e-9):.0%})" for k, v in totals.items()))
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--src", required=True, help="Folder containing PDFs")
@@ -90,6 +314,9 @@ def main():
     ap.add_argument("--dpi", type=int, default=300, help="Render DPI for OCR")
     ap.add_argument("--only", default=None, help="Only process the first file whose name contains this substring")
     ap.add_argument("--force-ocr", action="store_true", help="OCR every file (skip structured extraction)")
+    ap.add_argument("--force", action="store_true", help="Reconvert every file, even if unchanged")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes for documents/OCR pages (1 = serial, 0 = one per CPU core)")
     args = ap.parse_args()
 
     src = Path(args.src).resolve()
@@ -98,36 +325,37 @@ def main():
     if not src.exists():
         raise FileNotFoundError(f"--src not found: {src}")
 
-    processed = 0
-    for pdf in sorted(src.glob("*.pdf")):
-        if not should_process(pdf.name, args.only):
-            continue
+    all_pdfs = sorted(src.glob("*.pdf"))
+    pdfs = [pdf for pdf in all_pdfs if should_process(pdf.name, args.only)]
+    if args.only:  # when --only is used, stop after first match
+        pdfs = pdfs[:1]
 
-        try:
-            stem = pdf.stem
-            content = ""
-            if not args.force_ocr:
-                content = extract_text_pdf(pdf)
-            if not content:
-                # fallback (or forced) OCR
-                content = ocr_pdf(pdf, dpi=args.dpi, langs=args.langs)
-
-            if content.strip():
-                save_txt(out, stem, content)
-                print(f"[OK]  .PDF -> TXT: {pdf.name}")
-                print(f"[preview] {(out / (stem + '.txt')).name}")
-            else:
-                print(f"[WARN] Empty text after OCR: {pdf.name}")
-
-            processed += 1
-            if args.only:  # when --only is used, stop after first match
-                break
+    manifest = ConversionManifest(out)
+    settings = {"mode": "ocr" if args.force_ocr else "auto", "dpi": args.dpi, "langs": args.langs}
+    if not args.only:
+        for name in manifest.prune([pdf.name for pdf in all_pdfs]):
+            print(f"[CLEAN] Removed {name} (source deleted)")
+    if not pdfs:
+        print("[INFO] No PDFs matched your filter.")
+        return
+    todo, skipped = manifest.plan(pdfs, settings, force=args.force)
+    manifest.save()
+    if skipped:
+        print(f"[SKIP] {len(skipped)} unchanged file(s) (use --force to reconvert)")
+    if not todo:
+        return
 
-        except Exception as e:
-            print(f"[WARN] Failed on {pdf.name} :: {e}")
+    def on_file(pdf: Path, r: Dict):
+        if r["page_errors"]:  # not recorded: retried on the next run
+            return
+        output = out / f"{pdf.stem}.txt" if r["status"] == "ok" else None
+        manifest.record(pdf, output, r["mode"], settings)
 
-    if processed == 0:
-        print("[INFO] No PDFs matched your filter.")
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    t0 = time.perf_counter()
+    results = convert_all(todo, out, workers, force_ocr=args.force_ocr, dpi=args.dpi, langs=args.langs,
+                          on_file=on_file)
+    print_summary(results, time.perf_counter() - t0, workers)
 
 if __name__ == "__main__":
     main()
@@ -1,32 +1,42 @@
 # tools/eval/eval_rag.py
 # ---------------------------------------------------------------
-# Simple offline evaluator for Macrocomm RAG
+# Offline evaluator for the Macrocomm RAG pipeline (server/api_server.py)
 # - Loads questions from eval/questions.jsonl
-# - Runs retrieval and full generation
-# - Scores: retrieval_hit@k, answer_keyword_score, latency_ms
-# - Optional LLM-as-judge with Gemini if GEMINI_API_KEY is set
+#     {"id": "...", "question": "...", "sources": ["FILE.txt", ...],
+#      "must_include": ["keyword", ...], "doc_hint": "substring"}   (sources/doc_hint optional)
+# - Builds the index with build_bm25_retriever() and runs each question through
+#   the /chat pipeline (_prepare_chat: retrieval -> context packing -> prompt),
+#   then a pluggable LLM backend:
+#     stub    deterministic, offline: extracts the context sentences that share
+#             the most terms with the question (default)
+#     openai  the server's call_openai() (needs OPENAI_API_KEY)
+#     pkg.module:Class  any class with  async generate(messages, temperature, top_p) -> str
+# - Questions run concurrently (bounded by --concurrency)
+# - Scores: hit@k, recall@k, MRR (by source file), keyword score, latency
+#   percentiles; optional LLM-as-judge with Gemini (--judge, needs GEMINI_API_KEY)
+# - Humour injection is skipped so keyword scores are reproducible
 #
 # Usage (PowerShell):
 #   conda activate macrocomm-rag
 #   python .\tools\eval\eval_rag.py
+#   python .\tools\eval\eval_rag.py --llm openai --k 8 --mode hybrid --concurrency 8
 #
 # Output:
-#   runtime/eval_YYYYMMDD_HHMMSS.csv  and a console summary
+#   runtime/eval_YYYYMMDD_HHMMSS.csv          one row per question
+#   runtime/eval_YYYYMMDD_HHMMSS_summary.csv  metric,value  (+ console summary)
 # ---------------------------------------------------------------
 
-import json, time, csv, re, os
+import sys, json, time, csv, re, os, asyncio, argparse, importlib
 from pathlib import Path
 from datetime import datetime
 
-# Import your pipeline pieces
-from data.ingestion import retriever  # your Chroma retriever
-from src.memory.store import MemoryStore
-from src.workflow.graph import app as agent_app  # LangGraph app
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
 
-MEM = MemoryStore()  # read/write same SQLite as server
+from server import api_server as api  # the shipped pipeline
 
-EVAL_FILE = Path("eval/questions.jsonl")
-RUNTIME   = Path("runtime"); RUNTIME.mkdir(exist_ok=True)
+EVAL_FILE = ROOT / "eval" / "questions.jsonl"
+RUNTIME   = ROOT / "runtime"
 
 K = int(os.getenv("EVAL_K", "5"))  # top-k for retrieval
 
@@ -40,32 +50,46 @@ def contains_all(text: str, must_include: list[str]) -> float:
     hits = sum(1 for term in must_include if normalize(term) in tx)
     return hits / len(must_include)
 
-def run_agent_with_memory(user_id: str, question: str) -> str:
-    """Same pattern you use in the server (memory-aware call)."""
-    mem_ctx = MEM.build_context_snippet(user_id=user_id, max_turns=8, max_chars=1600)
-    FORMAT_INSTRUCTION = (
-        "Format your final answer as a compact numbered checklist, one step per line. "
-        "Start each line with '1.', '2.', '3.' etc. Avoid long paragraphs."
-    )
-    if mem_ctx:
-        augmented = (
-            "Use the following user-specific context if relevant (do not repeat it verbatim):\n"
-            f"{mem_ctx}\n\n"
-            f"User question: {question.strip()}\n\n{FORMAT_INSTRUCTION}"
-        )
-    else:
-        augmented = f"{question.strip()}\n\n{FORMAT_INSTRUCTION}"
+def percentile(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+# ---- LLM backends ----------------------------------------------------------
+class StubLLM:
+    """Deterministic offline 'LLM': the context sentences with the most question terms."""
+    name = "stub"
+
+    def __init__(self, max_sentences: int = 3):
+        self.max_sentences = max_sentences
+
+    async def generate(self, messages, temperature: float, top_p: float) -> str:
+        prompt = messages[-1]["content"]
+        ctx = prompt.split("INTERNAL_CONTEXT:\n", 1)[-1].split("\n\nQUESTION:\n", 1)[0]
+        question = prompt.split("QUESTION:\n", 1)[-1].split("\n\nInstructions:", 1)[0]
+        q_terms = set(api._tokenise_norm(question))
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", ctx) if len(s.strip()) > 20]
+        ranked = sorted(enumerate(sentences),
+                        key=lambda p: (-len(q_terms & set(api._tokenise_norm(p[1]))), p[0]))
+        best = sorted(ranked[:self.max_sentences])  # back in context order
+        return " ".join(s for _, s in best) or "I don't know."
+
+class OpenAILLM:
+    """The server's own Chat Completions call."""
+    name = "openai"
+
+    async def generate(self, messages, temperature: float, top_p: float) -> str:
+        return await api.call_openai(messages, temperature=temperature, top_p=top_p)
 
-    result = None
-    for out in agent_app.stream(
-        {"question": augmented, "documents": [], "web_search": False, "generation": "", "traces": []}
-    ):
-        for _, v in out.items(): result = v
+LLM_BACKENDS = {"stub": StubLLM, "openai": OpenAILLM}
 
-    ans = result["generation"] if isinstance(result, dict) and "generation" in result else str(result)
-    MEM.add_message(user_id, "user", question)
-    MEM.add_message(user_id, "assistant", ans)
-    return ans
+def make_llm(spec: str):
+    if spec in LLM_BACKENDS:
+        return LLM_BACKENDS[spec]()
+    module, _, cls = spec.partition(":")
+    if not cls:
+        raise SystemExit(f"[eval] Unknown --llm {spec!r} (stub, openai or pkg.module:Class)")
+    return getattr(importlib.import_module(module), cls)()
 
 def optional_llm_judge(question: str, ref: list[str], answer: str) -> float | None:
     """
@@ -96,65 +120,142 @@ def optional_llm_judge(question: str, ref: list[str], answer: str) -> float | No
     except Exception:
         return None
 
-def main():
-    if not EVAL_FILE.exists():
-        print(f"[eval] Missing {EVAL_FILE}. Create it first (see README).")
-        return
+# ---- scoring -----------------------------------------------------------------
+def relevant(source: str, row: dict) -> bool:
+    expected = {normalize(s) for s in row.get("sources", [])}
+    hint = normalize(row.get("doc_hint", ""))
+    src = normalize(source)
+    return src in expected or bool(hint and hint in src)
 
-    rows = []
-    for line in EVAL_FILE.read_text(encoding="utf-8").splitlines():
-        if not line.strip(): continue
-        rows.append(json.loads(line))
+def retrieval_scores(citations: list[dict], row: dict, k: int) -> dict:
+    """hit@k / recall@k / reciprocal rank over the ranked chunk sources."""
+    ranked = [c["source"] for c in citations[:k]]
+    first = next((i for i, s in enumerate(ranked, 1) if relevant(s, row)), None)
+    expected = {normalize(s) for s in row.get("sources", [])}
+    if expected:
+        recall = len(expected & {normalize(s) for s in ranked}) / len(expected)
+    else:  # doc_hint only: any matching file counts as full recall
+        recall = 1.0 if first else 0.0
+    return {"hit": 1 if first else 0, "recall": recall, "rr": 1.0 / first if first else 0.0}
 
-    out_path = RUNTIME / f"eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    print(f"[eval] Loaded {len(rows)} questions; writing {out_path}")
+async def evaluate(row: dict, i: int, args, llm, sem: asyncio.Semaphore) -> dict:
+    qid = row.get("id", f"q{i}")
+    async with sem:
+        t0 = time.perf_counter()
+        turn = await asyncio.to_thread(api._prepare_chat, {
+            "message": row["question"], "k": args.k, "mode": args.mode,
+            "temperature": args.temperature, "top_p": args.top_p,
+        })
+        t1 = time.perf_counter()
+        try:
+            answer, error = await llm.generate(turn.messages, turn.temperature, turn.top_p), ""
+        except Exception as e:
+            answer, error = "", repr(e)
+        t2 = time.perf_counter()
+    judge = await asyncio.to_thread(optional_llm_judge, row["question"], row.get("must_include", []), answer) \
+        if args.judge and answer else None
+    return {
+        "id": qid,
+        **retrieval_scores(turn.citations, row, args.k),
+        "keyword": contains_all(answer, row.get("must_include", [])),
+        "judge": judge,
+        "context_tokens": turn.context["tokens"],
+        "retrieval_ms": round((t1 - t0) * 1000, 1),
+        "generation_ms": round((t2 - t1) * 1000, 1),
+        "latency_ms": round((t2 - t0) * 1000, 1),
+        "top_source": turn.citations[0]["source"] if turn.citations else "",
+        "error": error,
+    }
 
-    fields = ["id","retrieval_hit@"+str(K),"keyword_score","judge_score","latency_ms"]
-    with out_path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fields); w.writeheader()
+async def run(rows: list[dict], args) -> list[dict]:
+    llm = make_llm(args.llm)
+    sem = asyncio.Semaphore(args.concurrency)
+    try:
+        return await asyncio.gather(*[evaluate(r, i, args, llm, sem) for i, r in enumerate(rows, 1)])
+    finally:
+        await api._close_openai()
 
-        hits = 0; kw_sum = 0.0; judge_sum = 0.0; judge_count = 0; lat_sum = 0.0
-        for i, r in enumerate(rows, 1):
-            qid = r.get("id", f"q{i}")
-            q   = r["question"]
-            must = r.get("must_include", [])
-            hint = (r.get("doc_hint") or "").lower()
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", default=str(EVAL_FILE), help="JSONL question set")
+    ap.add_argument("--llm", default="stub", help="stub | openai | pkg.module:Class")
+    ap.add_argument("--k", type=int, default=K, help="top-k chunks (recall/MRR are @k)")
+    ap.add_argument("--mode", default=None, help="retrieval mode: bm25 | vector | hybrid")
+    ap.add_argument("--temperature", type=float, default=0.35)
+    ap.add_argument("--top-p", type=float, default=0.9)
+    ap.add_argument("--concurrency", type=int, default=4, help="questions in flight at once")
+    ap.add_argument("--judge", action="store_true", help="Gemini LLM-as-judge (needs GEMINI_API_KEY)")
+    ap.add_argument("--out", default=None, help="CSV path (default runtime/eval_<ts>.csv)")
+    args = ap.parse_args()
 
-            # --- retrieval ---
-            docs = retriever.vectorstore.similarity_search_with_score(q, k=K)
-            doc_paths = [getattr(d[0], "metadata", {}).get("source","").lower() for d in docs]
-            hit = any(hint and hint in p for p in doc_paths)
-            hit_val = 1 if hit else 0
+    eval_file = Path(args.questions)
+    if not eval_file.exists():
+        print(f"[eval] Missing {eval_file}. Create it first (see header of this script).")
+        return
 
-            # --- generation ---
-            t0 = time.perf_counter()
-            ans = run_agent_with_memory("eval:user", q)
-            latency_ms = round((time.perf_counter() - t0) * 1000, 1)
+    rows = []
+    for line in eval_file.read_text(encoding="utf-8").splitlines():
+        if not line.strip(): continue
+        rows.append(json.loads(line))
 
-            kw = contains_all(ans, must)
+    t0 = time.perf_counter()
+    api._publish(api.build_bm25_retriever().index)
+    build_ms = round((time.perf_counter() - t0) * 1000, 1)
 
-            judge = optional_llm_judge(q, must, ans)
-            if judge is not None:
-                judge_sum += judge; judge_count += 1
+    RUNTIME.mkdir(exist_ok=True)
+    out_path = Path(args.out) if args.out else RUNTIME / f"eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    print(f"[eval] Loaded {len(rows)} questions; llm={args.llm} k={args.k} "
+          f"mode={args.mode or api.RETRIEVAL_MODE} concurrency={args.concurrency}; writing {out_path}")
 
-            lat_sum += latency_ms
-            hits += hit_val; kw_sum += kw
+    t0 = time.perf_counter()
+    results = asyncio.run(run(rows, args))
+    wall_s = time.perf_counter() - t0
 
+    fields = ["id", f"hit@{args.k}", f"recall@{args.k}", "rr", "keyword_score", "judge_score",
+              "context_tokens", "retrieval_ms", "generation_ms", "latency_ms", "top_source", "error"]
+    with out_path.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fields); w.writeheader()
+        for r in results:
             w.writerow({
-                "id": qid,
-                "retrieval_hit@"+str(K): hit_val,
-                "keyword_score": round(kw, 3),
-                "judge_score": ("" if judge is None else round(judge, 3)),
-                "latency_ms": latency_ms
+                "id": r["id"], f"hit@{args.k}": r["hit"], f"recall@{args.k}": round(r["recall"], 3),
+                "rr": round(r["rr"], 3), "keyword_score": round(r["keyword"], 3),
+                "judge_score": ("" if r["judge"] is None else round(r["judge"], 3)),
+                "context_tokens": r["context_tokens"], "retrieval_ms": r["retrieval_ms"],
+                "generation_ms": r["generation_ms"], "latency_ms": r["latency_ms"],
+                "top_source": r["top_source"], "error": r["error"],
             })
 
-    n = len(rows)
+    n = len(results)
+    judged = [r["judge"] for r in results if r["judge"] is not None]
+    lat = [r["latency_ms"] for r in results]
+    ret = [r["retrieval_ms"] for r in results]
+    summary = {
+        "questions": n,
+        "llm": args.llm,
+        "mode": args.mode or api.RETRIEVAL_MODE,
+        f"hit@{args.k}": round(sum(r["hit"] for r in results) / n, 4),
+        f"recall@{args.k}": round(sum(r["recall"] for r in results) / n, 4),
+        "mrr": round(sum(r["rr"] for r in results) / n, 4),
+        "keyword_score": round(sum(r["keyword"] for r in results) / n, 4),
+        "judge_score": round(sum(judged) / len(judged), 4) if judged else "",
+        "errors": sum(1 for r in results if r["error"]),
+        "latency_p50_ms": percentile(lat, 0.50),
+        "latency_p95_ms": percentile(lat, 0.95),
+        "latency_p99_ms": percentile(lat, 0.99),
+        "retrieval_p50_ms": percentile(ret, 0.50),
+        "retrieval_p95_ms": percentile(ret, 0.95),
+        "index_build_ms": build_ms,
+        "wall_s": round(wall_s, 2),
+    }
+    summary_path = out_path.with_name(out_path.stem + "_summary.csv")
+    with summary_path.open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f); w.writerow(["metric", "value"])
+        for key, value in summary.items():
+            w.writerow([key, value])
+
     print("\n[eval] Summary")
-    print(f"  Retrieval hit@{K}: {hits}/{n} = {hits/n:.2f}")
-    print(f"  Keyword score   : {kw_sum/n:.2f}")
-    if judge_count:
-        print(f"  Judge score     : {judge_sum/judge_count:.2f} (on {judge_count} judged)")
-    print(f"  Avg latency     : {lat_sum/n:.1f} ms")
+    for key, value in summary.items():
+        print(f"  {key:<17}: {value}")
     print(f"\n[eval] Done → {out_path}")
 
 if __name__ == "__main__":
@@ -3,6 +3,9 @@
 tools/pdf_ocr_to_txt.py
 -----------------------
 OCR-only pass for PDFs (useful if you want to force OCR and skip structured parsing).
+Shares the content-hash manifest with corp_to_txt.py (convert_manifest.py):
+unchanged sources are skipped, outputs of deleted sources are removed, and
+--force reconverts everything.
 
 USAGE:
   python tools/pdf_ocr_to_txt.py --src corp_docs --out corp_docs/txt
@@ -10,14 +13,16 @@ USAGE:
 """
 
 from __future__ import annotations
-import os, io, argparse, platform
+import os, time, argparse, platform
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 import fitz
 from PIL import Image
 import pytesseract
 
+from convert_manifest import ConversionManifest
+
 def _wire_tesseract():
     if platform.system().lower() != "windows":
         return
@@ -36,14 +41,25 @@ def _wire_tesseract():
             break
 _wire_tesseract()
 
-def ocr_pdf(pdf: Path, dpi: int = 300, langs: str = "eng") -> str:
+# <80 -> black, >200 -> white, rest kept
+_THRESHOLD_LUT = [255 if x > 200 else (0 if x < 80 else x) for x in range(256)]
+
+def ocr_pdf(pdf: Path, dpi: int = 300, langs: str = "eng", stages: Optional[Dict[str, float]] = None) -> str:
+    """OCR every page; grayscale pixmap samples go straight to Pillow (no PNG round-trip)."""
+    stages = {} if stages is None else stages
     doc = fitz.open(pdf)
     parts = []
     for p in doc:
-        pix = p.get_pixmap(matrix=fitz.Matrix(dpi/72.0, dpi/72.0), alpha=False)
-        img = Image.open(io.BytesIO(pix.tobytes("png"))).convert("L")
-        img = img.point(lambda x: 255 if x > 200 else (0 if x < 80 else x))
+        t0 = time.perf_counter()
+        pix = p.get_pixmap(matrix=fitz.Matrix(dpi/72.0, dpi/72.0), colorspace=fitz.csGRAY, alpha=False)
+        t1 = time.perf_counter()
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride)
+        img = img.point(_THRESHOLD_LUT)
+        t2 = time.perf_counter()
         parts.append(pytesseract.image_to_string(img, lang=langs, config="--oem 1 --psm 3").strip())
+        t3 = time.perf_counter()
+        for stage, t in (("render", t1 - t0), ("preprocess", t2 - t1), ("ocr", t3 - t2)):
+            stages[stage] = stages.get(stage, 0.0) + t
     return "\n\n".join([t for t in parts if t])
 
 def should_process(file_name: str, only: Optional[str]) -> bool:
@@ -56,26 +72,44 @@ def main():
     ap.add_argument("--dpi", type=int, default=300)
     ap.add_argument("--langs", default="eng")
     ap.add_argument("--only", default=None)
+    ap.add_argument("--force", action="store_true", help="Reconvert every file, even if unchanged")
     args = ap.parse_args()
 
     src = Path(args.src).resolve()
     out = Path(args.out).resolve()
     out.mkdir(parents=True, exist_ok=True)
 
-    processed = 0
-    for pdf in sorted(src.glob("*.pdf")):
-        if not should_process(pdf.name, args.only):
-            continue
+    manifest = ConversionManifest(out)
+    settings = {"mode": "ocr", "dpi": args.dpi, "langs": args.langs}
+    all_pdfs = sorted(src.glob("*.pdf"))
+    if not args.only:
+        for name in manifest.prune([pdf.name for pdf in all_pdfs]):
+            print(f"[CLEAN] Removed {name} (source deleted)")
+    pdfs = [pdf for pdf in all_pdfs if should_process(pdf.name, args.only)]
+    if args.only:
+        pdfs = pdfs[:1]
+    todo, skipped = manifest.plan(pdfs, settings, force=args.force)
+    manifest.save()
+    if skipped:
+        print(f"[SKIP] {len(skipped)} unchanged file(s) (use --force to reconvert)")
+
+    processed = len(skipped)
+    totals: Dict[str, float] = {}
+    for pdf in todo:
         try:
-            txt = ocr_pdf(pdf, dpi=args.dpi, langs=args.langs)
+            stages: Dict[str, float] = {}
+            txt = ocr_pdf(pdf, dpi=args.dpi, langs=args.langs, stages=stages)
             (out / (pdf.stem + ".txt")).write_text(txt, encoding="utf-8", errors="ignore")
-            print(f"[OK] OCR -> TXT: {pdf.name}")
+            manifest.record(pdf, out / (pdf.stem + ".txt"), "ocr", settings)
+            for stage, t in stages.items():
+                totals[stage] = totals.get(stage, 0.0) + t
+            print(f"[OK] OCR -> TXT: {pdf.name}  [" + ", ".join(f"{k} {v:.2f}s" for k, v in stages.items()) + "]")
             processed += 1
-            if args.only:
-                break
         except Exception as e:
             print(f"[WARN] OCR failed on {pdf.name} :: {e}")
 
+    if totals:
+        print("[STAGES] " + ", ".join(f"{k} {v:.2f}s" for k, v in totals.items()))
     if processed == 0:
         print("[INFO] No PDFs matched your filter.")
 